@@ -0,0 +1,169 @@
+"""
+CompileBenchmark - torch.compile engine: precompile time, latency, recompiles and binary-mask IoU
+
+Loads StencilGenerator(engine="compile") (see StencilCompile), precompiles the
+buckets for one resolution, then runs the same seeded generations as an eager
+generator and compares latency and the cleaned binary stencils (IoU of the
+black pixels). It also generates at a few off-bucket sizes and reports how
+many graphs were compiled after precompile(), which should be 0.
+
+The compile cache persists in --compile-dir, so run the benchmark twice: the
+first run pays the full compile ("cold"), the second loads the cached
+kernels and only re-traces ("warm"), which is what a restarted server pays.
+
+Without --model/--checkpoint, the tiny random-weight pipeline is used.
+
+Usage:
+    python CompileBenchmark.py --compile-dir /tmp/stencil-compile     # offline, run twice
+    python CompileBenchmark.py --model Manojb/stable-diffusion-2-1-base \\
+        --checkpoint ../Fine-tuning/checkpoint-1000 --steps 25 --resolution 512
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from Stencil import DEFAULT_COMPILE_DIR, StencilGenerator
+from StencilCompile import ARTIFACTS
+
+from DecoderBenchmark import mask_iou
+from StencilBenchmark import PROMPTS, time_call
+from TinyModels import TinyStencilGenerator
+
+# Requested sizes that have to snap onto the precompiled bucket: (width scale, height scale)
+OFF_BUCKET_SIZES = ((1.125, 1.0), (1.0, 0.875), (0.875, 0.875))
+
+
+def generation_case(generator, args) -> tuple:
+    """
+    Time seeded generations on a loaded generator.
+
+    Args:
+        generator: StencilGenerator to run
+        args: Parsed command-line arguments
+
+    Returns:
+        Tuple of (timing dict for one image, uint8 stencil stack for PROMPTS)
+    """
+    options = dict(num_inference_steps=args.steps, width=args.resolution, height=args.resolution)
+    timing = time_call(lambda: generator.generate(PROMPTS[0], seed=0, **options), repeats=args.repeats, min_seconds=0)
+    stencils = np.stack([np.array(generator.generate(prompt, seed=i, **options)) for i, prompt in enumerate(PROMPTS)])
+    return timing, stencils
+
+
+def compile_case(generator_class, source: dict, args) -> dict:
+    """
+    Load, precompile and time one model with the compile engine.
+
+    Args:
+        generator_class: StencilGenerator or TinyStencilGenerator
+        source: Generator keyword arguments selecting the model
+        args: Parsed command-line arguments
+
+    Returns:
+        Dictionary with the cache state, load and precompile seconds, latency,
+        compile stats and the stencil stack
+    """
+    warm = os.path.exists(os.path.join(args.compile_dir, ARTIFACTS))
+    start = time.perf_counter()
+    generator = generator_class(
+        device="cpu",
+        use_fp16=False,
+        engine="compile",
+        compile_dir=args.compile_dir,
+        compile_resolutions=[(args.resolution, args.resolution)],
+        **source,
+    )
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    generator.precompile(max_images=1)
+    precompile_seconds = time.perf_counter() - start
+
+    timing, stencils = generation_case(generator, args)
+    for width_scale, height_scale in OFF_BUCKET_SIZES:
+        width = int(args.resolution * width_scale) // 8 * 8
+        height = int(args.resolution * height_scale) // 8 * 8
+        generator.generate(PROMPTS[0], seed=0, num_inference_steps=args.steps, width=width, height=height)
+
+    entry = {
+        "cache": "warm" if warm else "cold",
+        "load_seconds": load_seconds,
+        "precompile_seconds": precompile_seconds,
+        "latency": timing,
+        "stats": generator.compile_stats(),
+        "stencils": stencils,
+    }
+    del generator
+    gc.collect()
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="torch.compile engine compile time, latency and stencil IoU")
+    parser.add_argument("--model", default=None, help="HuggingFace model ID of the base model")
+    parser.add_argument("--checkpoint", nargs="*", default=[], help="Fine-tuned checkpoints to compare as well")
+    parser.add_argument("--resolution", type=int, default=64, help="Image size in pixels (the precompiled bucket)")
+    parser.add_argument("--steps", type=int, default=10, help="Denoising steps")
+    parser.add_argument("--compile-dir", default=DEFAULT_COMPILE_DIR, help="Persistent compile cache directory")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per case")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    real = args.model is not None or bool(args.checkpoint)
+    if real:
+        generator_class = StencilGenerator
+        sources = {args.model: dict(model_id=args.model)} if args.model else {}
+        for checkpoint in args.checkpoint:
+            sources[os.path.basename(os.path.normpath(checkpoint))] = dict(checkpoint_path=checkpoint)
+    else:
+        generator_class = TinyStencilGenerator
+        sources = {"tiny": dict(model_id="tiny")}
+
+    report = {}
+    for name, source in sources.items():
+        eager = generator_class(device="cpu", use_fp16=False, **source)
+        eager_timing, eager_stencils = generation_case(eager, args)
+        del eager
+        gc.collect()
+
+        entry = compile_case(generator_class, source, args)
+        iou = mask_iou(eager_stencils, entry.pop("stencils"))
+        entry.update(
+            eager_latency=eager_timing,
+            speedup=eager_timing["median_ms"] / entry["latency"]["median_ms"],
+            iou_mean=float(iou.mean()),
+            iou_min=float(iou.min()),
+        )
+        report[name] = entry
+
+    print(
+        f"\n{'model':<28}{'cache':<7}{'load s':>8}{'compile s':>11}{'eager ms':>10}{'compiled ms':>13}"
+        f"{'speedup':>9}{'recompiles':>12}{'mean IoU':>10}"
+    )
+    for name, entry in report.items():
+        print(
+            f"{name[:27]:<28}{entry['cache']:<7}{entry['load_seconds']:>8.1f}{entry['precompile_seconds']:>11.1f}"
+            f"{entry['eager_latency']['median_ms']:>10.1f}{entry['latency']['median_ms']:>13.1f}"
+            f"{entry['speedup']:>8.2f}x{entry['stats']['recompiles']:>12}{entry['iou_mean']:>10.3f}"
+        )
+
+    if not real:
+        print("\nRandom weights: stencil IoU on real stencils needs --model/--checkpoint")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+DecoderBenchmark - Full SD VAE vs tiny distilled decoder: latency and binary-mask IoU
+
+Decodes the same final latents with StencilGenerator's "full" and "tiny"
+decoders, times each, and compares the cleaned binary stencils: the IoU of
+the black (subject) pixels of the tiny decoder's stencil against the full
+decoder's.
+
+Without --model, both decoders have the real architectures (SD VAE and TAESD)
+but random weights and decode random latents, so only the latencies mean
+anything. With --model (and a --tiny-vae path for offline use), latents come
+from real generations and the IoU shows how much the stencils change.
+
+Usage:
+    python DecoderBenchmark.py                                   # latency only, offline
+    python DecoderBenchmark.py --model Manojb/stable-diffusion-2-1-base --tiny-vae ./taesd
+    python DecoderBenchmark.py --checkpoint ../Fine-tuning/checkpoint-1000 --resolutions 512 768 1024
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import List
+
+import numpy as np
+import torch
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from Stencil import DEFAULT_TINY_VAE, GenerationRequest, StencilGenerator, _rgb_to_gray, clean_stencil_batch
+
+from StencilBenchmark import PROMPTS, time_call
+from TinyModels import sd_sized_tiny_vae, sd_sized_vae, tiny_generator
+
+
+def mask_iou(reference: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """
+    Intersection over union of the black (subject) pixels of two stencil stacks.
+
+    Args:
+        reference: uint8 stencils of shape (N, H, W) with 0 for the subject
+        candidate: uint8 stencils of the same shape
+
+    Returns:
+        Array of N IoU values (1.0 where both stencils are empty)
+    """
+    a = reference == 0
+    b = candidate == 0
+    intersection = (a & b).sum(axis=(1, 2))
+    union = (a | b).sum(axis=(1, 2))
+    return np.where(union > 0, intersection / np.maximum(union, 1), 1.0)
+
+
+def final_latents(generator: StencilGenerator, prompts: List[str], size: int, steps: int) -> torch.Tensor:
+    """Run the denoising loop for each prompt (seeded) and return the stacked final latents."""
+    requests = [GenerationRequest(prompt=prompt, seed=index) for index, prompt in enumerate(prompts)]
+    prompt_embeds, negative_prompt_embeds, guidance_scales, latents, scheduler_generator = (
+        generator._prepare_batch(requests, size, size)
+    )
+    with generator._inference_context():
+        for step in generator._iter_denoise(
+            prompt_embeds, negative_prompt_embeds, guidance_scales, latents, steps, generator=scheduler_generator
+        ):
+            pass
+    return step.latents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full vs tiny VAE decoder latency and stencil IoU")
+    parser.add_argument("--model", default=None, help="HuggingFace model ID (default: random SD-sized decoders)")
+    parser.add_argument("--checkpoint", default=None, help="Fine-tuned checkpoint to use instead of --model")
+    parser.add_argument("--tiny-vae", default=DEFAULT_TINY_VAE, help="Local path or model ID of the tiny decoder")
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[256, 512], help="Image sizes in pixels")
+    parser.add_argument("--steps", type=int, default=25, help="Denoising steps for real-model latents")
+    parser.add_argument("--repeats", type=int, default=2, help="Timed decodes per case")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    real = args.model is not None or args.checkpoint is not None
+    if real:
+        generator = StencilGenerator(
+            model_id=args.model or "Manojb/stable-diffusion-2-1-base",
+            checkpoint_path=args.checkpoint,
+            tiny_vae_path=args.tiny_vae,
+        )
+        generator.set_decoder("tiny")
+    else:
+        torch.manual_seed(0)
+        generator = tiny_generator()
+        generator.pipe.vae = sd_sized_vae()
+        generator._tiny_vae = sd_sized_tiny_vae()
+
+    report = {}
+    print(f"{'case':<14}{'full ms':>10}{'tiny ms':>10}{'speedup':>9}{'mean IoU':>10}{'min IoU':>9}")
+    for size in args.resolutions:
+        if real:
+            latents = final_latents(generator, PROMPTS, size, args.steps)
+        else:
+            latents = torch.randn(len(PROMPTS), 4, size // 8, size // 8)
+
+        timings, stencils = {}, {}
+        for decoder in ("full", "tiny"):
+            generator.set_decoder(decoder)
+            with generator._inference_context():
+                # One image per decode, as in an interactive request
+                timings[decoder] = time_call(lambda: generator._decode_latents(latents[:1]), repeats=args.repeats, min_seconds=0)
+                pixels = generator._decode_latents(latents)
+            stencils[decoder] = clean_stencil_batch(_rgb_to_gray(pixels))
+
+        iou = mask_iou(stencils["full"], stencils["tiny"])
+        speedup = timings["full"]["median_ms"] / timings["tiny"]["median_ms"]
+        report[f"{size}px"] = {
+            "full": timings["full"],
+            "tiny": timings["tiny"],
+            "speedup": speedup,
+            "iou_mean": float(iou.mean()) if real else None,
+            "iou_min": float(iou.min()) if real else None,
+        }
+        iou_columns = f"{iou.mean():>10.3f}{iou.min():>9.3f}" if real else f"{'-':>10}{'-':>9}"
+        print(f"{size}px{'':<9}{timings['full']['median_ms']:>10.1f}{timings['tiny']['median_ms']:>10.1f}{speedup:>8.1f}x{iou_columns}")
+
+    if not real:
+        print("\nRandom weights: IoU needs --model/--checkpoint (and a real --tiny-vae)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
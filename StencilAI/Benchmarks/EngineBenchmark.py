@@ -0,0 +1,180 @@
+"""
+EngineBenchmark - torch vs ONNX Runtime engines: latency and binary-mask IoU
+
+Runs the same seeded generations with StencilGenerator(engine="torch") and
+engine="onnx" (see StencilOnnx) on the base model and on each fine-tuned
+checkpoint, and compares the cleaned binary stencils: the IoU of the black
+(subject) pixels of the ONNX stencils against the torch ones. The first
+ONNX run of a model includes the export; it is reported separately as load
+time and doesn't count against the latencies.
+
+Without --model/--checkpoint, the tiny random-weight pipeline is used end to
+end, plus optionally one CFG step of a randomly initialised SD-architecture
+UNet (--unet-width 320 for the real size). ONNX Runtime materializes the
+attention matrices, so at 512px that step needs a few GB more than torch.
+
+Usage:
+    python EngineBenchmark.py                                  # offline
+    python EngineBenchmark.py --unet-width 64 --resolution 256
+    python EngineBenchmark.py --model Manojb/stable-diffusion-2-1-base \\
+        --checkpoint ../Fine-tuning/checkpoint-1000 --steps 25
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from Stencil import DEFAULT_ONNX_DIR, ENGINES, StencilGenerator
+from StencilOnnx import OnnxUNet, _session, export_component
+
+from DecoderBenchmark import mask_iou
+from StencilBenchmark import PROMPTS, time_call
+from TinyModels import TinyStencilGenerator, sd_sized_unet
+
+
+def generation_case(generator_class, source: dict, engine: str, args) -> tuple:
+    """
+    Time seeded generations on one model with one engine.
+
+    Args:
+        generator_class: StencilGenerator or TinyStencilGenerator
+        source: Generator keyword arguments selecting the model
+        engine: Engine to load the generator with
+        args: Parsed command-line arguments
+
+    Returns:
+        Tuple of (load seconds, timing dict for one image, uint8 stencil stack for PROMPTS)
+    """
+    start = time.perf_counter()
+    generator = generator_class(device="cpu", use_fp16=False, engine=engine, onnx_dir=args.onnx_dir, **source)
+    load_seconds = time.perf_counter() - start
+
+    options = dict(num_inference_steps=args.steps, width=args.resolution, height=args.resolution)
+    timing = time_call(lambda: generator.generate(PROMPTS[0], seed=0, **options), repeats=args.repeats, min_seconds=0)
+    stencils = np.stack([np.array(generator.generate(prompt, seed=i, **options)) for i, prompt in enumerate(PROMPTS)])
+    del generator
+    gc.collect()
+    return load_seconds, timing, stencils
+
+
+def unet_step_case(args) -> dict:
+    """
+    Time one CFG step of a random SD-architecture UNet in torch and in ONNX Runtime.
+
+    Args:
+        args: Parsed command-line arguments
+
+    Returns:
+        Dictionary with torch and onnx timings and the maximum absolute difference
+    """
+    torch.manual_seed(0)
+    width = args.unet_width
+    unet = sd_sized_unet((width, width * 2, width * 4, width * 4))
+
+    size = args.resolution // 8
+    generator = torch.Generator().manual_seed(0)
+    latents = torch.randn(2, 4, size, size, generator=generator)
+    embeds = torch.randn(2, 77, 768, generator=generator)
+    timestep = torch.tensor(500)
+
+    with torch.no_grad():
+        torch_timing = time_call(lambda: unet(latents, timestep, encoder_hidden_states=embeds), repeats=args.repeats, min_seconds=0)
+        reference = unet(latents, timestep, encoder_hidden_states=embeds).sample
+
+    with tempfile.TemporaryDirectory(prefix="unet-onnx-") as path:
+        start = time.perf_counter()
+        export_component("unet", unet, os.path.join(path, "unet"))
+        export_seconds = time.perf_counter() - start
+        config = unet.config
+        del unet
+        gc.collect()
+
+        onnx_unet = OnnxUNet(_session(os.path.join(path, "unet")), config)
+        onnx_timing = time_call(lambda: onnx_unet(latents, timestep, encoder_hidden_states=embeds), repeats=args.repeats, min_seconds=0)
+        output = onnx_unet(latents, timestep, encoder_hidden_states=embeds).sample
+
+    return {
+        "torch": torch_timing,
+        "onnx": onnx_timing,
+        "export_seconds": export_seconds,
+        "max_abs_diff": float((output - reference).abs().max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="torch vs ONNX Runtime latency and stencil IoU")
+    parser.add_argument("--model", default=None, help="HuggingFace model ID of the base model")
+    parser.add_argument("--checkpoint", nargs="*", default=[], help="Fine-tuned checkpoints to compare as well")
+    parser.add_argument("--resolution", type=int, default=256, help="Image size in pixels")
+    parser.add_argument("--steps", type=int, default=10, help="Denoising steps")
+    parser.add_argument("--unet-width", type=int, default=0, help="First-level channels of the offline UNet step (SD: 320, 0 to skip)")
+    parser.add_argument("--onnx-dir", default=DEFAULT_ONNX_DIR, help="Cache directory for the exported graphs")
+    parser.add_argument("--repeats", type=int, default=2, help="Timed runs per case")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    real = args.model is not None or bool(args.checkpoint)
+    if real:
+        generator_class = StencilGenerator
+        sources = {args.model: dict(model_id=args.model)} if args.model else {}
+        for checkpoint in args.checkpoint:
+            sources[os.path.basename(os.path.normpath(checkpoint))] = dict(checkpoint_path=checkpoint)
+    else:
+        generator_class = TinyStencilGenerator
+        sources = {"tiny": dict(model_id="tiny")}
+
+    report = {}
+    for name, source in sources.items():
+        report[name] = {}
+        for engine in ENGINES:
+            load_seconds, timing, stencils = generation_case(generator_class, source, engine, args)
+            entry = {"load_seconds": load_seconds, "latency": timing, "stencils": stencils}
+            if engine != "torch":
+                iou = mask_iou(report[name]["torch"]["stencils"], stencils)
+                entry.update(
+                    speedup=report[name]["torch"]["latency"]["median_ms"] / timing["median_ms"],
+                    iou_mean=float(iou.mean()),
+                    iou_min=float(iou.min()),
+                )
+            report[name][engine] = entry
+
+    print(f"\n{'model':<28}{'engine':<8}{'load s':>8}{'ms/image':>10}{'speedup':>9}{'mean IoU':>10}{'min IoU':>9}")
+    for name, engines in report.items():
+        for engine, entry in engines.items():
+            entry.pop("stencils")
+            if engine == "torch":
+                columns = f"{'-':>9}{'-':>10}{'-':>9}"
+            else:
+                columns = f"{entry['speedup']:>8.2f}x{entry['iou_mean']:>10.3f}{entry['iou_min']:>9.3f}"
+            print(f"{name[:27]:<28}{engine:<8}{entry['load_seconds']:>8.1f}{entry['latency']['median_ms']:>10.1f}{columns}")
+
+    if not real and args.unet_width:
+        step = unet_step_case(args)
+        report[f"unet-{args.unet_width}-step"] = step
+        print(
+            f"\nUNet step (width {args.unet_width}, {args.resolution}px, CFG batch 2): "
+            f"torch {step['torch']['median_ms']:.0f} ms, onnx {step['onnx']['median_ms']:.0f} ms "
+            f"(export {step['export_seconds']:.0f}s, max abs diff {step['max_abs_diff']:.1e})"
+        )
+
+    if not real:
+        print("\nRandom weights: stencil IoU on real stencils needs --model/--checkpoint")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+GuidanceBenchmark - Guidance schedules: latency, guided steps and binary-mask IoU
+
+Runs the same seeded generations with each classifier-free guidance schedule
+(see GUIDANCE_SCHEDULES in Stencil) on the base model and on each fine-tuned
+checkpoint, and compares the cleaned binary stencils against full guidance:
+the IoU of the black (subject) pixels. Every step without guidance runs the
+UNet on half the batch, so the guided step count is the UNet work saved.
+
+The "off" schedule only runs on checkpoint models (which have no default
+negative prompt). Without --model/--checkpoint, the tiny random-weight
+pipeline is used both ways; its latencies are dominated by decoding, and
+its random predictions agree early, so only the real models say much.
+
+Usage:
+    python GuidanceBenchmark.py                                  # offline
+    python GuidanceBenchmark.py --model Manojb/stable-diffusion-2-1-base \\
+        --checkpoint ../Fine-tuning/checkpoint-1000 --steps 25
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+
+import numpy as np
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from Stencil import GUIDED_STEPS_KEY, StencilGenerator
+
+from DecoderBenchmark import mask_iou
+from StencilBenchmark import PROMPTS, time_call
+from TinyModels import TinyStencilGenerator
+
+# (label, guidance_schedule, guidance_cutoff)
+SCHEDULES = [
+    ("full", "full", None),
+    ("truncate-0.5", "truncate", 0.5),
+    ("truncate-0.3", "truncate", 0.3),
+    ("adaptive-0.99", "adaptive", 0.99),
+    ("adaptive-0.95", "adaptive", 0.95),
+    ("off", "off", None),
+]
+
+
+def schedule_case(generator, schedule: str, cutoff, args) -> tuple:
+    """
+    Time seeded generations with one guidance schedule.
+
+    Args:
+        generator: Loaded StencilGenerator
+        schedule: guidance_schedule to run with
+        cutoff: guidance_cutoff to run with
+        args: Parsed command-line arguments
+
+    Returns:
+        Tuple of (timing dict for one image, mean guided steps over PROMPTS, uint8 stencil stack for PROMPTS)
+    """
+    options = dict(
+        num_inference_steps=args.steps,
+        width=args.resolution,
+        height=args.resolution,
+        guidance_schedule=schedule,
+        guidance_cutoff=cutoff,
+    )
+    timing = time_call(lambda: generator.generate(PROMPTS[0], seed=0, **options), repeats=args.repeats, min_seconds=0)
+    stencils, guided_steps = [], []
+    for i, prompt in enumerate(PROMPTS):
+        image = generator.generate(prompt, seed=i, **options)
+        stencils.append(np.array(image))
+        guided_steps.append(image.info[GUIDED_STEPS_KEY])
+    return timing, float(np.mean(guided_steps)), np.stack(stencils)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Guidance schedule latency and stencil IoU")
+    parser.add_argument("--model", default=None, help="HuggingFace model ID of the base model")
+    parser.add_argument("--checkpoint", nargs="*", default=[], help="Fine-tuned checkpoints to compare as well")
+    parser.add_argument("--resolution", type=int, default=256, help="Image size in pixels")
+    parser.add_argument("--steps", type=int, default=25, help="Denoising steps")
+    parser.add_argument("--repeats", type=int, default=2, help="Timed runs per case")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    real = args.model is not None or bool(args.checkpoint)
+    if real:
+        generator_class = StencilGenerator
+        sources = {args.model: dict(model_id=args.model)} if args.model else {}
+        for checkpoint in args.checkpoint:
+            sources[os.path.basename(os.path.normpath(checkpoint))] = dict(checkpoint_path=checkpoint)
+    else:
+        generator_class = TinyStencilGenerator
+        sources = {"tiny": dict(model_id="tiny"), "tiny-checkpoint": dict(checkpoint_path="tiny")}
+
+    report = {}
+    for name, source in sources.items():
+        generator = generator_class(device="cpu", use_fp16=False, **source)
+        report[name] = {}
+        reference = None
+        for label, schedule, cutoff in SCHEDULES:
+            if schedule == "off" and not generator.is_checkpoint_model:
+                continue
+            timing, guided_steps, stencils = schedule_case(generator, schedule, cutoff, args)
+            reference = stencils if reference is None else reference
+            iou = mask_iou(reference, stencils)
+            report[name][label] = {
+                "latency": timing,
+                "guided_steps": guided_steps,
+                "speedup": report[name]["full"]["latency"]["median_ms"] / timing["median_ms"] if label != "full" else 1.0,
+                "iou_mean": float(iou.mean()),
+                "iou_min": float(iou.min()),
+            }
+        del generator
+        gc.collect()
+
+    print(f"\n{'model':<28}{'schedule':<15}{'ms/image':>10}{'speedup':>9}{'guided':>8}{'mean IoU':>10}{'min IoU':>9}")
+    for name, entries in report.items():
+        for label, entry in entries.items():
+            print(
+                f"{name[:27]:<28}{label:<15}{entry['latency']['median_ms']:>10.1f}{entry['speedup']:>8.2f}x"
+                f"{entry['guided_steps']:>8.1f}{entry['iou_mean']:>10.3f}{entry['iou_min']:>9.3f}"
+            )
+
+    if not real:
+        print("\nRandom weights: stencil IoU on real stencils needs --model/--checkpoint")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
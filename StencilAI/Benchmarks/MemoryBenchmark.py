@@ -0,0 +1,86 @@
+"""
+MemoryBenchmark - Peak memory and latency of each memory-saving configuration
+
+Runs the same generation under every StencilGenerator MemoryPlan (attention
+slicing, VAE slicing, sequential classifier-free guidance, VAE tiling and,
+on CUDA, model offloading), reporting peak memory (VRAM on CUDA, process RSS
+on CPU), the planner's estimate and the latency of each. With --budget-mb it
+also shows which plan the generator picks for that budget.
+
+Usage:
+    python MemoryBenchmark.py                                  # tiny random model on CPU
+    python MemoryBenchmark.py --resolution 1024 --images 4 --budget-mb 3000
+    python MemoryBenchmark.py --model Manojb/stable-diffusion-2-1-base --resolution 1024 --images 4
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from Stencil import MEMORY_PLANS, GenerationRequest, StencilGenerator
+from StencilMetrics import metrics
+
+from StencilBenchmark import PROMPTS
+from TinyModels import tiny_generator
+
+
+def run_plan(generator: StencilGenerator, plan, args) -> dict:
+    """Generate once under a fixed plan and return its memory report and latency."""
+    generator.memory_plan = plan
+    request = GenerationRequest(prompt=PROMPTS[0], num_images=args.images, seed=0)
+    start = time.perf_counter()
+    # Each run is a request of its own, which restarts the CUDA peak
+    with metrics.request("memory_plan", plan=plan.describe()):
+        generator.generate_batch([request], num_inference_steps=args.steps, width=args.resolution, height=args.resolution)
+    report = dict(generator.last_memory_report)
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory per memory-saving configuration")
+    parser.add_argument("--model", default=None, help="HuggingFace model ID (default: tiny random model on CPU)")
+    parser.add_argument("--resolution", type=int, default=512, help="Image size in pixels")
+    parser.add_argument("--images", type=int, default=2, help="Images per batch")
+    parser.add_argument("--steps", type=int, default=4, help="Denoising steps")
+    parser.add_argument("--budget-mb", type=float, default=None, help="Also show the plan chosen for this budget")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    generator = StencilGenerator(model_id=args.model) if args.model else tiny_generator()
+    cuda = str(generator.device).startswith("cuda")
+
+    # One unmeasured run first, so one-off allocations don't count against the first plan
+    run_plan(generator, MEMORY_PLANS[0], args)
+
+    # Every plan is measured, including attention slicing the planner skips when fused attention is available
+    report = {}
+    for plan in MEMORY_PLANS:
+        if plan.offload and not cuda:
+            continue
+        report[plan.describe()] = run_plan(generator, plan, args)
+
+    print(f"\n{'memory plan':<72}{'estimate MB':>12}{'peak MB':>10}{'seconds':>9}")
+    for name, result in report.items():
+        extra = result["peak_mb"] - result["baseline_mb"]
+        print(f"{name:<72}{result['estimate_mb']:>12.0f}{result['peak_mb']:>10.0f}{result['seconds']:>9.2f}  (+{extra:.0f} MB)")
+
+    if args.budget_mb is not None:
+        generator.memory_plan = None
+        generator.memory_budget_mb = args.budget_mb
+        plan, estimate = generator.choose_memory_plan(args.images, args.resolution, args.resolution)
+        print(f"\nBudget {args.budget_mb:.0f} MB -> {plan.describe()} (estimated +{estimate:.0f} MB)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
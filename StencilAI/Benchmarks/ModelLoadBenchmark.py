@@ -0,0 +1,164 @@
+"""
+ModelLoadBenchmark - Model load / switch latency and peak RSS per loading mode
+
+Compares three ways of loading fine-tuned checkpoints through ModelPool:
+    cast-after-load   weights loaded in fp32, then cast (how loading used to work)
+    direct            weights loaded straight into the target dtype from mmap'd safetensors
+    fused             weights read from a pre-fused single-file artifact onto the device
+
+For each mode a fresh process loads checkpoint A, switches to B and back
+to A (with one resident UNet, so every switch is a real load), recording
+wall time and the peak RSS above the pre-load baseline.
+
+Usage:
+    python ModelLoadBenchmark.py                                  # tiny random models, fp16
+    python ModelLoadBenchmark.py --base-model runwayml/stable-diffusion-v1-5 \\
+        --checkpoints ../Fine-tuning/checkpoint-500 ../Fine-tuning/checkpoint-1000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from StencilMetrics import current_rss_mb, peak_rss_mb, _reset_peak_rss
+
+MODES = ["cast-after-load", "direct", "fused"]
+
+
+def make_tiny_checkpoints(root: str) -> tuple:
+    """
+    Save a tiny base pipeline and two tiny fine-tuned UNets to disk.
+
+    Returns:
+        (base model path, [checkpoint A path, checkpoint B path])
+    """
+    import torch
+    from TinyModels import tiny_pipeline, tiny_unet
+
+    tiny_pipeline().save_pretrained(os.path.join(root, "base"))
+    checkpoints = []
+    for index, name in enumerate(["checkpoint-a", "checkpoint-b"]):
+        torch.manual_seed(index + 1)
+        tiny_unet().save_pretrained(os.path.join(root, name, "unet"))
+        checkpoints.append(os.path.join(root, name))
+    return os.path.join(root, "base"), checkpoints
+
+
+def _pool(mode: str, args):
+    """Build a ModelPool that loads the way the given mode does."""
+    import torch
+    from Stencil import ModelPool
+
+    class CastAfterLoadPool(ModelPool):
+        """Loads every component in fp32 and casts afterwards."""
+
+        @property
+        def dtype(self):
+            return torch.float32
+
+        def _place(self, module):
+            return module.to(self.device, dtype=torch.float16 if self.use_fp16 else torch.float32)
+
+    pool_class = CastAfterLoadPool if mode == "cast-after-load" else ModelPool
+    pool = pool_class(
+        base_model=args.base_model,
+        max_unets=1,
+        device=args.device,
+        fast_load_dir=args.fast_load_dir if mode == "fused" else None,
+    )
+    # Load in half precision even on CPU; only loading is measured here
+    pool.use_fp16 = args.fp16
+    return pool
+
+
+def run_worker(args):
+    """Load A, switch to B, switch back to A; print the measurements as JSON."""
+    # Keep library import cost out of the measurements
+    import torch
+    from diffusers import AutoencoderKL, PNDMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextModel, CLIPTokenizer
+
+    pool = _pool(args.worker, args)
+    baseline_rss = current_rss_mb()
+    first, second = args.checkpoints[:2]
+
+    results = []
+    for label, checkpoint in [("load", first), ("switch", second), ("switch back", first)]:
+        _reset_peak_rss()
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        pool.build_pipeline(checkpoint)
+        results.append({
+            "step": label,
+            "checkpoint": checkpoint,
+            "seconds": time.perf_counter() - start,
+            "peak_rss_over_baseline_mb": peak_rss_mb() - baseline_rss,
+            "peak_rss_over_step_start_mb": peak_rss_mb() - rss_before,
+        })
+    print("RESULT " + json.dumps(results))
+
+
+def run_mode(mode: str, args) -> list:
+    """Run one mode in a fresh interpreter and return its measurements."""
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        "--worker", mode,
+        "--base-model", args.base_model,
+        "--checkpoints", *args.checkpoints,
+        "--device", args.device,
+        "--fast-load-dir", args.fast_load_dir,
+    ]
+    if not args.fp16:
+        command.append("--fp32")
+    proc = subprocess.run(command, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"{mode} worker failed:\n{proc.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model load/switch latency and peak RSS per loading mode")
+    parser.add_argument("--base-model", default=None, help="Base model providing shared components (default: tiny)")
+    parser.add_argument("--checkpoints", nargs="+", default=None, help="Two fine-tuned checkpoints to switch between")
+    parser.add_argument("--device", default="cpu", help="Device to load onto")
+    parser.add_argument("--fp32", dest="fp16", action="store_false", help="Load in fp32 instead of fp16")
+    parser.add_argument("--fast-load-dir", default=None, help="Where to keep fused artifacts (default: temp dir)")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="stencil-load-bench-")
+    if args.base_model is None or args.checkpoints is None:
+        args.base_model, args.checkpoints = make_tiny_checkpoints(work_dir)
+    args.fast_load_dir = args.fast_load_dir or os.path.join(work_dir, "fast-load")
+
+    # The first fused run only writes the artifacts; time the second one
+    run_mode("fused", args)
+
+    report = {}
+    print(f"{'mode':<18}{'step':<14}{'seconds':>10}{'peak RSS +MB':>15}")
+    for mode in MODES:
+        report[mode] = run_mode(mode, args)
+        for step in report[mode]:
+            print(f"{mode:<18}{step['step']:<14}{step['seconds']:>10.2f}{step['peak_rss_over_step_start_mb']:>15.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
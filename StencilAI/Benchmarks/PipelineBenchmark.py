@@ -0,0 +1,83 @@
+"""
+PipelineBenchmark - End-to-end throughput of sequential vs pipelined bulk generation
+
+Runs the same batch of requests through StencilPipeline with workers=0
+(denoise, decode, clean, outline and PNG encode strictly in sequence) and
+with a post-processing process pool (overlapping denoising with the rest),
+and reports images per second for each.
+
+On the tiny random-weight models denoising is cheap, so this mostly shows the
+pipeline's overhead and the post-processing ceiling; pass --model to measure
+with a real model.
+
+Usage:
+    python PipelineBenchmark.py
+    python PipelineBenchmark.py --workers 2 4 --requests 16 --images 4 --resolution 512
+    python PipelineBenchmark.py --model Manojb/stable-diffusion-2-1-base --steps 25
+"""
+
+import argparse
+import json
+import os
+import sys
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from StencilPipeline import StencilPipeline
+
+from TinyModels import tiny_generator
+
+PROMPTS = ["a cat sitting", "a tree with spreading branches", "a bicycle", "a coffee cup"]
+
+
+def run_mode(generator, workers: int, requests: list, args) -> dict:
+    """Run the requests through a pipeline with the given worker count (after one warm-up request)."""
+    options = dict(num_inference_steps=args.steps, width=args.resolution, height=args.resolution)
+    with StencilPipeline(generator, workers=workers, max_batch_images=args.batch_size, outline=not args.no_outline) as pipeline:
+        # Warm-up also starts the pool's processes, which shouldn't count against throughput
+        for _ in pipeline.run(requests[:1], **options):
+            pass
+        for _ in pipeline.run(requests, **options):
+            pass
+        return pipeline.last_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sequential vs pipelined bulk generation throughput")
+    parser.add_argument("--model", default=None, help="HuggingFace model ID (default: tiny random model on CPU)")
+    parser.add_argument("--workers", nargs="+", type=int, default=[2], help="Pool sizes to compare with sequential")
+    parser.add_argument("--requests", type=int, default=8, help="Number of requests")
+    parser.add_argument("--images", type=int, default=2, help="Images per request")
+    parser.add_argument("--batch-size", type=int, default=4, help="Images per UNet batch")
+    parser.add_argument("--resolution", type=int, default=256, help="Image size in pixels")
+    parser.add_argument("--steps", type=int, default=4, help="Denoising steps")
+    parser.add_argument("--no-outline", action="store_true", help="Skip the edge_stencil outlines")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    if args.model:
+        from Stencil import StencilGenerator
+        generator = StencilGenerator(model_id=args.model)
+    else:
+        generator = tiny_generator()
+
+    requests = [(PROMPTS[i % len(PROMPTS)], i * args.images, args.images) for i in range(args.requests)]
+
+    report = {}
+    for workers in [0] + args.workers:
+        name = "sequential" if workers == 0 else f"pipelined/{workers}w"
+        report[name] = run_mode(generator, workers, requests, args)
+
+    print(f"\n{'mode':<18}{'images':>8}{'seconds':>10}{'images/s':>10}")
+    for name, stats in report.items():
+        print(f"{name:<18}{stats['images']:>8}{stats['seconds']:>10.2f}{stats['images_per_second']:>10.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
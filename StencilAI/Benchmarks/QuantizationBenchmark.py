@@ -0,0 +1,161 @@
+"""
+QuantizationBenchmark - CPU precision modes vs fp32: latency and binary-mask IoU
+
+Runs the same seeded generations with StencilGenerator's cpu_precision set to
+each of fp32, bf16, int8 and int8-bf16 (see StencilQuantize), on the base
+model and on each fine-tuned checkpoint, and compares the cleaned binary
+stencils against fp32: the IoU of the black (subject) pixels.
+
+Without --model/--checkpoint, a randomly initialised UNet with the real SD
+architecture takes one CFG step (batch of 2) per mode instead, and the
+relative error of its noise prediction stands in for the IoU; only the
+latencies mean much there. The full-size fp32 UNet plus its bf16 autocast
+copies need ~8 GB of RAM, so pass --unet-width 160 on smaller machines.
+
+Usage:
+    python QuantizationBenchmark.py                                  # UNet step latency, offline
+    python QuantizationBenchmark.py --unet-width 160 --resolution 512
+    python QuantizationBenchmark.py --model Manojb/stable-diffusion-2-1-base \\
+        --checkpoint ../Fine-tuning/checkpoint-1000 --steps 25
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from Stencil import StencilGenerator
+from StencilQuantize import CPU_PRECISIONS, QUANTIZATION_MODES, cpu_supports_bf16, quantize_linear_layers
+
+from DecoderBenchmark import mask_iou
+from StencilBenchmark import PROMPTS, time_call
+from TinyModels import sd_sized_unet
+
+
+def generation_case(source: dict, precision: str, args) -> tuple:
+    """
+    Time seeded generations on one model at one precision.
+
+    Args:
+        source: StencilGenerator keyword arguments selecting the model
+        precision: cpu_precision to load the generator with
+        args: Parsed command-line arguments
+
+    Returns:
+        Tuple of (timing dict for one image, uint8 stencil stack for PROMPTS)
+    """
+    generator = StencilGenerator(device="cpu", cpu_precision=precision, **source)
+    options = dict(num_inference_steps=args.steps, width=args.resolution, height=args.resolution)
+    timing = time_call(lambda: generator.generate(PROMPTS[0], seed=0, **options), repeats=args.repeats, min_seconds=0)
+    stencils = np.stack([np.array(generator.generate(prompt, seed=i, **options)) for i, prompt in enumerate(PROMPTS)])
+    del generator
+    gc.collect()
+    return timing, stencils
+
+
+def unet_case(precision: str, args) -> tuple:
+    """
+    Time one CFG step of a random SD-architecture UNet at one precision.
+
+    Args:
+        precision: CPU precision mode to apply to the UNet
+        args: Parsed command-line arguments
+
+    Returns:
+        Tuple of (timing dict, fp32 noise prediction)
+    """
+    torch.manual_seed(0)
+    width = args.unet_width
+    unet = sd_sized_unet((width, width * 2, width * 4, width * 4))
+    mode = QUANTIZATION_MODES.get(precision)
+    if mode is not None:
+        quantize_linear_layers(unet, mode)
+    bf16 = precision.endswith("bf16") and cpu_supports_bf16()
+
+    size = args.resolution // 8
+    generator = torch.Generator().manual_seed(0)
+    latents = torch.randn(2, 4, size, size, generator=generator)
+    embeds = torch.randn(2, 77, 768, generator=generator)
+    timestep = torch.tensor([500, 500])
+
+    def step():
+        with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=bf16):
+            return unet(latents, timestep, embeds).sample.float()
+
+    timing = time_call(step, repeats=args.repeats, min_seconds=0)
+    noise_pred = step()
+    del unet
+    gc.collect()
+    return timing, noise_pred
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU precision modes vs fp32 latency and stencil IoU")
+    parser.add_argument("--model", default=None, help="HuggingFace model ID of the base model")
+    parser.add_argument("--checkpoint", nargs="*", default=[], help="Fine-tuned checkpoints to compare as well")
+    parser.add_argument("--modes", nargs="+", default=list(CPU_PRECISIONS), choices=CPU_PRECISIONS, help="Precisions to compare")
+    parser.add_argument("--resolution", type=int, default=512, help="Image size in pixels")
+    parser.add_argument("--steps", type=int, default=25, help="Denoising steps for real-model generations")
+    parser.add_argument("--unet-width", type=int, default=320, help="First-level channels of the offline UNet (SD: 320)")
+    parser.add_argument("--repeats", type=int, default=2, help="Timed runs per case")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    modes = ["fp32"] + [mode for mode in args.modes if mode != "fp32"]
+    real = args.model is not None or bool(args.checkpoint)
+    if real:
+        sources = {args.model: dict(model_id=args.model)} if args.model else {}
+        for checkpoint in args.checkpoint:
+            sources[os.path.basename(os.path.normpath(checkpoint))] = dict(checkpoint_path=checkpoint)
+    else:
+        sources = {f"unet-{args.unet_width}": None}
+
+    print(f"CPU bf16 support: {cpu_supports_bf16()}")
+    report = {}
+    for name, source in sources.items():
+        report[name] = {}
+        reference = None
+        for mode in modes:
+            if real:
+                timing, output = generation_case(source, mode, args)
+            else:
+                timing, output = unet_case(mode, args)
+            reference = output if reference is None else reference
+
+            baseline_ms = report[name]["fp32"]["latency"]["median_ms"] if mode != "fp32" else timing["median_ms"]
+            entry = {"latency": timing, "speedup": baseline_ms / timing["median_ms"]}
+            if real:
+                iou = mask_iou(reference, output)
+                entry.update(iou_mean=float(iou.mean()), iou_min=float(iou.min()))
+            else:
+                entry["relative_error"] = float((output - reference).norm() / reference.norm())
+            report[name][mode] = entry
+
+    fidelity = "mean IoU  min IoU" if real else "  rel. error"
+    print(f"\n{'model':<28}{'mode':<11}{'ms':>10}{'speedup':>9}  {fidelity}")
+    for name, modes_report in report.items():
+        for mode, entry in modes_report.items():
+            if real:
+                columns = f"{entry['iou_mean']:>10.3f}{entry['iou_min']:>9.3f}"
+            else:
+                columns = f"{entry['relative_error']:>13.4f}"
+            print(f"{name[:27]:<28}{mode:<11}{entry['latency']['median_ms']:>10.1f}{entry['speedup']:>8.2f}x{columns}")
+
+    if not real:
+        print("\nRandom weights: stencil IoU needs --model/--checkpoint")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+StencilBenchmark - Offline CPU benchmark suite for StencilAI
+
+Times generation (on tiny random-weight models), stencil cleaning, the
+StencilCV styles and PromptNLP over a matrix of resolutions and batch sizes,
+writes the results as JSON and compares them with a stored baseline.
+
+Usage:
+    python StencilBenchmark.py                       # run and compare with baseline.json
+    python StencilBenchmark.py --update-baseline     # store this run as the new baseline
+    python StencilBenchmark.py --resolutions 256 512 --batch-sizes 1 4 --threshold 0.2
+
+Exits with status 1 if any case is slower than the baseline by more than the
+threshold, so it can gate CI.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+import torch
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from Stencil import GenerationRequest, clean_stencil_batch
+from StencilCV import StencilCV
+from StencilMetrics import metrics
+
+from TinyModels import tiny_generator
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_OUTPUT = os.path.join(BENCHMARK_DIR, "results.json")
+
+PROMPTS = [
+    "a cat sitting",
+    "a brown dog with a red ball in a car at night",
+    "two cats on the sofa under a lamp",
+    "a lighthouse by the sea",
+]
+
+
+def time_call(
+    fn: Callable[[], object],
+    repeats: int = 3,
+    warmup: int = 1,
+    min_seconds: float = 0.25,
+    max_repeats: int = 50
+) -> dict:
+    """
+    Time a function over several runs after warming it up.
+
+    Fast functions keep being timed until min_seconds have passed (up to
+    max_repeats runs) so that millisecond cases aren't dominated by noise.
+
+    Args:
+        fn: Zero-argument function to time
+        repeats: Minimum number of timed runs
+        warmup: Number of untimed runs first
+        min_seconds: Minimum total time to spend on timed runs
+        max_repeats: Maximum number of timed runs
+
+    Returns:
+        Dictionary with median_ms, min_ms, mean_ms and repeats
+    """
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    while len(times) < repeats or (sum(times) < min_seconds * 1000 and len(times) < max_repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "median_ms": statistics.median(times),
+        "min_ms": min(times),
+        "mean_ms": statistics.mean(times),
+        "repeats": len(times),
+    }
+
+
+def synthetic_image(size: int, seed: int = 0) -> np.ndarray:
+    """
+    Draw a reproducible test scene: dark shapes on a lit, noisy background.
+
+    Args:
+        size: Width and height in pixels
+        seed: Seed for shape placement and noise
+
+    Returns:
+        uint8 RGB array of shape (size, size, 3)
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(170, 250, size, dtype=np.float32)
+    image = np.repeat(np.tile(gradient, (size, 1))[..., None], 3, axis=2)
+
+    for _ in range(4):
+        center = tuple(int(c) for c in rng.integers(size // 5, 4 * size // 5, 2))
+        radius = int(rng.integers(size // 12, size // 5))
+        cv2.circle(image, center, radius, (30, 30, 30), -1)
+    corner = rng.integers(0, size // 2, 2)
+    cv2.rectangle(image, tuple(int(c) for c in corner), tuple(int(c + size // 4) for c in corner), (60, 60, 60), -1)
+
+    image += rng.normal(0, 12, image.shape).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def stage_means(names: List[str]) -> Dict[str, float]:
+    """Return the mean wall time of selected StencilMetrics stages since the last reset."""
+    summary = metrics.summary()
+    return {name: summary[name]["mean_ms"] for name in names if name in summary}
+
+
+def bench_generation(resolutions: List[int], batch_sizes: List[int], steps: int, repeats: int) -> dict:
+    """
+    Time end-to-end generation on the tiny pipeline.
+
+    Args:
+        resolutions: Image sizes in pixels
+        batch_sizes: Images per generate_batch call
+        steps: Denoising steps per generation
+        repeats: Timed runs per case
+
+    Returns:
+        Results keyed by "generate/<res>px/b<batch>"
+    """
+    generator = tiny_generator()
+    results = {}
+    for size in resolutions:
+        for batch in batch_sizes:
+            request = GenerationRequest(prompt=PROMPTS[0], num_images=batch, seed=0)
+            metrics.reset()
+            result = time_call(
+                lambda: generator.generate_batch([request], num_inference_steps=steps, width=size, height=size),
+                repeats=repeats,
+            )
+            result["stages_ms"] = stage_means(["text_encode", "unet_step", "vae_decode", "clean"])
+            results[f"generate/{size}px/b{batch}"] = result
+            print(f"generate {size}px b{batch}: {result['median_ms']:.1f} ms")
+    return results
+
+
+def bench_large_canvas(resolutions: List[int], steps: int, repeats: int) -> dict:
+    """
+    Time tiled large-canvas generation at twice each resolution, with tiles of that resolution.
+
+    Each case also records ms per megapixel, to compare with regular generation.
+
+    Returns:
+        Results keyed by "large/<canvas>px/t<tile>"
+    """
+    generator = tiny_generator()
+    results = {}
+    for tile in resolutions:
+        canvas = 2 * tile
+        result = time_call(
+            lambda: generator.generate_large(
+                PROMPTS[0], width=canvas, height=canvas, num_inference_steps=steps, seed=0,
+                tile_size=tile, tile_overlap=tile // 4, tile_batch=4,
+            ),
+            repeats=repeats,
+        )
+        result["ms_per_megapixel"] = result["median_ms"] / (canvas * canvas / 1e6)
+        results[f"large/{canvas}px/t{tile}"] = result
+        print(f"large {canvas}px (tiles {tile}px): {result['median_ms']:.1f} ms, {result['ms_per_megapixel']:.0f} ms/MP")
+    return results
+
+
+def bench_cleaning(resolutions: List[int], batch_sizes: List[int], repeats: int) -> dict:
+    """
+    Time clean_stencil_batch on stacks of synthetic grayscale images.
+
+    Returns:
+        Results keyed by "clean/<res>px/b<batch>"
+    """
+    results = {}
+    for size in resolutions:
+        for batch in batch_sizes:
+            gray = np.stack([cv2.cvtColor(synthetic_image(size, seed), cv2.COLOR_RGB2GRAY) for seed in range(batch)])
+            result = time_call(lambda: clean_stencil_batch(gray), repeats=repeats)
+            results[f"clean/{size}px/b{batch}"] = result
+            print(f"clean {size}px b{batch}: {result['median_ms']:.1f} ms")
+    return results
+
+
+def bench_cv(resolutions: List[int], repeats: int) -> dict:
+    """
+    Time each StencilCV style on a synthetic image.
+
+    Returns:
+        Results keyed by "cv/<style>/<res>px"
+    """
+    processor = StencilCV()
+    results = {}
+    for size in resolutions:
+        image = cv2.cvtColor(synthetic_image(size), cv2.COLOR_RGB2BGR)
+        for style in ("outline", "filled", "hybrid"):
+            result = time_call(lambda: processor.auto_stencil(image, style=style), repeats=repeats)
+            results[f"cv/{style}/{size}px"] = result
+            print(f"cv {style} {size}px: {result['median_ms']:.1f} ms")
+    return results
+
+
+def bench_prompt_nlp(repeats: int) -> dict:
+    """
+    Time PromptNLP prompt decomposition, if spaCy and its English model are installed.
+
+    Returns:
+        Results keyed by "prompt_nlp/decompose" (empty if PromptNLP is unavailable)
+    """
+    sys.path.append(os.path.join(module_dir, "PromptNLP"))
+    try:
+        import PromptNLP
+        PromptNLP.decompose_prompt(PROMPTS[0])
+    except (ImportError, OSError) as e:
+        print(f"Skipping PromptNLP benchmark: {e}")
+        return {}
+
+    result = time_call(lambda: [PromptNLP.decompose_prompt(p) for p in PROMPTS], repeats=repeats)
+    print(f"prompt_nlp decompose x{len(PROMPTS)}: {result['median_ms']:.1f} ms")
+    return {"prompt_nlp/decompose": result}
+
+
+def environment() -> dict:
+    """Describe the machine the benchmark ran on."""
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare_to_baseline(
+    results: dict,
+    baseline: dict,
+    threshold: float = 0.25,
+    min_delta_ms: float = 1.0
+) -> List[str]:
+    """
+    Find cases that got slower than the baseline.
+
+    Compares the fastest run of each case, which is the least sensitive to
+    other load on the machine.
+
+    Args:
+        results: Case results from this run
+        baseline: Case results from the baseline run
+        threshold: Allowed relative slowdown (0.25 = 25%)
+        min_delta_ms: Ignore slowdowns smaller than this, to skip timer noise on tiny cases
+
+    Returns:
+        One message per regressed case
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before = baseline[name]["min_ms"]
+        after = result["min_ms"]
+        ratio = after / before if before > 0 else float("inf")
+        marker = ""
+        if ratio > 1 + threshold and after - before > min_delta_ms:
+            marker = "  <-- REGRESSION"
+            regressions.append(f"{name}: {before:.1f} ms -> {after:.1f} ms ({ratio:.2f}x)")
+        print(f"{name:<32}{before:>10.1f}{after:>10.1f}{ratio:>8.2f}x{marker}")
+    return regressions
+
+
+def run_suite(args) -> dict:
+    """Run every selected benchmark and return the combined results."""
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    results = {}
+    if "generate" in args.suites:
+        results.update(bench_generation(args.resolutions, args.batch_sizes, args.steps, args.repeats))
+    if "large" in args.suites:
+        results.update(bench_large_canvas(args.resolutions, args.steps, args.repeats))
+    if "clean" in args.suites:
+        results.update(bench_cleaning(args.resolutions, args.batch_sizes, args.repeats))
+    if "cv" in args.suites:
+        results.update(bench_cv(args.resolutions, args.repeats))
+    if "prompt_nlp" in args.suites:
+        results.update(bench_prompt_nlp(args.repeats))
+    return results
+
+
+def load_results(path: str) -> Optional[dict]:
+    """Load the case results from a results/baseline JSON file, or None if it doesn't exist."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline CPU benchmarks for StencilAI")
+    parser.add_argument("--suites", nargs="+", default=["generate", "clean", "cv", "prompt_nlp"],
+                        choices=["generate", "large", "clean", "cv", "prompt_nlp"], help="Benchmarks to run")
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[256, 512], help="Image sizes in pixels")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 2], help="Images per batch")
+    parser.add_argument("--steps", type=int, default=4, help="Denoising steps per generation")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per case")
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads (default: torch's choice)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write this run's results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed relative slowdown before failing")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the baseline")
+    args = parser.parse_args()
+
+    results = run_suite(args)
+    config = {key: getattr(args, key) for key in ("suites", "resolutions", "batch_sizes", "steps", "repeats", "threads")}
+    report = {"environment": environment(), "config": config, "results": results}
+
+    output = args.baseline if args.update_baseline else args.output
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to: {output}")
+
+    if args.update_baseline:
+        return
+
+    baseline = load_results(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one")
+        return
+
+    print(f"\n{'case':<32}{'base ms':>10}{'now ms':>10}{'ratio':>9}")
+    regressions = compare_to_baseline(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for message in regressions:
+            print(f"  {message}")
+        sys.exit(1)
+    print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
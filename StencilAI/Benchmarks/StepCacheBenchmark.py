@@ -0,0 +1,156 @@
+"""
+StepCacheBenchmark - DeepCache-style step cache: speedup and binary-mask IoU per reuse interval
+
+Runs the same seeded generations with StencilGenerator's step_cache_interval
+set to each interval (see StencilStepCache), on the base model and on each
+fine-tuned checkpoint, and compares the cleaned binary stencils against the
+uncached run (interval 1): the IoU of the black (subject) pixels.
+
+Without --model/--checkpoint, the tiny random-weight pipeline is used, plus
+optionally a full schedule of CFG UNet calls on a randomly initialised
+SD-architecture UNet (--unet-width 320 for the real size), which is where
+the speedup shows.
+
+Usage:
+    python StepCacheBenchmark.py                                  # offline
+    python StepCacheBenchmark.py --unet-width 64 --resolution 512
+    python StepCacheBenchmark.py --model Manojb/stable-diffusion-2-1-base \\
+        --checkpoint ../Fine-tuning/checkpoint-1000 --steps 25
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from Stencil import StencilGenerator
+from StencilStepCache import StepCacheUNet
+
+from DecoderBenchmark import mask_iou
+from StencilBenchmark import PROMPTS, time_call
+from TinyModels import TinyStencilGenerator, sd_sized_unet
+
+
+def generation_case(generator, interval: int, args) -> tuple:
+    """
+    Time seeded generations with one reuse interval.
+
+    Args:
+        generator: Loaded StencilGenerator
+        interval: step_cache_interval to run with
+        args: Parsed command-line arguments
+
+    Returns:
+        Tuple of (timing dict for one image, uint8 stencil stack for PROMPTS)
+    """
+    generator.set_step_cache(interval)
+    options = dict(num_inference_steps=args.steps, width=args.resolution, height=args.resolution)
+    timing = time_call(lambda: generator.generate(PROMPTS[0], seed=0, **options), repeats=args.repeats, min_seconds=0)
+    stencils = np.stack([np.array(generator.generate(prompt, seed=i, **options)) for i, prompt in enumerate(PROMPTS)])
+    return timing, stencils
+
+
+def unet_schedule_case(unet, interval: int, args) -> dict:
+    """
+    Time a schedule of CFG calls (batch of 2) on a UNet with one reuse interval.
+
+    Args:
+        unet: UNet2DConditionModel
+        interval: Reuse interval
+        args: Parsed command-line arguments
+
+    Returns:
+        Timing dict for the whole schedule
+    """
+    size = args.resolution // 8
+    generator = torch.Generator().manual_seed(0)
+    latents = torch.randn(2, 4, size, size, generator=generator)
+    embeds = torch.randn(2, 77, unet.config.cross_attention_dim, generator=generator)
+    timesteps = torch.linspace(999, 0, args.steps).long()
+
+    def schedule():
+        cached = StepCacheUNet(unet, interval)
+        with torch.no_grad():
+            for i, t in enumerate(timesteps):
+                cached.begin_step(i)
+                cached(latents, t, embeds)
+
+    return time_call(schedule, repeats=args.repeats, min_seconds=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step cache speedup and stencil IoU per reuse interval")
+    parser.add_argument("--model", default=None, help="HuggingFace model ID of the base model")
+    parser.add_argument("--checkpoint", nargs="*", default=[], help="Fine-tuned checkpoints to compare as well")
+    parser.add_argument("--intervals", nargs="+", type=int, default=[2, 3, 5], help="Reuse intervals to compare with 1")
+    parser.add_argument("--resolution", type=int, default=256, help="Image size in pixels")
+    parser.add_argument("--steps", type=int, default=25, help="Denoising steps")
+    parser.add_argument("--unet-width", type=int, default=0, help="First-level channels of the offline UNet schedule (SD: 320, 0 to skip)")
+    parser.add_argument("--repeats", type=int, default=2, help="Timed runs per case")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    intervals = [1] + [interval for interval in args.intervals if interval != 1]
+    real = args.model is not None or bool(args.checkpoint)
+    if real:
+        generator_class = StencilGenerator
+        sources = {args.model: dict(model_id=args.model)} if args.model else {}
+        for checkpoint in args.checkpoint:
+            sources[os.path.basename(os.path.normpath(checkpoint))] = dict(checkpoint_path=checkpoint)
+    else:
+        generator_class = TinyStencilGenerator
+        sources = {"tiny": dict(model_id="tiny")}
+
+    report = {}
+    for name, source in sources.items():
+        generator = generator_class(device="cpu", use_fp16=False, **source)
+        report[name] = {}
+        reference = None
+        for interval in intervals:
+            timing, stencils = generation_case(generator, interval, args)
+            reference = stencils if reference is None else reference
+            iou = mask_iou(reference, stencils)
+            report[name][interval] = {
+                "latency": timing,
+                "speedup": report[name][1]["latency"]["median_ms"] / timing["median_ms"] if interval != 1 else 1.0,
+                "iou_mean": float(iou.mean()),
+                "iou_min": float(iou.min()),
+            }
+        del generator
+
+    print(f"\n{'model':<28}{'interval':>9}{'ms/image':>10}{'speedup':>9}{'mean IoU':>10}{'min IoU':>9}")
+    for name, entries in report.items():
+        for interval, entry in entries.items():
+            print(
+                f"{name[:27]:<28}{interval:>9}{entry['latency']['median_ms']:>10.1f}"
+                f"{entry['speedup']:>8.2f}x{entry['iou_mean']:>10.3f}{entry['iou_min']:>9.3f}"
+            )
+
+    if not real and args.unet_width:
+        torch.manual_seed(0)
+        width = args.unet_width
+        unet = sd_sized_unet((width, width * 2, width * 4, width * 4))
+        schedule = {interval: unet_schedule_case(unet, interval, args) for interval in intervals}
+        report[f"unet-{width}-schedule"] = schedule
+        print(f"\nUNet schedule (width {width}, {args.resolution}px, {args.steps} CFG steps):")
+        for interval, timing in schedule.items():
+            speedup = schedule[1]["median_ms"] / timing["median_ms"]
+            print(f"  interval {interval}: {timing['median_ms'] / 1000:.1f}s ({speedup:.2f}x)")
+
+    if not real:
+        print("\nRandom weights: stencil IoU on real stencils needs --model/--checkpoint")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+TinyModels - Tiny randomly initialised Stable Diffusion components for offline benchmarks
+
+Builds a CLIP tokenizer/text encoder, UNet, VAE and scheduler from the same
+architecture families as the real models (CLIPTextModel, UNet2DConditionModel
+with cross-attention blocks, 4-block AutoencoderKL so the VAE still
+downsamples by 8), but with a handful of channels and random weights. Nothing
+is downloaded, so the whole generation path can be timed on CPU.
+
+Output images are noise; only timings (and relative comparisons between
+modes on the same tiny model) are meaningful.
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import torch
+from diffusers import AutoencoderKL, AutoencoderTiny, DPMSolverMultistepScheduler, StableDiffusionPipeline, UNet2DConditionModel
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from Stencil import StencilGenerator
+
+# Same context length and latent channels as SD 1.5 / 2.1
+MAX_LENGTH = 77
+HIDDEN_SIZE = 32
+
+
+def tiny_tokenizer() -> CLIPTokenizer:
+    """
+    Build a character-level CLIP tokenizer (no BPE merges) in a temp directory.
+
+    Returns:
+        CLIPTokenizer with a 60-token vocabulary and model_max_length 77
+    """
+    vocab_dir = tempfile.mkdtemp(prefix="tiny-clip-")
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1, "!": 2}
+    for char in [chr(c) for c in range(ord("a"), ord("z") + 1)] + [",", "."]:
+        vocab.setdefault(char, len(vocab))
+        vocab.setdefault(char + "</w>", len(vocab))
+
+    with open(os.path.join(vocab_dir, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(vocab_dir, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+
+    return CLIPTokenizer(
+        os.path.join(vocab_dir, "vocab.json"),
+        os.path.join(vocab_dir, "merges.txt"),
+        model_max_length=MAX_LENGTH,
+        pad_token="!",
+    )
+
+
+def tiny_text_encoder() -> CLIPTextModel:
+    """Build a 2-layer CLIP text encoder with hidden size 32."""
+    config = CLIPTextConfig(
+        hidden_size=HIDDEN_SIZE,
+        intermediate_size=64,
+        num_attention_heads=4,
+        num_hidden_layers=2,
+        vocab_size=100,
+        max_position_embeddings=MAX_LENGTH,
+        bos_token_id=0,
+        eos_token_id=1,
+        pad_token_id=2,
+    )
+    return CLIPTextModel(config).eval()
+
+
+def tiny_unet() -> UNet2DConditionModel:
+    """Build a two-level UNet with one cross-attention block on each side."""
+    return UNet2DConditionModel(
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+        up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"),
+        cross_attention_dim=HIDDEN_SIZE,
+        attention_head_dim=8,
+        norm_num_groups=32,
+    ).eval()
+
+
+def tiny_vae() -> AutoencoderKL:
+    """Build a 4-block VAE so, like SD, it maps 8x8 pixels to one latent."""
+    return AutoencoderKL(
+        in_channels=3,
+        out_channels=3,
+        block_out_channels=(32, 32, 32, 32),
+        down_block_types=("DownEncoderBlock2D",) * 4,
+        up_block_types=("UpDecoderBlock2D",) * 4,
+        latent_channels=4,
+        norm_num_groups=32,
+        sample_size=256,  # VAE tiling works in 256px tiles
+    ).eval()
+
+
+def sd_sized_vae() -> AutoencoderKL:
+    """Build a randomly initialised VAE with the real SD 1.x/2.x architecture, for decoder timings."""
+    return AutoencoderKL(
+        in_channels=3,
+        out_channels=3,
+        block_out_channels=(128, 256, 512, 512),
+        down_block_types=("DownEncoderBlock2D",) * 4,
+        up_block_types=("UpDecoderBlock2D",) * 4,
+        layers_per_block=2,
+        latent_channels=4,
+        norm_num_groups=32,
+    ).eval()
+
+
+def sd_sized_unet(block_out_channels: tuple = (320, 640, 1280, 1280)) -> UNet2DConditionModel:
+    """
+    Build a randomly initialised UNet with the SD 1.x architecture, for UNet timings.
+
+    Args:
+        block_out_channels: Channel widths per level; halve them to fit machines
+                            with less than ~8 GB of RAM
+
+    Returns:
+        UNet2DConditionModel taking 768-wide text embeddings
+    """
+    return UNet2DConditionModel(
+        sample_size=64,
+        block_out_channels=block_out_channels,
+        cross_attention_dim=768,
+        attention_head_dim=8,
+    ).eval()
+
+
+def sd_sized_tiny_vae() -> AutoencoderTiny:
+    """Build a randomly initialised AutoencoderTiny with the real TAESD architecture, for decoder timings."""
+    return AutoencoderTiny().eval()
+
+
+def tiny_components(seed: int = 0) -> dict:
+    """
+    Build every pipeline component with reproducible random weights.
+
+    Args:
+        seed: Seed for weight initialisation
+
+    Returns:
+        Dictionary with unet, vae, text_encoder, tokenizer and scheduler
+    """
+    torch.manual_seed(seed)
+    return dict(
+        unet=tiny_unet(),
+        vae=tiny_vae(),
+        text_encoder=tiny_text_encoder(),
+        tokenizer=tiny_tokenizer(),
+        scheduler=DPMSolverMultistepScheduler(steps_offset=1),
+    )
+
+
+def tiny_pipeline(seed: int = 0) -> StableDiffusionPipeline:
+    """
+    Assemble the tiny components into a StableDiffusionPipeline.
+
+    Args:
+        seed: Seed for weight initialisation
+
+    Returns:
+        StableDiffusionPipeline without safety checker
+    """
+    return StableDiffusionPipeline(
+        **tiny_components(seed),
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+
+
+class TinyStencilGenerator(StencilGenerator):
+    """StencilGenerator whose loaders build the tiny pipeline instead of downloading a model."""
+
+    def _load_from_pretrained(self, model_id: str):
+        self.pipe = tiny_pipeline().to(self.device)
+        self.text_encoder_id = "tiny"
+
+    def _load_from_checkpoint(self, checkpoint_path: str):
+        self.pipe = tiny_pipeline().to(self.device)
+        self.text_encoder_id = "tiny"
+
+
+def tiny_generator(**kwargs) -> TinyStencilGenerator:
+    """
+    Create a CPU, fp32 StencilGenerator on the tiny pipeline.
+
+    Args:
+        **kwargs: Extra StencilGenerator arguments
+
+    Returns:
+        TinyStencilGenerator
+    """
+    kwargs.setdefault("device", "cpu")
+    kwargs.setdefault("use_fp16", False)
+    return TinyStencilGenerator(model_id="tiny", **kwargs)
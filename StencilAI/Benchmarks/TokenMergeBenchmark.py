@@ -0,0 +1,174 @@
+"""
+TokenMergeBenchmark - Token merging: speedup vs resolution and binary-mask IoU
+
+Runs the same seeded generations with StencilGenerator's token_merge_ratio
+set to each ratio (see StencilTokenMerge), at each resolution, on the base
+model and on each fine-tuned checkpoint, and compares the cleaned binary
+stencils against the unmerged run: the IoU of the black (subject) pixels.
+
+Without --model/--checkpoint, the tiny random-weight pipeline is used, plus
+optionally one CFG step of a randomly initialised SD-architecture UNet per
+resolution (--unet-width 320 for the real size), which is where the
+attention cost, and so the speedup, shows.
+
+Usage:
+    python TokenMergeBenchmark.py                                  # offline
+    python TokenMergeBenchmark.py --unet-width 32 --resolutions 512 768 1024
+    python TokenMergeBenchmark.py --model Manojb/stable-diffusion-2-1-base \\
+        --checkpoint ../Fine-tuning/checkpoint-1000 --resolutions 512 768 1024
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+module_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+from Stencil import StencilGenerator
+from StencilTokenMerge import TokenMergingUNet
+
+from DecoderBenchmark import mask_iou
+from StencilBenchmark import PROMPTS, time_call
+from TinyModels import TinyStencilGenerator, sd_sized_unet
+
+
+def generation_case(generator, ratio: float, resolution: int, args) -> tuple:
+    """
+    Time seeded generations with one merge ratio at one resolution.
+
+    Args:
+        generator: Loaded StencilGenerator
+        ratio: token_merge_ratio to run with
+        resolution: Image size in pixels
+        args: Parsed command-line arguments
+
+    Returns:
+        Tuple of (timing dict for one image, uint8 stencil stack for PROMPTS)
+    """
+    generator.set_token_merging(ratio)
+    options = dict(num_inference_steps=args.steps, width=resolution, height=resolution)
+    timing = time_call(lambda: generator.generate(PROMPTS[0], seed=0, **options), repeats=args.repeats, min_seconds=0)
+    stencils = np.stack([np.array(generator.generate(prompt, seed=i, **options)) for i, prompt in enumerate(PROMPTS)])
+    return timing, stencils
+
+
+def unet_step_case(unet, ratio: float, resolution: int, args) -> tuple:
+    """
+    Time one CFG step (batch of 2) of a UNet with one merge ratio.
+
+    Args:
+        unet: UNet2DConditionModel
+        ratio: Merge ratio (0 runs the plain UNet)
+        resolution: Image size in pixels
+        args: Parsed command-line arguments
+
+    Returns:
+        Tuple of (timing dict, noise prediction)
+    """
+    size = resolution // 8
+    generator = torch.Generator().manual_seed(0)
+    latents = torch.randn(2, 4, size, size, generator=generator)
+    embeds = torch.randn(2, 77, unet.config.cross_attention_dim, generator=generator)
+    timestep = torch.tensor(500)
+
+    def step():
+        runner = TokenMergingUNet(unet, unet, ratio) if ratio else unet
+        with torch.no_grad():
+            return runner(latents, timestep, encoder_hidden_states=embeds).sample
+
+    return time_call(step, repeats=args.repeats, min_seconds=0), step()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token merging speedup vs resolution and stencil IoU")
+    parser.add_argument("--model", default=None, help="HuggingFace model ID of the base model")
+    parser.add_argument("--checkpoint", nargs="*", default=[], help="Fine-tuned checkpoints to compare as well")
+    parser.add_argument("--ratios", nargs="+", type=float, default=[0.3, 0.5], help="Merge ratios to compare with 0")
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[256, 512], help="Image sizes in pixels")
+    parser.add_argument("--steps", type=int, default=10, help="Denoising steps")
+    parser.add_argument("--unet-width", type=int, default=0, help="First-level channels of the offline UNet step (SD: 320, 0 to skip)")
+    parser.add_argument("--repeats", type=int, default=2, help="Timed runs per case")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    ratios = [0.0] + [ratio for ratio in args.ratios if ratio]
+    real = args.model is not None or bool(args.checkpoint)
+    if real:
+        generator_class = StencilGenerator
+        sources = {args.model: dict(model_id=args.model)} if args.model else {}
+        for checkpoint in args.checkpoint:
+            sources[os.path.basename(os.path.normpath(checkpoint))] = dict(checkpoint_path=checkpoint)
+    else:
+        generator_class = TinyStencilGenerator
+        sources = {"tiny": dict(model_id="tiny")}
+
+    report = {}
+    for name, source in sources.items():
+        generator = generator_class(device="cpu", use_fp16=False, **source)
+        report[name] = {}
+        for resolution in args.resolutions:
+            entries = report[name][resolution] = {}
+            reference = None
+            for ratio in ratios:
+                timing, stencils = generation_case(generator, ratio, resolution, args)
+                reference = stencils if reference is None else reference
+                iou = mask_iou(reference, stencils)
+                entries[ratio] = {
+                    "latency": timing,
+                    "speedup": entries[0.0]["latency"]["median_ms"] / timing["median_ms"] if ratio else 1.0,
+                    "iou_mean": float(iou.mean()),
+                    "iou_min": float(iou.min()),
+                }
+        del generator
+        gc.collect()
+
+    print(f"\n{'model':<28}{'size':>6}{'ratio':>7}{'ms/image':>10}{'speedup':>9}{'mean IoU':>10}{'min IoU':>9}")
+    for name, resolutions in report.items():
+        for resolution, entries in resolutions.items():
+            for ratio, entry in entries.items():
+                print(
+                    f"{name[:27]:<28}{resolution:>6}{ratio:>7.2f}{entry['latency']['median_ms']:>10.1f}"
+                    f"{entry['speedup']:>8.2f}x{entry['iou_mean']:>10.3f}{entry['iou_min']:>9.3f}"
+                )
+
+    if not real and args.unet_width:
+        torch.manual_seed(0)
+        width = args.unet_width
+        unet = sd_sized_unet((width, width * 2, width * 4, width * 4))
+        steps = report[f"unet-{width}-step"] = {}
+        print(f"\nUNet step (width {width}, CFG batch 2):")
+        for resolution in args.resolutions:
+            steps[resolution] = {}
+            reference = None
+            for ratio in ratios:
+                timing, noise_pred = unet_step_case(unet, ratio, resolution, args)
+                reference = noise_pred if reference is None else reference
+                steps[resolution][ratio] = {
+                    "latency": timing,
+                    "speedup": steps[resolution][0.0]["latency"]["median_ms"] / timing["median_ms"] if ratio else 1.0,
+                    "relative_error": float((noise_pred - reference).norm() / reference.norm()),
+                }
+                entry = steps[resolution][ratio]
+                print(
+                    f"  {resolution}px ratio {ratio:.2f}: {timing['median_ms'] / 1000:.2f}s "
+                    f"({entry['speedup']:.2f}x, rel. error {entry['relative_error']:.3f})"
+                )
+        gc.collect()
+
+    if not real:
+        print("\nRandom weights: stencil IoU on real stencils needs --model/--checkpoint")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
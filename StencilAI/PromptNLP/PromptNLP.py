@@ -10,11 +10,30 @@ Author: StencilAI
 License: MIT
 """
 
-import spacy
+from functools import lru_cache
 from typing import List
 
-# Load spaCy's English language model for NLP processing
-nlp = spacy.load("en_core_web_sm")
+
+@lru_cache(maxsize=None)
+def get_nlp():
+    """
+    Load spaCy's English language model on first use.
+
+    Importing spaCy and loading the model takes seconds, so it is deferred
+    until a prompt is actually decomposed.
+
+    Returns:
+        spacy.Language: The en_core_web_sm pipeline
+    """
+    import spacy
+    return spacy.load("en_core_web_sm")
+
+
+def __getattr__(name):
+    # Keeps `PromptNLP.nlp` working for existing callers
+    if name == "nlp":
+        return get_nlp()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def clean_np(chunk) -> str:
@@ -97,7 +116,7 @@ def decompose_prompt(prompt: str, keep_modifiers: bool = False,
         >>> decompose_prompt("a brown dog with a red ball")
         ['a dog', 'a ball', 'a dog with a ball']
     """
-    doc = nlp(prompt)
+    doc = get_nlp()(prompt)
 
     # Step 1: Extract and clean all noun phrases
     np_chunks = list(doc.noun_chunks)
@@ -3,22 +3,38 @@ Stencil Image Generator using Stable Diffusion
 
 This module provides a simple interface to generate drawing stencil images
 using pretrained Stable Diffusion models with prompt engineering.
+
+torch and scipy are imported lazily and diffusers/transformers inside the
+functions that load models, so importing this module is cheap; the heavy
+imports happen when the first generator is created.
 """
 
-import torch
-from diffusers import (
-    StableDiffusionPipeline,
-    DPMSolverMultistepScheduler,
-    UNet2DConditionModel,
-    AutoencoderKL,
-    PNDMScheduler
-)
-from transformers import CLIPTextModel, CLIPTokenizer
+from __future__ import annotations
+
 from PIL import Image, ImageOps, ImageEnhance, ImageFilter
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Callable, Hashable, Iterator, AsyncIterator, Tuple, NamedTuple
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import contextlib
+import copy
+import inspect
 import os
+import threading
+import uuid
 import numpy as np
-from scipy import ndimage
+from StencilCache import ResultCache, make_cache_key
+from StencilFastLoad import (
+    fused_artifact_dir, has_fused_artifact, load_fused_artifact, load_fused_pipeline, save_fused_artifact, save_fused_pipeline
+)
+from StencilMetrics import current_rss_mb, metrics
+from StencilSchedulers import DEFAULT_FAST_STEPS, PARTIAL_SCHEDULE_FALLBACK, SCHEDULERS, SchedulerProfiles, make_scheduler
+from StencilStartup import lazy_import
+
+torch = lazy_import("torch")
+ndimage = lazy_import("scipy.ndimage")
 
 
 def _patch_clip_init():
@@ -40,6 +56,786 @@ def _patch_clip_init():
         pass  # transformers not installed yet
 
 
+def _otsu_thresholds(images: np.ndarray) -> np.ndarray:
+    """
+    Compute Otsu's threshold for every image in a stack at once.
+
+    Builds all 256-bin histograms with a single bincount and maximizes the
+    between-class variance along the bin axis, matching skimage's
+    threshold_otsu for uint8 images.
+
+    Args:
+        images: Grayscale uint8 stack of shape (N, H, W)
+
+    Returns:
+        Array of N thresholds
+    """
+    n = images.shape[0]
+    offsets = (np.arange(n, dtype=np.int64) * 256)[:, None]
+    hist = np.bincount((images.reshape(n, -1) + offsets).ravel(), minlength=256 * n)
+    hist = hist.reshape(n, 256).astype(np.float64)
+
+    bins = np.arange(256, dtype=np.float64)
+    weight1 = np.cumsum(hist, axis=1)
+    weight2 = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1]
+
+    # Empty classes give NaN means; their variance is treated as zero
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean1 = np.cumsum(hist * bins, axis=1) / weight1
+        mean2 = (np.cumsum((hist * bins)[:, ::-1], axis=1) / weight2[:, ::-1])[:, ::-1]
+        variance = weight1[:, :-1] * weight2[:, 1:] * (mean1[:, :-1] - mean2[:, 1:]) ** 2
+
+    return np.argmax(np.nan_to_num(variance), axis=1)
+
+
+def clean_stencil_batch(
+    images: np.ndarray,
+    invert_if_needed: bool = True,
+    remove_small_objects: bool = True,
+    min_object_size: int = 100
+) -> np.ndarray:
+    """
+    Convert a stack of grayscale images to clean binary stencils in one pass.
+
+    Vectorized version of StencilGenerator._clean_stencil_image: Otsu
+    thresholds, inversion, small-component removal and closing are each done
+    for the whole stack with a single NumPy/SciPy call. Connectivity and
+    morphology only act within each image, never across the stack.
+
+    Args:
+        images: Grayscale uint8 stack of shape (N, H, W)
+        invert_if_needed: Auto-detect if we need to invert (black on white vs white on black)
+        remove_small_objects: Remove small noise/artifacts
+        min_object_size: Minimum pixel area to keep (removes noise)
+
+    Returns:
+        uint8 stack of shape (N, H, W) with 0 (black subject) and 255 (white background)
+    """
+    # Apply Otsu's thresholds - create stark black and white
+    thresholds = _otsu_thresholds(images)
+    binary = images > thresholds[:, None, None]
+
+    # Invert images that are mostly black (white subject on black background)
+    if invert_if_needed:
+        invert = binary.sum(axis=(1, 2)) < binary[0].size / 2
+        binary[invert] = ~binary[invert]
+
+    # Remove small dark components, labelling with 4-connectivity inside each image only
+    if remove_small_objects:
+        structure = np.zeros((3, 3, 3), dtype=bool)
+        structure[1] = ndimage.generate_binary_structure(2, 1)
+        labeled_array, _ = ndimage.label(~binary, structure=structure)
+
+        component_sizes = np.bincount(labeled_array.ravel())
+        small = component_sizes < min_object_size
+        small[0] = False  # Label 0 is the white background
+        binary[small[labeled_array]] = True
+
+    # Apply slight morphological closing to fill small holes in the subject
+    binary = ndimage.binary_closing(binary, structure=np.ones((1, 3, 3), dtype=bool))
+
+    return binary.astype(np.uint8) * 255
+
+
+# Linear map from SD 1.x/2.x latent channels to approximate RGB in [-1, 1],
+# used for cheap previews instead of a full VAE decode
+LATENT_RGB_FACTORS = [
+    #   R        G        B
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+]
+
+
+def _rgb_to_gray(images: np.ndarray) -> np.ndarray:
+    """
+    Convert a uint8 RGB stack (N, H, W, 3) to grayscale with PIL's "L" weights.
+
+    Uses the same fixed-point arithmetic as Image.convert('L') so results are identical.
+    """
+    rgb = images.astype(np.uint32)
+    gray = rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000
+    return (gray >> 16).astype(np.uint8)
+
+
+class PromptEmbeddingCache:
+    """
+    Bounded LRU cache of CLIP text embeddings.
+
+    Entries are keyed by text encoder identity and the final decorated prompt,
+    so generators that share a text encoder (e.g. the fine-tuned checkpoints,
+    which all reuse the SD-1.5 encoder) also share cached embeddings.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of embeddings to keep (0 disables caching)
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], torch.Tensor]) -> torch.Tensor:
+        """
+        Return the cached embedding for key, computing and storing it on a miss.
+
+        Args:
+            key: Hashable cache key
+            compute: Zero-argument function producing the embedding tensor
+
+        Returns:
+            The cached or freshly computed embedding tensor
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        # Encode outside the lock so concurrent requests for other prompts don't wait
+        value = compute()
+
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def info(self) -> dict:
+        """
+        Get hit/miss counters and current occupancy, for sizing the cache.
+
+        Returns:
+            Dictionary with hits, misses, hit_rate, size and maxsize
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+    def clear(self):
+        """Drop all cached embeddings and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# Shared by every StencilGenerator unless one is given its own cache
+prompt_embedding_cache = PromptEmbeddingCache(maxsize=128)
+
+
+class LatentCache:
+    """
+    Bounded LRU cache of the final latents of recent results, by result id.
+
+    StencilGenerator.vary() re-noises a cached latent partway and denoises
+    only the rest of the schedule, so a variation costs a fraction of a full
+    generation. Entries are small (4 x H/8 x W/8 floats, kept on the CPU).
+    """
+
+    def __init__(self, maxsize: int = 64):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of results to keep (0 disables caching)
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, entry: CachedLatents) -> Optional[str]:
+        """
+        Store a result's latents.
+
+        Args:
+            entry: Latents and the settings that produced them
+
+        Returns:
+            New result id, or None if caching is disabled
+        """
+        if self.maxsize <= 0:
+            return None
+        result_id = uuid.uuid4().hex[:16]
+        with self._lock:
+            self._entries[result_id] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return result_id
+
+    def get(self, result_id: str) -> Optional[CachedLatents]:
+        """Return a result's cached latents (marking them recently used), or None if evicted."""
+        with self._lock:
+            entry = self._entries.get(result_id)
+            if entry is not None:
+                self._entries.move_to_end(result_id)
+            return entry
+
+    def info(self) -> dict:
+        """
+        Get the current occupancy.
+
+        Returns:
+            Dictionary with size and maxsize
+        """
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize}
+
+    def clear(self):
+        """Drop all cached latents."""
+        with self._lock:
+            self._entries.clear()
+
+
+def _module_nbytes(module: torch.nn.Module) -> int:
+    """Return the memory held by a module's parameters and buffers, in bytes."""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+# Distilled tiny autoencoder (TAESD) for the SD 1.x/2.x latent space; a local path also works
+DEFAULT_TINY_VAE = "madebyollin/taesd"
+DECODERS = ("full", "tiny")
+
+# Backends for the text encoder, UNet and VAE decoder (see StencilOnnx)
+ENGINES = ("torch", "compile", "onnx")
+DEFAULT_ONNX_DIR = ".stencil_onnx"
+DEFAULT_COMPILE_DIR = ".stencil_compile"
+# Classifier-free guidance schedules: every step, the first fraction of the steps, until the
+# conditional and unconditional predictions converge, or never (checkpoint models without a
+# negative prompt only)
+GUIDANCE_SCHEDULES = ("full", "truncate", "adaptive", "off")
+# Default guidance_cutoff per schedule: fraction of guided steps, and cosine similarity of the
+# two predictions at which guidance stops
+DEFAULT_GUIDANCE_CUTOFFS = {"truncate": 0.5, "adaptive": 0.99}
+# Step count presets: "custom" uses num_inference_steps as given, "fast" the model's profiled
+# minimal step count for its scheduler (see StencilSchedulers)
+QUALITY_PRESETS = ("custom", "fast")
+# PIL Image.info key holding the id of a result's cached latents (see StencilGenerator.vary)
+RESULT_ID_KEY = "stencil_result_id"
+# PIL Image.info keys of the denoising steps a result took, and how many of them ran the
+# unconditional branch (classifier-free guidance)
+STEPS_RUN_KEY = "stencil_steps_run"
+GUIDED_STEPS_KEY = "stencil_guided_steps"
+
+_tiny_vaes = {}
+_tiny_vaes_lock = threading.Lock()
+
+
+def load_tiny_vae(path: str = DEFAULT_TINY_VAE, device: str = "cpu", dtype: Optional[torch.dtype] = None):
+    """
+    Load a tiny distilled VAE (AutoencoderTiny), shared by every generator on the same device.
+
+    Args:
+        path: Local directory or HuggingFace model ID of the AutoencoderTiny weights
+        device: Device to load onto
+        dtype: Weight dtype (default float32)
+
+    Returns:
+        AutoencoderTiny in eval mode
+    """
+    from diffusers import AutoencoderTiny
+
+    dtype = dtype or torch.float32
+    key = (path, str(device), str(dtype))
+    with _tiny_vaes_lock:
+        if key not in _tiny_vaes:
+            print(f"Loading tiny VAE decoder from {path}...")
+            vae = AutoencoderTiny.from_pretrained(path, torch_dtype=dtype, low_cpu_mem_usage=True)
+            _tiny_vaes[key] = vae.to(device).eval()
+        return _tiny_vaes[key]
+
+
+class ModelPool:
+    """
+    Registry of loaded model components for the fine-tuned checkpoints.
+
+    All fine-tuned checkpoints share the base SD-1.5 tokenizer, text encoder,
+    VAE and scheduler; only the UNet differs. The pool loads the shared
+    components once and keeps up to max_unets UNets resident, evicting the
+    least recently used one when the count or the memory budget is exceeded.
+    Switching between checkpoints that are already resident only costs
+    assembling a new pipeline object.
+
+    Weights are loaded straight into the target dtype with low CPU memory
+    use (safetensors files are memory-mapped), so no fp32 copy is made. With
+    fast_load_dir set, the shared components and each checkpoint's UNet are
+    also saved as fused fast-load artifacts (see StencilFastLoad), the shared
+    ones only once, and later loads read those instead.
+    """
+
+    def __init__(
+        self,
+        base_model: str = "runwayml/stable-diffusion-v1-5",
+        max_unets: int = 2,
+        memory_budget_mb: Optional[float] = None,
+        device: Optional[str] = None,
+        use_fp16: bool = True,
+        fast_load_dir: Optional[str] = None
+    ):
+        """
+        Initialize the model pool. Nothing is loaded until first use.
+
+        Args:
+            base_model: HuggingFace model ID providing the shared components
+            max_unets: Maximum number of UNets to keep resident
+            memory_budget_mb: Maximum memory for resident UNets in MB (None for no limit)
+            device: Device to load onto ('cuda', 'cpu', or None for auto-detect)
+            use_fp16: Whether to load components in half precision (CUDA only)
+            fast_load_dir: Directory for fused fast-load artifacts (None to disable)
+        """
+        self.base_model = base_model
+        self.max_unets = max(1, max_unets)
+        self.memory_budget_mb = memory_budget_mb
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.use_fp16 = use_fp16 and self.device == "cuda"
+        self.fast_load_dir = fast_load_dir
+
+        self.unet_hits = 0
+        self.unet_misses = 0
+        self.unet_evictions = 0
+
+        self._shared = None
+        self._unets = OrderedDict()  # checkpoint_path -> (unet, nbytes)
+        self._quantized = {}  # (component, checkpoint_path or None, mode) -> (quantized copy, layer count)
+        self._lock = threading.RLock()
+
+    @property
+    def dtype(self) -> torch.dtype:
+        """Dtype components are loaded in."""
+        return torch.float16 if self.use_fp16 else torch.float32
+
+    def _place(self, module: torch.nn.Module) -> torch.nn.Module:
+        """Move a module to the pool's device, casting to FP16 if enabled and not loaded that way."""
+        if module.dtype != self.dtype:
+            module = module.to(dtype=self.dtype)
+        return module.to(self.device)
+
+    def fast_load_path(self, checkpoint_path: str) -> Optional[str]:
+        """
+        Get the fused artifact directory for a checkpoint's UNet at the pool's dtype.
+
+        Args:
+            checkpoint_path: Local checkpoint directory or HuggingFace Hub model ID
+
+        Returns:
+            Artifact directory (which may not exist yet), or None if fast loading is disabled
+        """
+        if self.fast_load_dir is None:
+            return None
+        return fused_artifact_dir(self.fast_load_dir, checkpoint_path, self.dtype, suffix="-unet")
+
+    def shared_load_path(self) -> Optional[str]:
+        """Get the fused artifact directory for the shared components, or None if fast loading is disabled."""
+        if self.fast_load_dir is None:
+            return None
+        return fused_artifact_dir(self.fast_load_dir, self.base_model, self.dtype, suffix="-shared")
+
+    def shared_components(self) -> dict:
+        """
+        Get the shared tokenizer, text encoder, VAE and scheduler, loading them on first use.
+
+        They are read from the shared fused artifact if there is one, else
+        loaded from base_model (and saved as that artifact if fast loading
+        is enabled).
+
+        Returns:
+            Dictionary with tokenizer, text_encoder, vae and scheduler
+        """
+        from diffusers import AutoencoderKL, PNDMScheduler
+        from transformers import CLIPTextModel, CLIPTokenizer
+
+        with self._lock:
+            artifact = self.shared_load_path()
+            if self._shared is None and has_fused_artifact(artifact):
+                print(f"Loading shared components from fused artifact {artifact}...")
+                components = load_fused_artifact(
+                    artifact, self.device, ["tokenizer", "text_encoder", "vae", "scheduler"]
+                )
+                self._shared = {
+                    "tokenizer": components["tokenizer"],
+                    "text_encoder": self._place(components["text_encoder"]),
+                    "vae": self._place(components["vae"]),
+                    "scheduler": components["scheduler"],
+                }
+
+            if self._shared is None:
+                print("Loading tokenizer...")
+                tokenizer = CLIPTokenizer.from_pretrained(self.base_model, subfolder="tokenizer")
+
+                print("Loading text encoder...")
+                text_encoder = CLIPTextModel.from_pretrained(
+                    self.base_model, subfolder="text_encoder", torch_dtype=self.dtype, low_cpu_mem_usage=True
+                )
+
+                print("Loading VAE...")
+                vae = AutoencoderKL.from_pretrained(
+                    self.base_model, subfolder="vae", torch_dtype=self.dtype, low_cpu_mem_usage=True
+                )
+
+                print("Loading scheduler...")
+                scheduler = PNDMScheduler.from_pretrained(self.base_model, subfolder="scheduler")
+
+                self._shared = {
+                    "tokenizer": tokenizer,
+                    "text_encoder": self._place(text_encoder),
+                    "vae": self._place(vae),
+                    "scheduler": scheduler,
+                }
+                if artifact is not None:
+                    save_fused_artifact(artifact, source=self.base_model, **self._shared)
+            return self._shared
+
+    def _load_unet(self, checkpoint_path: str) -> UNet2DConditionModel:
+        """
+        Load a fine-tuned UNet from a checkpoint directory or HuggingFace Hub.
+
+        Args:
+            checkpoint_path: Path to checkpoint directory containing UNet,
+                           or HuggingFace Hub model ID (e.g., "username/model-name")
+        """
+        artifact = self.fast_load_path(checkpoint_path)
+        if has_fused_artifact(artifact):
+            print(f"Loading fine-tuned UNet from fused artifact {artifact}...")
+            return self._place(load_fused_artifact(artifact, self.device, ["unet"])["unet"])
+
+        # Handles both local paths and HuggingFace Hub model IDs
+        if os.path.exists(checkpoint_path):
+            # Local path - append /unet subdirectory
+            unet_path = f"{checkpoint_path}/unet"
+        else:
+            # Assume it's a HuggingFace Hub model ID
+            unet_path = checkpoint_path
+
+        from diffusers import UNet2DConditionModel
+
+        print(f"Loading fine-tuned UNet from {unet_path}...")
+        unet = UNet2DConditionModel.from_pretrained(
+            unet_path,
+            subfolder="unet" if not os.path.exists(checkpoint_path) else None,
+            torch_dtype=self.dtype,
+            low_cpu_mem_usage=True
+        )
+        return self._place(unet)
+
+    def _evict(self):
+        """Evict least recently used UNets until the count and memory budget are respected."""
+        budget = self.memory_budget_mb * 1024 ** 2 if self.memory_budget_mb is not None else None
+
+        # Always keep the most recently used UNet, even if it alone exceeds the budget
+        while len(self._unets) > 1 and (
+            len(self._unets) > self.max_unets
+            or (budget is not None and self.resident_bytes() > budget)
+        ):
+            evicted_path, _ = self._unets.popitem(last=False)
+            self._quantized = {key: value for key, value in self._quantized.items() if key[1] != evicted_path}
+            self.unet_evictions += 1
+            print(f"Evicting UNet for {evicted_path} from model pool")
+
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+
+    def get_unet(self, checkpoint_path: str) -> UNet2DConditionModel:
+        """
+        Get the UNet for a checkpoint, loading it (and evicting others) if not resident.
+
+        Args:
+            checkpoint_path: Local checkpoint directory or HuggingFace Hub model ID
+
+        Returns:
+            The fine-tuned UNet on the pool's device
+        """
+        with self._lock:
+            if checkpoint_path in self._unets:
+                self._unets.move_to_end(checkpoint_path)
+                self.unet_hits += 1
+                return self._unets[checkpoint_path][0]
+
+            self.unet_misses += 1
+            unet = self._load_unet(checkpoint_path)
+            self._unets[checkpoint_path] = (unet, _module_nbytes(unet))
+            self._evict()
+            return unet
+
+    def quantized(self, component: str, module: torch.nn.Module, mode: str, checkpoint_path: Optional[str] = None):
+        """
+        Get an int8-quantized copy of a pooled module, quantizing it on first request.
+
+        The pooled module itself stays in full precision for other generators;
+        quantized UNets are dropped with their UNet.
+
+        Args:
+            component: "text_encoder" or "unet"
+            module: The pooled module
+            mode: Quantization mode (see StencilQuantize.QUANTIZATION_MODES)
+            checkpoint_path: Checkpoint the UNet belongs to (None for shared components)
+
+        Returns:
+            Tuple of (quantized copy, number of quantized Linear layers)
+        """
+        from StencilQuantize import quantize_linear_layers
+
+        key = (component, checkpoint_path, mode)
+        with self._lock:
+            if key not in self._quantized:
+                self._quantized[key] = quantize_linear_layers(copy.deepcopy(module), mode)
+            return self._quantized[key]
+
+    def build_pipeline(self, checkpoint_path: str) -> StableDiffusionPipeline:
+        """
+        Assemble a pipeline from the shared components and a checkpoint's UNet.
+
+        Args:
+            checkpoint_path: Local checkpoint directory or HuggingFace Hub model ID
+
+        Returns:
+            StableDiffusionPipeline ready for inference on the pool's device
+        """
+        from diffusers import StableDiffusionPipeline
+
+        shared = self.shared_components()
+        unet = self.get_unet(checkpoint_path)
+
+        print("Assembling pipeline...")
+        pipe = StableDiffusionPipeline(
+            vae=shared["vae"],
+            text_encoder=shared["text_encoder"],
+            tokenizer=shared["tokenizer"],
+            unet=unet,
+            # Schedulers keep per-run state, so every pipeline gets its own instance
+            scheduler=shared["scheduler"].__class__.from_config(shared["scheduler"].config),
+            safety_checker=None,
+            feature_extractor=None,
+            requires_safety_checker=False
+        )
+
+        artifact = self.fast_load_path(checkpoint_path)
+        if artifact is not None and not has_fused_artifact(artifact):
+            save_fused_artifact(artifact, source=checkpoint_path, unet=unet)
+        return pipe
+
+    def resident_bytes(self) -> int:
+        """Return the memory held by resident UNets, in bytes."""
+        with self._lock:
+            return sum(nbytes for _, nbytes in self._unets.values())
+
+    def info(self) -> dict:
+        """
+        Get pool statistics.
+
+        Returns:
+            Dictionary with resident checkpoints, UNet memory, quantized copies and hit/miss/eviction counters
+        """
+        with self._lock:
+            return {
+                "resident": list(self._unets.keys()),
+                "resident_mb": self.resident_bytes() / 1024 ** 2,
+                "shared_loaded": self._shared is not None,
+                "quantized": len(self._quantized),
+                "hits": self.unet_hits,
+                "misses": self.unet_misses,
+                "evictions": self.unet_evictions,
+            }
+
+
+class DenoiseStep(NamedTuple):
+    """State after one denoising step, as yielded by StencilGenerator._iter_denoise."""
+
+    index: int
+    timestep: torch.Tensor
+    latents: torch.Tensor
+    denoised: torch.Tensor  # Current estimate of the fully denoised latents
+    guided_steps: int  # Steps so far that ran the unconditional branch
+
+
+class GenerationPreview(NamedTuple):
+    """An update from StencilGenerator.generate_stream."""
+
+    step: int
+    total_steps: int
+    images: List[Image.Image]
+    final: bool
+
+
+class GenerationResult(NamedTuple):
+    """The images for one request, as yielded by StencilGenerator.generate_many."""
+
+    index: int
+    request: GenerationRequest
+    images: List[Image.Image]
+
+
+class GenerationCancelled(Exception):
+    """Raised inside a generation when its CancellationToken has been cancelled."""
+
+
+class CancellationToken:
+    """Thread-safe flag used to abandon a running generation between denoising steps."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Request cancellation; the generation stops before its next step."""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether cancellation has been requested."""
+        return self._event.is_set()
+
+
+@dataclass
+class GenerationRequest:
+    """
+    Per-request settings for a batched generation.
+
+    Requests batched together share size and step count (passed separately),
+    but each keeps its own prompt, seed and guidance scale.
+    """
+
+    prompt: str
+    num_images: int = 1
+    negative_prompt: Optional[str] = None
+    guidance_scale: float = 7.5
+    seed: Optional[int] = None
+    add_stencil_suffix: bool = True
+    clean_background: bool = True
+    cancel_token: Optional[CancellationToken] = field(default=None, compare=False)
+
+
+@dataclass
+class CachedLatents:
+    """
+    Final latents of one generated image, kept for StencilGenerator.vary().
+
+    The request is the single-image request that produced it; width and
+    height are the requested output size (the latents may be at a compile
+    bucket size).
+    """
+
+    model: str
+    request: GenerationRequest
+    latents: torch.Tensor
+    num_inference_steps: int
+    width: int
+    height: int
+    guidance_schedule: str = "full"
+    guidance_cutoff: Optional[float] = None
+
+
+@dataclass
+class MemoryPlan:
+    """
+    Memory-saving measures for a generation, each trading some speed for lower peak memory.
+
+    attention_slicing: None, "auto" (half the heads at a time) or "max" (one head at a time)
+    vae_slicing: Decode the batch one image at a time
+    sequential_cfg: Run the unconditional and conditional UNet passes one after the other
+                    instead of as one doubled batch
+    vae_tiling: Decode in overlapping tiles (for large images)
+    offload: Keep models on the CPU and move each to the GPU only while it runs (CUDA only)
+    """
+
+    attention_slicing: Optional[str] = None
+    vae_slicing: bool = False
+    sequential_cfg: bool = False
+    vae_tiling: bool = False
+    offload: bool = False
+
+    def describe(self) -> str:
+        """Return a short description of the enabled measures, e.g. "attention_slicing=auto, vae_slicing"."""
+        parts = []
+        if self.attention_slicing:
+            parts.append(f"attention_slicing={self.attention_slicing}")
+        parts += [name for name in ("vae_slicing", "sequential_cfg", "vae_tiling", "offload") if getattr(self, name)]
+        return ", ".join(parts) or "none"
+
+
+# Memory plans tried in order under a memory budget, from fastest to leanest
+MEMORY_PLANS = [
+    MemoryPlan(),
+    MemoryPlan(attention_slicing="auto"),
+    MemoryPlan(attention_slicing="auto", vae_slicing=True),
+    MemoryPlan(attention_slicing="auto", vae_slicing=True, sequential_cfg=True),
+    MemoryPlan(attention_slicing="max", vae_slicing=True, sequential_cfg=True),
+    MemoryPlan(attention_slicing="max", vae_slicing=True, sequential_cfg=True, vae_tiling=True),
+    MemoryPlan(attention_slicing="max", vae_slicing=True, sequential_cfg=True, vae_tiling=True, offload=True),
+]
+
+
+def _has_sdpa() -> bool:
+    """Whether torch has fused scaled_dot_product_attention, which diffusers uses by default."""
+    return hasattr(torch.nn.functional, "scaled_dot_product_attention")
+
+
+def _tile_starts(length: int, tile: int, stride: int) -> List[int]:
+    """Return tile offsets along one axis: every stride, plus one flush with the far edge."""
+    if length <= tile:
+        return [0]
+    return list(range(0, length - tile, stride)) + [length - tile]
+
+
+def _tile_weights(height: int, width: int, overlap: int) -> torch.Tensor:
+    """
+    Feathered blending weights for one latent tile.
+
+    Weights ramp linearly from the tile's edges over the overlap, so every
+    pixel's prediction fades in and out across seams instead of switching abruptly.
+
+    Args:
+        height: Tile height in latent pixels
+        width: Tile width in latent pixels
+        overlap: Overlap between neighbouring tiles in latent pixels
+
+    Returns:
+        Weight map of shape (1, 1, height, width), all positive
+    """
+    def ramp(n: int) -> torch.Tensor:
+        position = torch.arange(n, dtype=torch.float32)
+        return (torch.minimum(position + 1, n - position) / (overlap + 1)).clamp(max=1.0)
+
+    return (ramp(height)[:, None] * ramp(width)[None, :])[None, None]
+
+
+def _as_generation_request(spec: Union[GenerationRequest, tuple, dict]) -> GenerationRequest:
+    """
+    Turn a generate_many() spec into a GenerationRequest.
+
+    Args:
+        spec: A GenerationRequest, a (prompt, seed, num_images) tuple (seed
+              and num_images optional) or a dict of GenerationRequest fields
+
+    Returns:
+        The GenerationRequest
+    """
+    if isinstance(spec, GenerationRequest):
+        return spec
+    if isinstance(spec, dict):
+        return GenerationRequest(**spec)
+    if isinstance(spec, str):
+        return GenerationRequest(prompt=spec)
+
+    spec = tuple(spec)
+    prompt, seed, num_images = spec + (None, None, 1)[len(spec):]
+    return GenerationRequest(prompt=prompt, seed=seed, num_images=num_images)
+
+
 class StencilGenerator:
     """
     A class to generate drawing stencil images using Stable Diffusion.
@@ -48,13 +844,44 @@ class StencilGenerator:
     to guide the model toward producing black and white stencil-style images.
     """
 
+    # Worker threads in the executor used by agenerate()
+    ASYNC_WORKERS = 4
+
+    # UNet batch sizing for generate_many()
+    CPU_BATCH_IMAGES = 4
+    MAX_BATCH_IMAGES = 16
+    BYTES_PER_IMAGE_512 = 768 * 2**20  # Rough CUDA activation memory per 512x512 image with CFG, FP16
+
+    # Rough, deliberately conservative activation model used to pick a MemoryPlan
+    UNET_ELEMENTS_PER_LATENT_PIXEL = 5000  # Live SD UNet activations (skips + one block) per latent pixel per row
+    ATTENTION_HEADS = 8  # Heads in the highest-resolution self-attention
+    VAE_ELEMENTS_PER_CHANNEL_PIXEL = 6  # Live full-resolution VAE decoder activations, per channel per pixel
+    VAE_TILE_PIXELS = 512 * 512  # Output pixels per VAE tile with tiling on
+
     def __init__(
         self,
         model_id: str = "Manojb/stable-diffusion-2-1-base",
         # model_id: str = "runwayml/stable-diffusion-v1-5",
         checkpoint_path: Optional[str] = None,
         device: Optional[str] = None,
-        use_fp16: bool = True
+        use_fp16: bool = True,
+        embedding_cache: Optional[PromptEmbeddingCache] = None,
+        model_pool: Optional[ModelPool] = None,
+        result_cache: Optional[ResultCache] = None,
+        fast_load_dir: Optional[str] = None,
+        decoder: str = "full",
+        tiny_vae_path: str = DEFAULT_TINY_VAE,
+        memory_budget_mb: Optional[float] = None,
+        cpu_precision: str = "fp32",
+        engine: str = "torch",
+        onnx_dir: str = DEFAULT_ONNX_DIR,
+        compile_dir: str = DEFAULT_COMPILE_DIR,
+        compile_resolutions: Optional[List[Tuple[int, int]]] = None,
+        step_cache_interval: int = 1,
+        token_merge_ratio: float = 0.0,
+        scheduler: Optional[str] = None,
+        scheduler_profiles: Optional[SchedulerProfiles] = None,
+        latent_cache: Optional[LatentCache] = None
     ):
         """
         Initialize the Stencil Generator.
@@ -65,23 +892,113 @@ class StencilGenerator:
                            If provided, loads fine-tuned model instead of pretrained model
             device: Device to run on ('cuda', 'cpu', or None for auto-detect)
             use_fp16: Whether to use half precision (FP16) for faster inference
+            embedding_cache: Prompt embedding cache to use (defaults to the shared module-level cache)
+            model_pool: Model pool to take shared components and UNets from when loading a
+                        checkpoint. Its device and precision override device and use_fp16.
+            result_cache: Cache of finished images for seeded generate() calls (None to disable)
+            fast_load_dir: Directory for fused fast-load artifacts: loaded from if present,
+                           written after a normal load otherwise (None to disable).
+                           A model_pool uses its own fast_load_dir instead.
+            decoder: Latent decoder: "full" (the model's VAE) or "tiny" (a distilled
+                     AutoencoderTiny; much cheaper, and good enough once the output is
+                     thresholded to a binary stencil)
+            tiny_vae_path: Local directory or HuggingFace model ID of the tiny decoder
+            memory_budget_mb: Cap on VRAM (CUDA) or process RSS (CPU) during generation. Before
+                              each batch the fastest MemoryPlan estimated to fit is applied, and
+                              the peak memory is reported in last_memory_report (None to disable)
+            cpu_precision: CPU inference precision (see StencilQuantize): "fp32", "bf16"
+                           (autocast), "int8" (dynamic int8 Linear layers in the text encoder
+                           and UNet) or "int8-bf16" (weight-only int8 with bf16 autocast).
+                           Ignored on CUDA, where use_fp16 applies instead.
+            engine: "torch"; "compile" to run the UNet and VAE decoder through torch.compile
+                    with static shape buckets (see StencilCompile; requests are generated at
+                    the nearest bucket resolution); or "onnx" to run the text encoder, UNet
+                    and VAE decoder with ONNX Runtime on CPU (fp32 only; graphs are exported
+                    on first use)
+            onnx_dir: Directory caching the exported ONNX graphs, keyed by weights hash
+            compile_dir: Directory for the persistent torch.compile cache
+            compile_resolutions: (width, height) buckets for the compile engine
+                                 (None for StencilCompile.COMPILE_RESOLUTIONS)
+            step_cache_interval: Run the full UNet only every this many steps and reuse its
+                                 deep features in between (see StencilStepCache; torch
+                                 engine only, 1 to disable)
+            token_merge_ratio: Fraction of the highest-resolution self-attention tokens to merge
+                               away (see StencilTokenMerge; torch engine only, 0 to disable)
+            scheduler: Key of StencilSchedulers.SCHEDULERS (None for the model's default:
+                       "dpm++" for pretrained models, "pndm" for checkpoints)
+            scheduler_profiles: Profiled step counts for the "fast" quality preset (None to
+                                use StencilSchedulers.DEFAULT_FAST_STEPS)
+            latent_cache: Cache of recent results' final latents for vary() (defaults to a
+                          private LatentCache; pass LatentCache(maxsize=0) to disable)
         """
         self.model_id = model_id
         self.checkpoint_path = checkpoint_path
-        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
-        self.use_fp16 = use_fp16 and self.device == "cuda"
+        self.model_pool = model_pool
+        self.result_cache = result_cache
+        self.fast_load_dir = fast_load_dir
+        if model_pool is not None and checkpoint_path is not None:
+            self.device = model_pool.device
+            self.use_fp16 = model_pool.use_fp16
+        else:
+            self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+            self.use_fp16 = use_fp16 and self.device == "cuda"
         self.is_checkpoint_model = checkpoint_path is not None
+        self.embedding_cache = embedding_cache if embedding_cache is not None else prompt_embedding_cache
+        self._default_negative_embeds = None
+        self._executor = None  # Created on first agenerate() call
+        self._executor_lock = threading.Lock()
+        self.tiny_vae_path = tiny_vae_path
+        self._tiny_vae = None  # Loaded when the tiny decoder is first selected
+        self.memory_budget_mb = memory_budget_mb
+        self.memory_plan = None  # Fixed MemoryPlan to use instead of choosing one from the budget
+        self.last_memory_report = None  # Plan, estimate and peak memory of the last bounded run
+        self._applied_plan = None
+        self._offloaded = False
+        self.cpu_precision = "fp32"
+        self._cpu_autocast = False
+        self.engine = "torch"
+        self.onnx_dir = onnx_dir
+        self.compile_dir = compile_dir
+        self.compile_resolutions = compile_resolutions
+        self._backend = None  # OnnxEngine or CompileEngine unless engine is "torch"
+        self.step_cache_interval = 1
+        self.token_merge_ratio = 0.0
+        self.scheduler_profiles = scheduler_profiles
+        self.latent_cache = latent_cache if latent_cache is not None else LatentCache()
+        self.set_decoder(decoder)
 
         # Apply monkey-patch to fix transformers version compatibility
         _patch_clip_init()
 
         # Load model based on whether checkpoint is provided
-        if self.is_checkpoint_model:
-            self._load_from_checkpoint(checkpoint_path)
+        with metrics.stage("model_load", reset_peak_rss=True, model=checkpoint_path or model_id) as load:
+            if self.is_checkpoint_model:
+                self._load_from_checkpoint(checkpoint_path)
+            else:
+                self._load_from_pretrained(model_id)
+
+        # Registered schedulers are built from the model's own scheduler config
+        self._scheduler_config = self.pipe.scheduler.config
+        self.default_scheduler = "pndm" if self.is_checkpoint_model else "dpm++"
+        self.scheduler = self.default_scheduler
+        if scheduler is not None and scheduler != self.default_scheduler:
+            self.set_scheduler(scheduler)
+
+        if self.decoder == "tiny":
+            self.set_decoder("tiny")
+        if cpu_precision != "fp32":
+            self.set_cpu_precision(cpu_precision)
+        if engine != "torch":
+            self.set_engine(engine)
+        if step_cache_interval != 1:
+            self.set_step_cache(step_cache_interval)
+        if token_merge_ratio:
+            self.set_token_merging(token_merge_ratio)
+
+        if load:
+            print(f"Model loaded successfully in {load['wall_ms'] / 1000:.1f}s (peak RSS {load['peak_rss_mb']:.0f} MB)")
         else:
-            self._load_from_pretrained(model_id)
-
-        print("Model loaded successfully!")
+            print("Model loaded successfully!")
 
         # Set prompt decoration based on model type
         if self.is_checkpoint_model:
@@ -105,23 +1022,37 @@ class StencilGenerator:
         Args:
             model_id: HuggingFace model ID
         """
+        from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
+
         print(f"Loading pretrained model {model_id} on {self.device}...")
+        self.text_encoder_id = model_id
 
         # Load the pipeline with version-compatible parameters
         dtype = torch.float16 if self.use_fp16 else torch.float32
 
-        self.pipe = StableDiffusionPipeline.from_pretrained(
-            model_id,
-            torch_dtype=dtype,
-            safety_checker=None,  # Disable for faster loading
-        )
+        artifact = fused_artifact_dir(self.fast_load_dir, model_id, dtype) if self.fast_load_dir else None
+        if has_fused_artifact(artifact):
+            # Weights go straight from the mmap'd file to the device in the right dtype
+            print(f"Loading from fused artifact {artifact}...")
+            self.pipe = load_fused_pipeline(artifact, device=self.device)
+        else:
+            # Loads directly in the target dtype from mmap'd safetensors, without an fp32 copy
+            self.pipe = StableDiffusionPipeline.from_pretrained(
+                model_id,
+                torch_dtype=dtype,
+                low_cpu_mem_usage=True,
+                safety_checker=None,  # Disable for faster loading
+            )
 
-        # Use DPM-Solver for faster generation
-        self.pipe.scheduler = DPMSolverMultistepScheduler.from_config(
-            self.pipe.scheduler.config
-        )
+            # Use DPM-Solver for faster generation
+            self.pipe.scheduler = DPMSolverMultistepScheduler.from_config(
+                self.pipe.scheduler.config
+            )
+
+            self.pipe = self.pipe.to(self.device)
 
-        self.pipe = self.pipe.to(self.device)
+            if artifact is not None:
+                save_fused_pipeline(self.pipe, artifact, source=model_id)
 
         # Enable memory optimizations
         if self.device == "cuda":
@@ -133,62 +1064,184 @@ class StencilGenerator:
         """
         Load a fine-tuned model from checkpoint directory or HuggingFace Hub.
 
+        The shared base components and the UNet come from the model pool, so
+        switching between checkpoints already resident in the pool is cheap.
+        Without a pool, a private single-UNet pool is used.
+
         Args:
             checkpoint_path: Path to checkpoint directory containing UNet,
                            or HuggingFace Hub model ID (e.g., "username/model-name")
         """
         print(f"Loading fine-tuned checkpoint from {checkpoint_path} on {self.device}...")
 
-        # Base model for standard components
-        base_model = "runwayml/stable-diffusion-v1-5"
-
-        print("Loading tokenizer...")
-        tokenizer = CLIPTokenizer.from_pretrained(base_model, subfolder="tokenizer")
+        pool = self.model_pool or ModelPool(
+            device=self.device, use_fp16=self.use_fp16, max_unets=1, fast_load_dir=self.fast_load_dir
+        )
+        self.text_encoder_id = pool.base_model
+        self.pipe = pool.build_pipeline(checkpoint_path)
 
-        print("Loading text encoder...")
-        text_encoder = CLIPTextModel.from_pretrained(base_model, subfolder="text_encoder")
+    def set_decoder(self, decoder: str):
+        """
+        Select the decoder used to turn final latents into pixels.
 
-        print("Loading VAE...")
-        vae = AutoencoderKL.from_pretrained(base_model, subfolder="vae")
+        The tiny decoder is loaded on first selection (after the model, so it
+        matches the model's device and precision).
 
-        print("Loading scheduler...")
-        scheduler = PNDMScheduler.from_pretrained(base_model, subfolder="scheduler")
+        Args:
+            decoder: "full" for the model's VAE, "tiny" for the distilled AutoencoderTiny
+        """
+        if decoder not in DECODERS:
+            raise ValueError(f"Unknown decoder '{decoder}', expected one of {DECODERS}")
+        self.decoder = decoder
+        if decoder == "tiny" and self._tiny_vae is None and hasattr(self, "pipe"):
+            self._tiny_vae = load_tiny_vae(self.tiny_vae_path, self.device, self.pipe.vae.dtype)
 
-        # Load fine-tuned UNet from checkpoint
-        # Handles both local paths and HuggingFace Hub model IDs
-        if os.path.exists(checkpoint_path):
-            # Local path - append /unet subdirectory
-            unet_path = f"{checkpoint_path}/unet"
-        else:
-            # Assume it's a HuggingFace Hub model ID
-            unet_path = checkpoint_path
+    def set_cpu_precision(self, precision: str):
+        """
+        Switch CPU inference to a cheaper precision.
 
-        print(f"Loading fine-tuned UNet from {unet_path}...")
-        unet = UNet2DConditionModel.from_pretrained(unet_path, subfolder="unet" if not os.path.exists(checkpoint_path) else None)
+        Quantization replaces the Linear layers of the loaded text encoder and
+        UNet, so it can't be undone on this generator; load a new one to go
+        back to fp32. Components shared through a model pool are quantized
+        as copies cached in the pool, so other generators keep their fp32
+        weights and later generators of the same checkpoint reuse the copies.
 
-        # Assemble pipeline
-        print("Assembling pipeline...")
-        self.pipe = StableDiffusionPipeline(
-            vae=vae,
-            text_encoder=text_encoder,
-            tokenizer=tokenizer,
-            unet=unet,
-            scheduler=scheduler,
-            safety_checker=None,
-            feature_extractor=None,
-            requires_safety_checker=False
-        )
+        Args:
+            precision: "bf16", "int8" or "int8-bf16" (see StencilQuantize)
+        """
+        from StencilQuantize import CPU_PRECISIONS, QUANTIZATION_MODES, cpu_supports_bf16, quantize_linear_layers
+
+        if precision not in CPU_PRECISIONS:
+            raise ValueError(f"Unknown CPU precision '{precision}', expected one of {CPU_PRECISIONS}")
+        if self.device != "cpu":
+            print(f"CPU precision '{precision}' ignored on {self.device}")
+            return
+        if self.cpu_precision != "fp32":
+            raise RuntimeError(f"CPU precision is already '{self.cpu_precision}'; load a new generator to change it")
+        if self.engine != "torch":
+            raise RuntimeError(f"CPU precision applies to the torch engine, not '{self.engine}'")
+
+        wants_bf16 = precision.endswith("bf16")
+        if wants_bf16 and not cpu_supports_bf16():
+            print("This CPU has no native bf16 support; keeping fp32 activations")
+            wants_bf16 = False
+
+        mode = QUANTIZATION_MODES.get(precision)
+        if mode is not None:
+            with metrics.stage("quantize", mode=mode) as record:
+                for name in ("text_encoder", "unet"):
+                    module = getattr(self.pipe, name)
+                    if self.model_pool is not None and self.is_checkpoint_model:
+                        checkpoint_path = self.checkpoint_path if name == "unet" else None
+                        module, count = self.model_pool.quantized(name, module, mode, checkpoint_path)
+                    else:
+                        module, count = quantize_linear_layers(module, mode)
+                    setattr(self.pipe, name, module)
+                    print(f"Quantized {count} Linear layers of the {name} to int8 ({mode})")
+            if record:
+                print(f"Quantization took {record['wall_ms'] / 1000:.1f}s")
+
+        self.cpu_precision = precision
+        self._cpu_autocast = wants_bf16
+        self._default_negative_embeds = None
+
+    def set_engine(self, engine: str):
+        """
+        Select the backend that runs the text encoder, UNet and VAE decoder.
 
-        # Move to device with FP16 if enabled
-        if self.device == "cuda":
-            if self.use_fp16:
-                self.pipe.vae = self.pipe.vae.to(self.device, dtype=torch.float16)
-                self.pipe.text_encoder = self.pipe.text_encoder.to(self.device, dtype=torch.float16)
-                self.pipe.unet = self.pipe.unet.to(self.device, dtype=torch.float16)
-            else:
-                self.pipe = self.pipe.to(self.device)
+        The first switch to "onnx" for a set of weights exports them to
+        onnx_dir, which takes minutes for an SD-sized UNet; later loads of the
+        same weights reuse the export. "compile" compiles each shape bucket on
+        first use (or in precompile()) and caches the kernels in compile_dir.
+        The torch modules stay loaded for the scheduler setup, tiled decodes
+        and memory estimates.
+
+        Args:
+            engine: "torch", "compile" or "onnx" (CPU, fp32)
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+        if engine == self.engine:
+            return
+        if engine == "onnx":
+            if self.device != "cpu":
+                print(f"ONNX engine ignored on {self.device}")
+                return
+            if self.cpu_precision != "fp32":
+                raise ValueError(f"The ONNX engine runs fp32 graphs, not cpu_precision '{self.cpu_precision}'")
+            from StencilOnnx import OnnxEngine
+            self._backend = OnnxEngine(self.pipe, self.onnx_dir, source=self.checkpoint_path or self.model_id)
+        elif engine == "compile":
+            from StencilCompile import CompileEngine
+            self._backend = CompileEngine(self.pipe, self.compile_dir, resolutions=self.compile_resolutions)
         else:
-            self.pipe = self.pipe.to(self.device)
+            self._backend = None
+        self.engine = engine
+        self._default_negative_embeds = None
+
+    def set_step_cache(self, interval: int):
+        """
+        Reuse deep UNet features across denoising steps (DeepCache).
+
+        Every interval-th step runs the full UNet; the steps in between run
+        only its outermost resolution level on the cached deep features.
+        Applies to the torch engine; compiled and ONNX graphs always run whole.
+
+        Args:
+            interval: Full-UNet interval in steps (1 disables reuse)
+        """
+        if interval < 1:
+            raise ValueError(f"Step cache interval must be at least 1, got {interval}")
+        if interval > 1 and self.engine != "torch":
+            print(f"Step cache ignored with the {self.engine} engine")
+        self.step_cache_interval = interval
+
+    def set_token_merging(self, ratio: float):
+        """
+        Merge redundant tokens around the UNet's high-resolution self-attention (ToMe).
+
+        Self-attention dominates UNet time at 768-1024 px; merging half the
+        tokens roughly quarters its cost. Applies to the torch engine.
+
+        Args:
+            ratio: Fraction of tokens to merge away, 0 (off) to 0.75
+        """
+        if not 0 <= ratio <= 0.75:
+            raise ValueError(f"Token merge ratio must be between 0 and 0.75, got {ratio}")
+        if ratio and self.engine != "torch":
+            print(f"Token merging ignored with the {self.engine} engine")
+        self.token_merge_ratio = ratio
+
+    def set_scheduler(self, scheduler: str):
+        """
+        Switch the denoising scheduler.
+
+        Args:
+            scheduler: Key of StencilSchedulers.SCHEDULERS
+        """
+        if scheduler not in SCHEDULERS:
+            raise ValueError(f"Unknown scheduler '{scheduler}', expected one of {tuple(SCHEDULERS)}")
+        self.pipe.scheduler = make_scheduler(scheduler, self._scheduler_config)
+        self.scheduler = scheduler
+        print(f"Scheduler: {scheduler}")
+
+    def recommended_steps(self) -> int:
+        """
+        Get the minimal step count for this model and scheduler, used by the "fast" preset.
+
+        Returns:
+            The profiled step count, or DEFAULT_FAST_STEPS for the scheduler if not profiled
+        """
+        steps = None
+        if self.scheduler_profiles is not None:
+            steps = self.scheduler_profiles.recommended_steps(self.checkpoint_path or self.model_id, self.scheduler)
+        return steps if steps is not None else DEFAULT_FAST_STEPS[self.scheduler]
+
+    def _preset_steps(self, num_inference_steps: int, quality_preset: str) -> int:
+        """Resolve a quality preset to the number of denoising steps to run (never more than requested)."""
+        if quality_preset not in QUALITY_PRESETS:
+            raise ValueError(f"Unknown quality preset '{quality_preset}', expected one of {QUALITY_PRESETS}")
+        return min(self.recommended_steps(), num_inference_steps) if quality_preset == "fast" else num_inference_steps
 
     def _clean_stencil_image(
         self,
@@ -204,78 +1257,1173 @@ class StencilGenerator:
         a clean black silhouette on pure white background, regardless
         of what the model generated.
 
+        Single-image wrapper around clean_stencil_batch; generate() cleans
+        whole batches at once instead.
+
         Args:
             image: Input PIL Image
-            binary_threshold: Threshold for binarization (0-255), 128 = middle
+            binary_threshold: Unused; the threshold is always found with Otsu's method
             invert_if_needed: Auto-detect if we need to invert (black on white vs white on black)
             remove_small_objects: Remove small noise/artifacts
             min_object_size: Minimum pixel area to keep (removes noise)
 
         Returns:
-            Pure black and white stencil image
+            Pure black and white single-channel ('L') stencil image
         """
         # Convert to grayscale first
         if image.mode != 'L':
             image = image.convert('L')
 
-        # Convert to numpy array
-        img_array = np.array(image)
+        cleaned = clean_stencil_batch(
+            np.array(image)[None],
+            invert_if_needed=invert_if_needed,
+            remove_small_objects=remove_small_objects,
+            min_object_size=min_object_size
+        )
+        return Image.fromarray(cleaned[0])
 
-        # Apply Otsu's method for automatic threshold detection
-        # This finds the optimal threshold to separate foreground/background
-        try:
-            from skimage.filters import threshold_otsu
-            binary_threshold = threshold_otsu(img_array)
-        except ImportError:
-            # Fall back to simple threshold if skimage not available
-            binary_threshold = 128
-
-        # Apply binary threshold - create stark black and white
-        binary = img_array > binary_threshold
-
-        # Decide if we need to invert (we want black subject on white background)
-        if invert_if_needed:
-            # Count pixels - if more white than black, we likely have black subject on white (correct)
-            # If more black than white, we have white subject on black (need to invert)
-            white_pixels = np.sum(binary)
-            total_pixels = binary.size
-            if white_pixels < total_pixels / 2:
-                # More black than white - invert
-                binary = ~binary
-
-        # Remove small objects (noise/artifacts)
-        if remove_small_objects:
-            try:
-                from scipy.ndimage import label, sum as ndi_sum
-                # Label connected components
-                labeled_array, num_features = label(~binary)  # Invert for labeling dark regions
+    def _encode_text(self, text: str) -> torch.Tensor:
+        """
+        Run the tokenizer and CLIP text encoder on a single prompt.
 
-                # Calculate size of each component
-                component_sizes = ndi_sum(~binary, labeled_array, range(num_features + 1))
+        Mirrors the pipeline's own prompt encoding so the result can be passed
+        straight back in as prompt_embeds/negative_prompt_embeds.
 
-                # Remove small components
-                mask_size = component_sizes < min_object_size
-                remove_pixel = mask_size[labeled_array]
-                binary[remove_pixel] = True  # Set to white (background)
-            except ImportError:
-                pass  # Skip if scipy not available
+        Args:
+            text: Prompt text ("" for the unconditional embedding)
 
-        # Apply slight morphological closing to fill small holes in the subject
-        try:
-            from scipy.ndimage import binary_closing
-            binary = binary_closing(binary, structure=np.ones((3, 3)))
-        except ImportError:
-            pass
+        Returns:
+            Embedding tensor of shape (1, max_length, hidden_size)
+        """
+        tokenizer = self.pipe.tokenizer
+        text_encoder = self._backend.text_encoder if self._backend is not None else self.pipe.text_encoder
+
+        with metrics.stage("tokenize"):
+            text_inputs = tokenizer(
+                text,
+                padding="max_length",
+                max_length=tokenizer.model_max_length,
+                truncation=True,
+                return_tensors="pt",
+            )
+
+        attention_mask = None
+        if getattr(text_encoder.config, "use_attention_mask", False):
+            attention_mask = text_inputs.attention_mask.to(self.device)
+
+        with self._inference_context(), metrics.stage("text_encode"):
+            embeds = text_encoder(text_inputs.input_ids.to(self.device), attention_mask=attention_mask)[0]
+
+        return embeds.to(dtype=text_encoder.dtype, device=self.device)
+
+    def _get_prompt_embeds(self, text: str) -> torch.Tensor:
+        """
+        Get the embedding for a prompt from the LRU cache, encoding it on a miss.
+
+        Args:
+            text: Final (decorated) prompt text
+
+        Returns:
+            Embedding tensor of shape (1, max_length, hidden_size)
+        """
+        key = (self.text_encoder_id, str(self.device), str(self.pipe.text_encoder.dtype), self.cpu_precision, self.engine, text)
+        return self.embedding_cache.get_or_compute(key, lambda: self._encode_text(text))
+
+    def _get_negative_embeds(self, negative_prompt: Optional[str]) -> torch.Tensor:
+        """
+        Get the embedding for the negative prompt.
+
+        The default negative prompt never changes, so its embedding is computed
+        once per loaded model; custom negative prompts go through the LRU cache.
+
+        Args:
+            negative_prompt: User-supplied negative prompt, or None for the model default
+
+        Returns:
+            Embedding tensor of shape (1, max_length, hidden_size)
+        """
+        if negative_prompt:
+            return self._get_prompt_embeds(negative_prompt)
+
+        if self._default_negative_embeds is None:
+            # Checkpoint models have no default negative prompt; use the empty prompt like the pipeline does
+            self._default_negative_embeds = self._encode_text(self.default_negative_prompt or "")
+        return self._default_negative_embeds
+
+    def embedding_cache_info(self) -> dict:
+        """
+        Get prompt embedding cache statistics.
+
+        Returns:
+            Dictionary with hits, misses, hit_rate, size and maxsize
+        """
+        return self.embedding_cache.info()
+
+    def _decorate_prompt(self, prompt: str, add_stencil_suffix: bool = True) -> str:
+        """
+        Apply the model-specific stencil decoration to a prompt.
+
+        Args:
+            prompt: Base text prompt describing what to draw
+            add_stencil_suffix: Whether to add stencil styling to the prompt
+
+        Returns:
+            The final prompt passed to the text encoder
+        """
+        full_prompt = prompt
+        if self.is_checkpoint_model:
+            # For fine-tuned checkpoints, add "sketch of" prefix
+            if add_stencil_suffix and not prompt.lower().startswith("sketch of"):
+                full_prompt = f"sketch of {prompt}"
+        else:
+            # For standard models, use stencil suffix
+            if add_stencil_suffix:
+                full_prompt = f"{prompt}, {self.stencil_suffix}"
+        return full_prompt
+
+    def _inference_context(self):
+        """Return the no-grad (and FP16 or CPU bf16 autocast, if enabled) context used for inference."""
+        stack = contextlib.ExitStack()
+        stack.enter_context(torch.no_grad())
+        if self.use_fp16:
+            stack.enter_context(torch.autocast(self.device))
+        elif self._cpu_autocast:
+            stack.enter_context(torch.autocast("cpu", dtype=torch.bfloat16))
+        return stack
+
+    def _prepare_latents(
+        self,
+        num_images: int,
+        width: int,
+        height: int,
+        generator: Optional[torch.Generator] = None
+    ) -> torch.Tensor:
+        """
+        Draw the initial noise latents for one request.
+
+        Uses the same sampling call as the pipeline, so a given seed produces
+        the same images whether or not the request is batched with others.
+
+        Args:
+            num_images: Number of images in the request
+            width: Image width in pixels
+            height: Image height in pixels
+            generator: Seeded torch.Generator, or None for the global RNG
+
+        Returns:
+            Unscaled noise latents of shape (num_images, C, height/8, width/8)
+        """
+        from diffusers.utils.torch_utils import randn_tensor
+
+        shape = (
+            num_images,
+            self.pipe.unet.config.in_channels,
+            height // self.pipe.vae_scale_factor,
+            width // self.pipe.vae_scale_factor,
+        )
+        return randn_tensor(shape, generator=generator, device=torch.device(self.device), dtype=self.pipe.text_encoder.dtype)
+
+    def estimate_memory_mb(self, plan: MemoryPlan, num_images: int, width: int, height: int) -> float:
+        """
+        Estimate the working memory a generation needs on top of what is already allocated.
+
+        A rough activation model: the larger of the UNet peak (live activations
+        plus one unsliced attention score matrix at the highest resolution) and
+        the decoder peak, minus the weights freed from the GPU by offloading.
+
+        Args:
+            plan: Memory plan to estimate for
+            num_images: Images in the batch
+            width: Image width in pixels
+            height: Image height in pixels
+
+        Returns:
+            Estimated extra memory in MB (negative if offloading frees more than is needed)
+        """
+        element_size = 2 if self.use_fp16 else 4
+        latent_pixels = (width // self.pipe.vae_scale_factor) * (height // self.pipe.vae_scale_factor)
+
+        # Activations scale with UNet width (320 channels at the top level for SD)
+        rows = num_images if plan.sequential_cfg else 2 * num_images
+        elements = self.UNET_ELEMENTS_PER_LATENT_PIXEL * self.pipe.unet.config.block_out_channels[0] / 320
+        # Fused scaled_dot_product_attention never materializes the score matrix; sliced attention does
+        attention_rows = {"auto": rows * self.ATTENTION_HEADS // 2, "max": 1}
+        attention_rows[None] = 0 if _has_sdpa() else rows * self.ATTENTION_HEADS
+        unet_bytes = element_size * (
+            rows * latent_pixels * elements
+            + attention_rows[plan.attention_slicing] * latent_pixels ** 2
+        )
+
+        vae = self._tiny_vae if self.decoder == "tiny" else self.pipe.vae
+        channels = vae.config.decoder_block_out_channels[0] if self.decoder == "tiny" else vae.config.block_out_channels[0]
+        decode_images = 1 if plan.vae_slicing else num_images
+        pixels = min(width * height, self.VAE_TILE_PIXELS) if plan.vae_tiling else width * height
+        vae_bytes = element_size * decode_images * self.VAE_ELEMENTS_PER_CHANNEL_PIXEL * channels * pixels
+        if self.decoder == "full":
+            # The VAE's mid-block attention runs over all latent pixels of a tile
+            vae_latent_pixels = pixels // self.pipe.vae_scale_factor ** 2
+            vae_bytes += element_size * decode_images * vae_latent_pixels ** 2
+
+        needed = max(unet_bytes, vae_bytes)
+        if plan.offload:
+            # Only the model that is running stays on the GPU
+            sizes = [_module_nbytes(m) for m in (self.pipe.unet, self.pipe.vae, self.pipe.text_encoder)]
+            needed -= sum(sizes) - max(sizes)
+        return needed / 1024 ** 2
+
+    def _memory_in_use_mb(self) -> float:
+        """Return the memory the budget is measured against: allocated VRAM on CUDA, process RSS otherwise."""
+        if str(self.device).startswith("cuda"):
+            return torch.cuda.memory_allocated() / 1024 ** 2
+        return current_rss_mb()
+
+    def choose_memory_plan(self, num_images: int, width: int, height: int) -> Tuple[MemoryPlan, float]:
+        """
+        Pick the fastest plan from MEMORY_PLANS estimated to fit in the memory budget.
+
+        Offloading is only considered on CUDA, and attention slicing only
+        without fused scaled_dot_product_attention (which already needs less
+        memory than any slicing). If nothing fits, the leanest plan is
+        returned and a warning printed.
+
+        Args:
+            num_images: Images in the batch
+            width: Image width in pixels
+            height: Image height in pixels
+
+        Returns:
+            Tuple of (plan, estimated extra memory in MB)
+        """
+        available = self.memory_budget_mb - self._memory_in_use_mb()
+        cuda = str(self.device).startswith("cuda")
+        plans = []
+        for plan in MEMORY_PLANS:
+            if _has_sdpa():
+                plan = replace(plan, attention_slicing=None)
+            if (cuda or not plan.offload) and plan not in plans:
+                plans.append(plan)
+
+        for plan in plans:
+            estimate = self.estimate_memory_mb(plan, num_images, width, height)
+            if estimate <= available:
+                return plan, estimate
+
+        print(
+            f"Warning: {num_images} image(s) at {width}x{height} are estimated to need {estimate:.0f} MB "
+            f"with every memory saving on, but only {available:.0f} MB of the budget is left"
+        )
+        return plan, estimate
+
+    def _apply_memory_plan(self, plan: MemoryPlan):
+        """Configure attention slicing, VAE slicing/tiling and offloading for a plan."""
+        if plan == self._applied_plan:
+            return
+
+        if plan.attention_slicing:
+            self.pipe.enable_attention_slicing(plan.attention_slicing)
+        else:
+            self.pipe.disable_attention_slicing()
+
+        for vae in (self.pipe.vae, self._tiny_vae):
+            if vae is None:
+                continue
+            vae.enable_slicing() if plan.vae_slicing else vae.disable_slicing()
+            vae.enable_tiling() if plan.vae_tiling else vae.disable_tiling()
+
+        if plan.offload and not self._offloaded:
+            # Note: shared pool components are offloaded for every pipeline that uses them
+            self.pipe.enable_model_cpu_offload(device=self.device)
+            self._offloaded = True
+        elif not plan.offload and self._offloaded:
+            self.pipe.remove_all_hooks()
+            self.pipe.to(self.device)
+            self._offloaded = False
+
+        self._applied_plan = plan
+
+    def _prepare_memory(self, num_images: int, width: int, height: int) -> Optional[MemoryPlan]:
+        """
+        Apply the fixed memory_plan, or the one chosen for the memory budget.
+
+        Returns:
+            The applied plan, or None when neither is set (nothing is changed then)
+        """
+        if self.memory_plan is not None:
+            plan, estimate = self.memory_plan, self.estimate_memory_mb(self.memory_plan, num_images, width, height)
+        elif self.memory_budget_mb is not None:
+            plan, estimate = self.choose_memory_plan(num_images, width, height)
+        else:
+            return None
+
+        self._apply_memory_plan(plan)
+        self.last_memory_report = {
+            "plan": plan.describe(),
+            "budget_mb": self.memory_budget_mb,
+            "baseline_mb": round(self._memory_in_use_mb(), 1),
+            "estimate_mb": round(estimate, 1),
+        }
+        return plan
+
+    def _report_peak_memory(self, record: dict):
+        """Add the peak memory of a bounded run to last_memory_report and print it."""
+        if not record or self.last_memory_report is None:
+            return
+        peak = record.get("cuda_peak_mb", record["peak_rss_mb"])
+        self.last_memory_report["peak_mb"] = peak
+        budget = f" of {self.memory_budget_mb:.0f} MB budget" if self.memory_budget_mb else ""
+        print(f"Peak memory {peak:.0f} MB{budget} (memory plan: {self.last_memory_report['plan']})")
+
+    def _denoising_unet(self, step_cache: bool = True):
+        """
+        Get the callable that runs the UNet for a denoising loop.
+
+        That is the engine's UNet, wrapped in the step cache and token merging
+        when enabled (both torch engine only).
+
+        Args:
+            step_cache: Allow the step cache, which needs every UNet call of a
+                        run to see the same latents (not so for tiles)
+
+        Returns:
+            Tuple of (UNet callable, its StepCacheUNet or None)
+        """
+        unet = self._backend.unet if self._backend is not None else self.pipe.unet
+        cache = None
+        if step_cache and self.step_cache_interval > 1 and self._backend is None:
+            from StencilStepCache import StepCacheUNet
+            unet = cache = StepCacheUNet(unet, self.step_cache_interval)
+        if self.token_merge_ratio and self._backend is None:
+            from StencilTokenMerge import TokenMergingUNet
+            unet = TokenMergingUNet(unet, self.pipe.unet, self.token_merge_ratio)
+        return unet, cache
+
+    def _iter_denoise(
+        self,
+        prompt_embeds: torch.Tensor,
+        negative_prompt_embeds: torch.Tensor,
+        guidance_scales: torch.Tensor,
+        latents: torch.Tensor,
+        num_inference_steps: int,
+        generator: Optional[torch.Generator] = None,
+        convergence_tolerance: Optional[float] = None,
+        check_every: int = 2,
+        is_cancelled: Optional[Callable[[], bool]] = None,
+        sequential_cfg: bool = False,
+        guidance_schedule: str = "full",
+        guidance_cutoff: Optional[float] = None,
+        init_latents: Optional[torch.Tensor] = None,
+        strength: float = 1.0
+    ) -> Iterator[DenoiseStep]:
+        """
+        Run the denoising loop for a batch, yielding after every step.
+
+        Each batch row may have its own prompt and guidance scale. A fresh
+        scheduler is created per call so concurrent runs don't share state.
+        Callers can stop early simply by not consuming the rest of the loop.
+
+        With a convergence_tolerance, the loop also stops by itself once the
+        binarized stencil has settled: every check_every steps (after the
+        first third of the schedule) the approximate stencil mask of each row
+        is compared with the previous check, and when no row changed by more
+        than that fraction of pixels, a last step is yielded whose latents are
+        the denoised estimate. Since the output is thresholded to black and
+        white anyway, the remaining steps would only refine gray levels.
+
+        With init_latents (the final latents of an earlier result), latents is
+        used as noise to re-noise them to the point strength of the way back
+        through the schedule, and only the remaining steps run, as in img2img.
+        Schedulers that can't start partway through (PNDM) are replaced by
+        their PARTIAL_SCHEDULE_FALLBACK for such runs.
+
+        Args:
+            prompt_embeds: Conditional embeddings, shape (B, L, D)
+            negative_prompt_embeds: Unconditional embeddings, shape (B, L, D)
+            guidance_scales: Per-row classifier-free guidance scales, shape (B,)
+            latents: Initial noise latents from _prepare_latents, shape (B, C, H, W)
+            num_inference_steps: Number of denoising steps
+            generator: Generator for stochastic schedulers (single-request batches only)
+            convergence_tolerance: Fraction of mask pixels allowed to change between
+                                   checks for early exit (None runs all steps)
+            check_every: Steps between convergence checks
+            is_cancelled: Checked before every step; raises GenerationCancelled when it returns True
+            sequential_cfg: Run the unconditional and conditional passes separately, halving
+                            the UNet batch at the cost of a second call per step
+            guidance_schedule: One of GUIDANCE_SCHEDULES. "truncate" and "adaptive" drop the
+                               unconditional branch (half the UNet work) once the silhouette
+                               has formed; "off" never runs it
+            guidance_cutoff: Fraction of guided steps ("truncate") or cosine similarity of the
+                             conditional and unconditional predictions at which to stop
+                             guiding ("adaptive"); None for DEFAULT_GUIDANCE_CUTOFFS
+            init_latents: Clean latents to start from instead of pure noise, shape (B, C, H, W)
+            strength: Fraction of the schedule to re-run from init_latents (0 to 1]
+
+        Yields:
+            DenoiseStep with the step index, timestep, current latents and
+            the scheduler's estimate of the final latents
+        """
+        unet, step_cache = self._denoising_unet()
+        if init_latents is not None and self.scheduler in PARTIAL_SCHEDULE_FALLBACK:
+            scheduler = make_scheduler(PARTIAL_SCHEDULE_FALLBACK[self.scheduler], self._scheduler_config)
+        else:
+            scheduler = self.pipe.scheduler.__class__.from_config(self.pipe.scheduler.config)
+        scheduler.set_timesteps(num_inference_steps, device=self.device)
+        timesteps = scheduler.timesteps
+        if init_latents is None:
+            latents = latents * scheduler.init_noise_sigma
+        else:
+            # At least one step, so even a tiny strength gives a decodable result; multi-order
+            # schedulers must start on a whole step
+            start = len(timesteps) - max(int(len(timesteps) * strength), 1)
+            start -= start % scheduler.order
+            timesteps = timesteps[start:]
+            if hasattr(scheduler, "set_begin_index"):
+                scheduler.set_begin_index(start)
+            latents = scheduler.add_noise(init_latents, latents, timesteps[:1].repeat(latents.shape[0]))
+
+        if guidance_schedule not in GUIDANCE_SCHEDULES:
+            raise ValueError(f"Unknown guidance schedule '{guidance_schedule}', expected one of {GUIDANCE_SCHEDULES}")
+        if guidance_cutoff is None:
+            guidance_cutoff = DEFAULT_GUIDANCE_CUTOFFS.get(guidance_schedule)
+        guided_steps = len(timesteps)
+        if guidance_schedule == "truncate":
+            guided_steps = int(np.ceil(guidance_cutoff * len(timesteps)))
+
+        # Rows with guidance <= 1 just use the conditional prediction, like the pipeline
+        guidance_scales = guidance_scales.clamp(min=1.0)
+        do_classifier_free_guidance = bool((guidance_scales > 1.0).any()) and guidance_schedule != "off"
+        steps_guided = 0
+        if do_classifier_free_guidance:
+            encoder_hidden_states = torch.cat([negative_prompt_embeds, prompt_embeds])
+            guidance = guidance_scales.to(device=latents.device, dtype=latents.dtype).view(-1, 1, 1, 1)
+        else:
+            encoder_hidden_states = prompt_embeds
+
+        step_kwargs = {}
+        if generator is not None and "generator" in inspect.signature(scheduler.step).parameters:
+            step_kwargs["generator"] = generator
+
+        # The silhouette is still forming early on, so don't check before a third of the schedule
+        first_check = max(check_every, len(timesteps) // 3)
+        previous_mask = None
+
+        for i, t in enumerate(timesteps):
+            if is_cancelled is not None and is_cancelled():
+                raise GenerationCancelled(f"Generation cancelled after {i} steps")
+
+            if do_classifier_free_guidance and i >= guided_steps:
+                do_classifier_free_guidance = False
+                encoder_hidden_states = prompt_embeds
+                if step_cache is not None:
+                    # Cached call slots would hand the unconditional features to the conditional pass
+                    step_cache.reset()
+                print(f"Guidance truncated after {i}/{len(timesteps)} steps")
+
+            if step_cache is not None:
+                step_cache.begin_step(i)
+            with metrics.stage("unet_step", step=i, batch=latents.shape[0], guided=do_classifier_free_guidance):
+                if do_classifier_free_guidance and sequential_cfg:
+                    latent_model_input = scheduler.scale_model_input(latents, t)
+                    noise_pred_uncond = unet(latent_model_input, t, encoder_hidden_states=negative_prompt_embeds).sample
+                    noise_pred_text = unet(latent_model_input, t, encoder_hidden_states=prompt_embeds).sample
+                    noise_pred = noise_pred_uncond + guidance * (noise_pred_text - noise_pred_uncond)
+                else:
+                    latent_model_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
+                    latent_model_input = scheduler.scale_model_input(latent_model_input, t)
+
+                    noise_pred = unet(latent_model_input, t, encoder_hidden_states=encoder_hidden_states).sample
+
+                    if do_classifier_free_guidance:
+                        noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+                        noise_pred = noise_pred_uncond + guidance * (noise_pred_text - noise_pred_uncond)
+
+                output = scheduler.step(noise_pred, t, latents, **step_kwargs)
+
+            if do_classifier_free_guidance:
+                steps_guided += 1
+                if guidance_schedule == "adaptive" and i + 1 >= first_check:
+                    # Once every row's two predictions agree, guidance only rescales a vanishing difference.
+                    # Both are close to the noise itself early on, so like convergence, wait for a third of the schedule
+                    similarity = torch.nn.functional.cosine_similarity(
+                        noise_pred_text.flatten(1).float(), noise_pred_uncond.flatten(1).float(), dim=1
+                    ).min()
+                    if similarity >= guidance_cutoff:
+                        do_classifier_free_guidance = False
+                        encoder_hidden_states = prompt_embeds
+                        if step_cache is not None:
+                            step_cache.reset()
+                        print(f"Guidance converged after {i + 1}/{len(timesteps)} steps")
+
+            # Schedulers that don't report x0 are all alpha-parameterized
+            denoised = getattr(output, "pred_original_sample", None)
+            if denoised is None:
+                alpha_prod = scheduler.alphas_cumprod[int(t)].to(device=latents.device, dtype=latents.dtype)
+                denoised = (latents - (1 - alpha_prod).sqrt() * noise_pred) / alpha_prod.sqrt()
+
+            latents = output.prev_sample
+
+            steps_done = i + 1
+            if (
+                convergence_tolerance is not None
+                and steps_done >= first_check
+                and steps_done < len(timesteps)
+                and steps_done % check_every == 0
+            ):
+                mask = self._stencil_mask(denoised)
+                if previous_mask is not None:
+                    changed = (mask != previous_mask).mean(axis=(1, 2)).max()
+                    if changed <= convergence_tolerance:
+                        print(f"Stencil converged after {steps_done}/{len(timesteps)} steps")
+                        yield DenoiseStep(i, t, denoised, denoised, steps_guided)
+                        return
+                previous_mask = mask
+
+            yield DenoiseStep(i, t, latents, denoised, steps_guided)
+
+    def _decode_latents(self, latents: torch.Tensor) -> np.ndarray:
+        """
+        Decode final latents to RGB pixels with the selected decoder.
+
+        Args:
+            latents: Denoised latents, shape (B, C, H, W)
+
+        Returns:
+            uint8 array of shape (B, H, W, 3)
+        """
+        # AutoencoderTiny has scaling_factor 1.0 and the same [-1, 1] output range
+        vae = self._tiny_vae if self.decoder == "tiny" else self.pipe.vae
+        if vae is self.pipe.vae and self._backend is not None and not vae.use_tiling:
+            # Tiled decodes (memory plans, generate_large) stay on torch
+            vae = self._backend.vae
+        with metrics.stage("vae_decode", batch=latents.shape[0], decoder=self.decoder):
+            image = vae.decode(latents / vae.config.scaling_factor).sample
+            image = (image * 0.5 + 0.5).clamp(0, 1)
+            image = image.cpu().permute(0, 2, 3, 1).float().numpy()
+            return (image * 255).round().astype(np.uint8)
+
+    def _bucket_size(self, width: int, height: int) -> Tuple[int, int]:
+        """Return the (width, height) to denoise a request at: the nearest compiled bucket, or the request itself."""
+        if self.engine == "compile":
+            return self._backend.snap_resolution(width, height)
+        return width, height
+
+    def _resize_pixels(self, pixels: np.ndarray, width: int, height: int) -> np.ndarray:
+        """
+        Resize decoded pixels generated at a bucket resolution to the requested size.
+
+        Args:
+            pixels: uint8 array of shape (B, H, W, 3)
+            width: Requested width in pixels
+            height: Requested height in pixels
+
+        Returns:
+            uint8 array of shape (B, height, width, 3)
+        """
+        if pixels.shape[1:3] == (height, width):
+            return pixels
+        return np.stack([
+            np.asarray(Image.fromarray(image).resize((width, height), Image.LANCZOS)) for image in pixels
+        ])
+
+    def precompile(self, resolutions: Optional[List[Tuple[int, int]]] = None, max_images: int = 4):
+        """
+        Compile every shape bucket a request can hit, so no request pays a compile.
+
+        Covers UNet batches of up to 2 * max_images rows (classifier-free
+        guidance) and decoder batches of up to max_images. Buckets already in
+        the compile cache take seconds each. Does nothing unless the engine is
+        "compile".
+
+        Args:
+            resolutions: (width, height) sizes to cover (None for all buckets)
+            max_images: Largest number of images generated together
+        """
+        if self.engine != "compile":
+            return
+        with self._inference_context():
+            self._backend.precompile(
+                resolutions,
+                unet_batch_sizes=range(1, 2 * max_images + 1),
+                decoder_batch_sizes=range(1, max_images + 1),
+            )
+
+    def compile_stats(self) -> Optional[dict]:
+        """
+        Get the compile engine's statistics.
+
+        Returns:
+            Dictionary with compiled_shapes, recompiles (compiles after precompile(),
+            which should stay at 0) and dynamo_graphs, or None unless the engine is "compile"
+        """
+        return self._backend.stats() if self.engine == "compile" else None
+
+    def _preview_pixels(self, latents: torch.Tensor, scale: int = 1) -> np.ndarray:
+        """
+        Approximate decoded pixels from latents with a linear projection.
+
+        Costs a few elementwise ops instead of a VAE decode, which is plenty
+        for previews and for checking the silhouette of a binary stencil.
+
+        Args:
+            latents: Latents of shape (B, 4, h, w)
+            scale: Upsampling factor (vae_scale_factor gives full image size)
+
+        Returns:
+            uint8 RGB array of shape (B, h*scale, w*scale, 3)
+        """
+        factors = torch.tensor(LATENT_RGB_FACTORS, dtype=torch.float32)
+        rgb = torch.einsum("bchw,cr->brhw", latents.detach().float().cpu(), factors)
+        if scale > 1:
+            rgb = torch.nn.functional.interpolate(rgb, scale_factor=scale, mode="bilinear", align_corners=False)
+        rgb = ((rgb + 1) / 2).clamp(0, 1).permute(0, 2, 3, 1)
+        return (rgb.numpy() * 255).round().astype(np.uint8)
+
+    def _stencil_mask(self, latents: torch.Tensor) -> np.ndarray:
+        """
+        Approximate the binarized stencil at latent resolution.
+
+        Args:
+            latents: Denoised latent estimate, shape (B, 4, h, w)
+
+        Returns:
+            Boolean array of shape (B, h, w), True for white background
+        """
+        gray = _rgb_to_gray(self._preview_pixels(latents))
+        return clean_stencil_batch(gray, remove_small_objects=False) > 0
+
+    def _postprocess(self, pixels: np.ndarray, clean_background: List[bool]) -> List[Image.Image]:
+        """
+        Turn decoded pixels into PIL images, cleaning the selected rows as one batch.
+
+        Cleaned rows become single-channel ('L') stencils, skipping the RGB
+        round trip; the rest stay RGB.
+
+        Args:
+            pixels: uint8 array of shape (B, H, W, 3) from _decode_latents
+            clean_background: Per-row flag for binary stencil cleaning
+
+        Returns:
+            List of B PIL Images
+        """
+        images = [None] * len(pixels)
+
+        clean_rows = [i for i, clean in enumerate(clean_background) if clean]
+        if clean_rows:
+            with metrics.stage("clean", images=len(clean_rows)):
+                cleaned = clean_stencil_batch(_rgb_to_gray(pixels[clean_rows]))
+            for i, stencil in zip(clean_rows, cleaned):
+                images[i] = Image.fromarray(stencil)
+
+        for i, clean in enumerate(clean_background):
+            if not clean:
+                images[i] = Image.fromarray(pixels[i])
+        return images
+
+    def generate_batch(
+        self,
+        requests: List[GenerationRequest],
+        num_inference_steps: int = 25,
+        width: int = 512,
+        height: int = 512,
+        adaptive_steps: bool = False,
+        convergence_tolerance: float = 0.002,
+        guidance_schedule: str = "full",
+        guidance_cutoff: Optional[float] = None,
+    ) -> List[List[Image.Image]]:
+        """
+        Generate several requests in one batched denoising loop.
+
+        All requests share size and step count but keep their own prompt,
+        negative prompt, seed and guidance scale. This is what the
+        DynamicBatcher uses to serve concurrent users with one UNet batch.
+        The run is abandoned (GenerationCancelled) once every request in it
+        has been cancelled through its cancel_token.
+
+        Args:
+            requests: Requests to generate together
+            num_inference_steps: Number of denoising steps
+            width: Image width in pixels (must be divisible by 8)
+            height: Image height in pixels (must be divisible by 8)
+            adaptive_steps: Stop early once the binarized stencil stops changing
+            convergence_tolerance: Fraction of stencil pixels allowed to change for early exit
+            guidance_schedule: When to run the unconditional branch (see GUIDANCE_SCHEDULES);
+                               the guided step count is recorded in Image.info[GUIDED_STEPS_KEY]
+            guidance_cutoff: Truncation fraction or adaptive similarity threshold (None for default)
+
+        Returns:
+            One list of PIL Images per request, in request order
+        """
+        pixels, tags = self._denoise_batch(
+            requests,
+            num_inference_steps,
+            width,
+            height,
+            adaptive_steps,
+            convergence_tolerance,
+            guidance_schedule,
+            guidance_cutoff,
+        )
+
+        clean_background = [r.clean_background for r in requests for _ in range(r.num_images)]
+        if any(clean_background):
+            print("Cleaning background...")
+        with metrics.stage("postprocess", images=len(clean_background)):
+            images = self._postprocess(pixels, clean_background)
+        self._tag_results(images, tags)
+
+        # Split the batch back out per request
+        results = []
+        offset = 0
+        for request in requests:
+            results.append(images[offset:offset + request.num_images])
+            offset += request.num_images
+
+        print("Generation complete!")
+        return results
+
+    def _denoise_batch(
+        self,
+        requests: List[GenerationRequest],
+        num_inference_steps: int = 25,
+        width: int = 512,
+        height: int = 512,
+        adaptive_steps: bool = False,
+        convergence_tolerance: float = 0.002,
+        guidance_schedule: str = "full",
+        guidance_cutoff: Optional[float] = None,
+        cache_latents: bool = True,
+        init_latents: Optional[torch.Tensor] = None,
+        strength: float = 1.0,
+    ) -> Tuple[np.ndarray, List[dict]]:
+        """
+        Denoise and VAE-decode a batch of requests, without post-processing.
+
+        Args:
+            requests, num_inference_steps, width, height, adaptive_steps,
+            convergence_tolerance, guidance_schedule, guidance_cutoff: Same as generate_batch()
+            cache_latents: Keep the final latents in the latent cache for vary()
+            init_latents, strength: Start from earlier latents, as for _iter_denoise()
+
+        Returns:
+            Tuple of (uint8 array of shape (total images, H, W, 3), rows in request
+            order; Image.info entries per row, see _result_tags())
+        """
+        self._check_guidance_schedule(requests, guidance_schedule)
+        bucket_width, bucket_height = self._bucket_size(width, height)
+        prompt_embeds, negative_prompt_embeds, guidance_scales, latents, generator = (
+            self._prepare_batch(requests, bucket_width, bucket_height)
+        )
+        total_images = sum(request.num_images for request in requests)
+        print(f"Generating {total_images} stencil image(s)...")
+        plan = self._prepare_memory(total_images, bucket_width, bucket_height)
+
+        is_cancelled = None
+        if any(request.cancel_token is not None for request in requests):
+            is_cancelled = lambda: all(
+                request.cancel_token is not None and request.cancel_token.cancelled for request in requests
+            )
+
+        # Bounded runs record their peak (RSS from here, CUDA since the request started); otherwise
+        # this stage is just a pass-through
+        bounded = plan is not None
+        stage = (
+            metrics.stage("bounded_generation", reset_peak_rss=True, plan=plan.describe())
+            if bounded else contextlib.nullcontext({})
+        )
+        with self._inference_context(), stage as record:
+            denoise = self._iter_denoise(
+                prompt_embeds,
+                negative_prompt_embeds,
+                guidance_scales,
+                latents,
+                num_inference_steps,
+                generator=generator,
+                convergence_tolerance=convergence_tolerance if adaptive_steps else None,
+                is_cancelled=is_cancelled,
+                sequential_cfg=bounded and plan.sequential_cfg,
+                guidance_schedule=guidance_schedule,
+                guidance_cutoff=guidance_cutoff,
+                init_latents=init_latents,
+                strength=strength,
+            )
+            for step in denoise:
+                pass
+            pixels = self._decode_latents(step.latents)
+        if bounded:
+            self._report_peak_memory(record)
+
+        result_ids = [None] * total_images
+        if cache_latents:
+            result_ids = self._cache_latents(
+                step.latents, requests, num_inference_steps, width, height, guidance_schedule, guidance_cutoff
+            )
+        return self._resize_pixels(pixels, width, height), self._result_tags(step, result_ids)
+
+    def _cache_latents(
+        self,
+        latents: torch.Tensor,
+        requests: List[GenerationRequest],
+        num_inference_steps: int,
+        width: int,
+        height: int,
+        guidance_schedule: str = "full",
+        guidance_cutoff: Optional[float] = None,
+    ) -> List[Optional[str]]:
+        """
+        Store the final latents of each image of a batch in the latent cache.
+
+        Args:
+            latents: Final latents, shape (total images, C, h, w), rows in request order
+            requests: Requests of the batch
+            num_inference_steps, width, height, guidance_schedule, guidance_cutoff:
+                Settings the batch was generated with
+
+        Returns:
+            Result id per row (None if the cache is disabled)
+        """
+        model = self.checkpoint_path or self.model_id
+        rows = [replace(request, num_images=1, seed=None, cancel_token=None) for request in requests for _ in range(request.num_images)]
+        return [
+            self.latent_cache.put(CachedLatents(
+                model=model,
+                request=request,
+                latents=row.detach().to("cpu", torch.float32).clone(),
+                num_inference_steps=num_inference_steps,
+                width=width,
+                height=height,
+                guidance_schedule=guidance_schedule,
+                guidance_cutoff=guidance_cutoff,
+            ))
+            for request, row in zip(rows, latents)
+        ]
 
-        # Convert boolean array to uint8 (True->255, False->0)
-        result = (binary * 255).astype(np.uint8)
+    def _result_tags(self, step: DenoiseStep, result_ids: List[Optional[str]]) -> List[dict]:
+        """
+        Build the Image.info entries of each result of a denoising run.
 
-        # Convert back to PIL Image
-        cleaned_image = Image.fromarray(result, mode='L').convert('RGB')
+        Args:
+            step: Last step of the run
+            result_ids: Latent cache result id per image (None where not cached)
 
-        return cleaned_image
+        Returns:
+            Per image: STEPS_RUN_KEY, GUIDED_STEPS_KEY and, if cached, RESULT_ID_KEY
+        """
+        tags = []
+        for result_id in result_ids:
+            tag = {STEPS_RUN_KEY: step.index + 1, GUIDED_STEPS_KEY: step.guided_steps}
+            if result_id is not None:
+                tag[RESULT_ID_KEY] = result_id
+            tags.append(tag)
+        return tags
+
+    def _tag_results(self, images: List[Image.Image], tags: List[dict]):
+        """Record each image's run details (steps run, latent cache result id) in its Image.info."""
+        for image, tag in zip(images, tags):
+            image.info.update(tag)
+
+    def vary(
+        self,
+        result_id: str,
+        strength: float = 0.5,
+        num_images: int = 1,
+        seed: Optional[int] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Union[Image.Image, List[Image.Image]]:
+        """
+        Generate variations of an earlier result from its cached final latents.
 
-    
+        The latents are re-noised to the point strength of the way back
+        through the original schedule and only the remaining steps run, with
+        the original prompt, guidance and size, so a variation costs about
+        strength times a full generation. Variations are cached too, so they
+        can be varied in turn.
+
+        Args:
+            result_id: Id of the result, from its Image.info[RESULT_ID_KEY]
+            strength: How far to re-noise (0 to 1]: low keeps the silhouette, 1 is nearly a fresh sample
+            num_images: Number of variations
+            seed: Random seed for the re-noising (None for random)
+            cancel_token: Token that abandons the run (GenerationCancelled) when cancelled
+
+        Returns:
+            Single PIL Image if num_images=1, otherwise list of PIL Images
+
+        Raises:
+            KeyError: If the result's latents are no longer (or were never) cached
+            ValueError: If the result came from another model, or strength is out of range
+        """
+        entry = self.latent_cache.get(result_id)
+        if entry is None:
+            raise KeyError(f"No cached latents for result {result_id}; generate it again to vary it")
+        if entry.model != (self.checkpoint_path or self.model_id):
+            raise ValueError(f"Result {result_id} was generated with {entry.model}, not {self.checkpoint_path or self.model_id}")
+        if not 0 < strength <= 1:
+            raise ValueError(f"Variation strength must be between 0 (exclusive) and 1, got {strength}")
+
+        request = replace(entry.request, num_images=num_images, seed=seed, cancel_token=cancel_token)
+        init_latents = entry.latents.to(device=self.device, dtype=self.pipe.unet.dtype).expand(num_images, -1, -1, -1)
+        print(f"Varying result {result_id} at strength {strength}...")
+        with metrics.stage("vary", images=num_images, strength=strength):
+            pixels, tags = self._denoise_batch(
+                [request],
+                entry.num_inference_steps,
+                entry.width,
+                entry.height,
+                guidance_schedule=entry.guidance_schedule,
+                guidance_cutoff=entry.guidance_cutoff,
+                init_latents=init_latents,
+                strength=strength,
+            )
+            images = self._postprocess(pixels, [request.clean_background] * num_images)
+        self._tag_results(images, tags)
+
+        print("Variation complete!")
+        return images[0] if num_images == 1 else images
+
+    def _check_guidance_schedule(self, requests: List[GenerationRequest], guidance_schedule: str):
+        """
+        Reject guidance_schedule="off" where dropping guidance would drop a negative prompt.
+
+        Checkpoint models have no default negative prompt, so without one of
+        their own their unconditional branch only pushes away from the empty
+        prompt, which the fine-tuned stencil style doesn't need.
+
+        Args:
+            requests: Requests to generate together
+            guidance_schedule: Requested schedule
+
+        Raises:
+            ValueError: For "off" on the base model or with a negative prompt
+        """
+        if guidance_schedule != "off":
+            return
+        if not self.is_checkpoint_model or any(request.negative_prompt for request in requests):
+            raise ValueError('guidance_schedule="off" needs a checkpoint model and no negative prompt')
+
+    def _prepare_batch(
+        self,
+        requests: List[GenerationRequest],
+        width: int,
+        height: int
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, Optional[torch.Generator]]:
+        """
+        Build the stacked embeddings, guidance scales and initial latents for a batch.
+
+        Args:
+            requests: Requests to generate together
+            width: Image width in pixels (must be divisible by 8)
+            height: Image height in pixels (must be divisible by 8)
+
+        Returns:
+            Tuple of (prompt_embeds, negative_prompt_embeds, guidance_scales,
+            latents, scheduler generator for single-request batches)
+        """
+        if width % 8 != 0 or height % 8 != 0:
+            raise ValueError(f"width and height have to be divisible by 8 but are {width} and {height}.")
+
+        prompt_embeds, negative_prompt_embeds, guidance_scales, latents = [], [], [], []
+        generators = []
+        for request in requests:
+            full_prompt = self._decorate_prompt(request.prompt, request.add_stencil_suffix)
+            print(f"Prompt: {full_prompt}")
+
+            # Look up (or encode) the prompt embeddings; the default negative prompt
+            # (None for checkpoint models) is encoded once per loaded model
+            n = request.num_images
+            prompt_embeds.append(self._get_prompt_embeds(full_prompt).repeat(n, 1, 1))
+            negative_prompt_embeds.append(self._get_negative_embeds(request.negative_prompt).repeat(n, 1, 1))
+            guidance_scales.append(torch.full((n,), float(request.guidance_scale)))
+
+            # Each request gets its own generator so its seed behaves as if it ran alone
+            generator = None
+            if request.seed is not None:
+                generator = torch.Generator(device=self.device).manual_seed(request.seed)
+            generators.append(generator)
+            latents.append(self._prepare_latents(n, width, height, generator))
+
+        return (
+            torch.cat(prompt_embeds),
+            torch.cat(negative_prompt_embeds),
+            torch.cat(guidance_scales),
+            torch.cat(latents),
+            generators[0] if len(requests) == 1 else None,
+        )
+
+    def generate_stream(
+        self,
+        prompt: str,
+        num_images: int = 1,
+        negative_prompt: Optional[str] = None,
+        num_inference_steps: int = 25,
+        guidance_scale: float = 7.5,
+        width: int = 512,
+        height: int = 512,
+        seed: Optional[int] = None,
+        add_stencil_suffix: bool = True,
+        clean_background: bool = True,
+        preview_every: int = 5,
+        adaptive_steps: bool = False,
+        convergence_tolerance: float = 0.002,
+        guidance_schedule: str = "full",
+        guidance_cutoff: Optional[float] = None,
+        quality_preset: str = "custom",
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Iterator[GenerationPreview]:
+        """
+        Generate stencil images, yielding cheap previews while denoising.
+
+        Previews come from a linear latent-to-RGB projection of the current
+        denoised estimate (no VAE decode), binarized like the final output.
+        The first preview follows the first step; the last update has
+        final=True and carries the same images generate() would return.
+
+        Args:
+            prompt, num_images, negative_prompt, num_inference_steps,
+            guidance_scale, width, height, seed, add_stencil_suffix,
+            clean_background, adaptive_steps, convergence_tolerance,
+            guidance_schedule, guidance_cutoff, quality_preset, cancel_token: Same as generate()
+            preview_every: Yield a preview every this many steps
+
+        Yields:
+            GenerationPreview updates
+        """
+        num_inference_steps = self._preset_steps(num_inference_steps, quality_preset)
+        request = GenerationRequest(
+            prompt=prompt,
+            num_images=num_images,
+            negative_prompt=negative_prompt,
+            guidance_scale=guidance_scale,
+            seed=seed,
+            add_stencil_suffix=add_stencil_suffix,
+            clean_background=clean_background,
+        )
+
+        options = dict(
+            adaptive_steps=adaptive_steps,
+            convergence_tolerance=convergence_tolerance,
+            guidance_schedule=guidance_schedule,
+            guidance_cutoff=guidance_cutoff,
+        )
+        key = self.result_cache_key(request, num_inference_steps, width, height, **options) if self.result_cache else None
+        if key is not None:
+            images = self.result_cache.get(key)
+            if images is not None:
+                yield GenerationPreview(num_inference_steps, num_inference_steps, images, True)
+                return
+
+        self._check_guidance_schedule([request], guidance_schedule)
+        bucket_width, bucket_height = self._bucket_size(width, height)
+        prompt_embeds, negative_prompt_embeds, guidance_scales, latents, generator = (
+            self._prepare_batch([request], bucket_width, bucket_height)
+        )
+        print(f"Generating {num_images} stencil image(s) with previews...")
+        plan = self._prepare_memory(num_images, bucket_width, bucket_height)
+
+        denoise = self._iter_denoise(
+            prompt_embeds,
+            negative_prompt_embeds,
+            guidance_scales,
+            latents,
+            num_inference_steps,
+            generator=generator,
+            convergence_tolerance=convergence_tolerance if adaptive_steps else None,
+            is_cancelled=(lambda: cancel_token.cancelled) if cancel_token is not None else None,
+            sequential_cfg=plan is not None and plan.sequential_cfg,
+            guidance_schedule=guidance_schedule,
+            guidance_cutoff=guidance_cutoff,
+        )
+
+        # Step under the inference context, but never hold it across a yield
+        while True:
+            with self._inference_context():
+                step = next(denoise, None)
+            if step is None:
+                break
+
+            steps_done = step.index + 1
+            if steps_done < num_inference_steps and (step.index == 0 or steps_done % preview_every == 0):
+                with metrics.stage("preview", step=steps_done):
+                    pixels = self._preview_pixels(step.denoised, scale=self.pipe.vae_scale_factor)
+                    pixels = self._resize_pixels(pixels, width, height)
+                    previews = self._postprocess(pixels, [clean_background] * num_images)
+                yield GenerationPreview(steps_done, num_inference_steps, previews, False)
+            final_step = step
+
+        with self._inference_context():
+            pixels = self._decode_latents(final_step.latents)
+        images = self._postprocess(self._resize_pixels(pixels, width, height), [clean_background] * num_images)
+        result_ids = self._cache_latents(
+            final_step.latents, [request], num_inference_steps, width, height, guidance_schedule, guidance_cutoff
+        )
+        self._tag_results(images, self._result_tags(final_step, result_ids))
+
+        if key is not None:
+            self.result_cache.put(key, images)
+
+        print("Generation complete!")
+        yield GenerationPreview(final_step.index + 1, num_inference_steps, images, True)
+
+    def result_cache_key(
+        self,
+        request: GenerationRequest,
+        num_inference_steps: int = 25,
+        width: int = 512,
+        height: int = 512,
+        **options
+    ) -> Optional[str]:
+        """
+        Build the content address of a request's output for the ResultCache.
+
+        Only seeded requests are deterministic, so unseeded ones have no key.
+
+        Args:
+            request: The generation request
+            num_inference_steps: Number of denoising steps
+            width: Image width in pixels
+            height: Image height in pixels
+            **options: Extra generate_batch options that affect the output
+
+        Returns:
+            Hex cache key, or None if the request is not cacheable
+        """
+        if request.seed is None:
+            return None
+
+        return make_cache_key(
+            model=self.checkpoint_path or self.model_id,
+            device=str(self.device),
+            dtype=str(self.pipe.unet.dtype),
+            prompt=self._decorate_prompt(request.prompt, request.add_stencil_suffix),
+            negative_prompt=request.negative_prompt or self.default_negative_prompt,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=float(request.guidance_scale),
+            width=width,
+            height=height,
+            seed=int(request.seed),
+            num_images=request.num_images,
+            clean_background=request.clean_background,
+            options=self._cache_options(options),
+        )
+
+    def _cache_options(self, options: dict) -> dict:
+        """Add the non-default decoder, CPU precision, engine, step cache, token merging and scheduler to a cache key's options."""
+        options = dict(options)
+        # Full guidance is the default, so it keeps the keys from before guidance schedules
+        if options.get("guidance_schedule") == "full":
+            options.pop("guidance_schedule")
+            options.pop("guidance_cutoff", None)
+        if self.decoder != "full":
+            options["decoder"] = self.decoder
+        if self.cpu_precision != "fp32":
+            options["cpu_precision"] = self.cpu_precision
+        if self.engine != "torch":
+            options["engine"] = self.engine
+        if self.step_cache_interval > 1 and self.engine == "torch":
+            options["step_cache_interval"] = self.step_cache_interval
+        if self.token_merge_ratio and self.engine == "torch":
+            options["token_merge_ratio"] = self.token_merge_ratio
+        if self.scheduler != self.default_scheduler:
+            options["scheduler"] = self.scheduler
+        return options
 
     def generate(
         self,
@@ -289,6 +2437,12 @@ class StencilGenerator:
         seed: Optional[int] = None,
         add_stencil_suffix: bool = True,
         clean_background: bool = True,
+        adaptive_steps: bool = False,
+        convergence_tolerance: float = 0.002,
+        guidance_schedule: str = "full",
+        guidance_cutoff: Optional[float] = None,
+        quality_preset: str = "custom",
+        cancel_token: Optional[CancellationToken] = None,
     ) -> Union[Image.Image, List[Image.Image]]:
         """
         Generate stencil images based on the prompt.
@@ -304,59 +2458,567 @@ class StencilGenerator:
             seed: Random seed for reproducibility (None for random)
             add_stencil_suffix: Whether to automatically add stencil styling to prompt
             clean_background: Whether to post-process into pure binary stencil (highly recommended)
+            adaptive_steps: Stop denoising early once the binarized stencil stops changing;
+                            the number of steps actually run is recorded in Image.info[STEPS_RUN_KEY]
+            convergence_tolerance: Fraction of stencil pixels allowed to change for early exit
+            guidance_schedule: "full" (guide every step), "truncate" (drop the unconditional
+                               branch after the first guidance_cutoff fraction of steps),
+                               "adaptive" (drop it once the conditional and unconditional
+                               predictions reach guidance_cutoff cosine similarity) or "off"
+                               (checkpoint models without a negative prompt only)
+            guidance_cutoff: Truncation fraction or adaptive similarity threshold (None for
+                             DEFAULT_GUIDANCE_CUTOFFS)
+            quality_preset: "custom" runs num_inference_steps; "fast" runs the minimal step
+                            count profiled for this model and scheduler (recommended_steps()),
+                            capped at num_inference_steps
+            cancel_token: Token that abandons the run (GenerationCancelled) when cancelled
 
         Returns:
             Single PIL Image if num_images=1, otherwise list of PIL Images
         """
+        num_inference_steps = self._preset_steps(num_inference_steps, quality_preset)
+        request = GenerationRequest(
+            prompt=prompt,
+            num_images=num_images,
+            negative_prompt=negative_prompt,
+            guidance_scale=guidance_scale,
+            seed=seed,
+            add_stencil_suffix=add_stencil_suffix,
+            clean_background=clean_background,
+            cancel_token=cancel_token,
+        )
+        options = dict(
+            adaptive_steps=adaptive_steps,
+            convergence_tolerance=convergence_tolerance,
+            guidance_schedule=guidance_schedule,
+            guidance_cutoff=guidance_cutoff,
+        )
+        compute = lambda: self.generate_batch([request], num_inference_steps, width, height, **options)[0]
 
+        key = self.result_cache_key(request, num_inference_steps, width, height, **options) if self.result_cache else None
+        images = self.result_cache.get_or_compute(key, compute) if key is not None else compute()
 
-        # Construct full prompt based on model type
-        full_prompt = prompt
-        if self.is_checkpoint_model:
-            # For fine-tuned checkpoints, add "sketch of" prefix
-            if add_stencil_suffix and not prompt.lower().startswith("sketch of"):
-                full_prompt = f"sketch of {prompt}"
-        else:
-            # For standard models, use stencil suffix
-            if add_stencil_suffix:
-                full_prompt = f"{prompt}, {self.stencil_suffix}"
+        # Return single image or list
+        return images[0] if num_images == 1 else images
 
-        # Use default negative prompt if none provided (None for checkpoint models)
-        full_negative_prompt = negative_prompt or self.default_negative_prompt
+    def _max_batch_images(self, width: int, height: int) -> int:
+        """
+        Estimate how many images fit in one UNet batch at this size.
 
-        # Set seed if provided
-        generator = None
-        if seed is not None:
-            generator = torch.Generator(device=self.device).manual_seed(seed)
+        On CUDA this divides the free memory by a rough per-image activation
+        cost (with classifier-free guidance, in the current precision); on
+        other devices it returns CPU_BATCH_IMAGES, since larger batches gain
+        little there.
 
-        print(f"Generating {num_images} stencil image(s)...")
-        print(f"Prompt: {full_prompt}")
+        Args:
+            width: Image width in pixels
+            height: Image height in pixels
 
-        # Generate images
-        with torch.autocast(self.device) if self.use_fp16 else torch.no_grad():
-            result = self.pipe(
-                prompt=full_prompt,
-                num_images_per_prompt=num_images,
-                negative_prompt=full_negative_prompt,
-                num_inference_steps=num_inference_steps,
-                guidance_scale=guidance_scale,
-                width=width,
-                height=height,
-                generator=generator,
+        Returns:
+            Images per UNet batch, between 1 and MAX_BATCH_IMAGES
+        """
+        if not str(self.device).startswith("cuda"):
+            return self.CPU_BATCH_IMAGES
+
+        free_bytes, _ = torch.cuda.mem_get_info()
+        per_image = self.BYTES_PER_IMAGE_512 * (width * height) / (512 * 512)
+        if not self.use_fp16:
+            per_image *= 2
+        return int(max(1, min(self.MAX_BATCH_IMAGES, 0.8 * free_bytes // per_image)))
+
+    def generate_many(
+        self,
+        requests: List[Union[GenerationRequest, tuple, dict]],
+        num_inference_steps: int = 25,
+        width: int = 512,
+        height: int = 512,
+        max_batch_images: Optional[int] = None,
+        adaptive_steps: bool = False,
+        convergence_tolerance: float = 0.002,
+        guidance_schedule: str = "full",
+        guidance_cutoff: Optional[float] = None,
+        quality_preset: str = "custom",
+    ) -> Iterator[GenerationResult]:
+        """
+        Generate many requests, packed into as few UNet batches as memory allows.
+
+        Every image gets its own torch.Generator, seeded with the request's
+        seed plus the image's index, so image i of a request with seed s is
+        the same as generate(prompt, seed=s + i) however the requests happen
+        to be packed. Requests may be split across batches; results are
+        yielded in request order as soon as each request is complete. If a
+        CUDA batch runs out of memory, it is retried at half the size.
+
+        Args:
+            requests: GenerationRequests, (prompt, seed, num_images) tuples or
+                      dicts of GenerationRequest fields
+            num_inference_steps: Number of denoising steps
+            width: Image width in pixels (must be divisible by 8)
+            height: Image height in pixels (must be divisible by 8)
+            max_batch_images: Images per UNet batch (None to estimate from free memory)
+            adaptive_steps: Stop each batch early once its binarized stencils stop changing
+            convergence_tolerance: Fraction of stencil pixels allowed to change for early exit
+            guidance_schedule, guidance_cutoff: Guidance schedule, as for generate()
+            quality_preset: Step count preset, as for generate()
+
+        Yields:
+            GenerationResult with the request's index, the request and its images
+        """
+        num_inference_steps = self._preset_steps(num_inference_steps, quality_preset)
+        requests = [_as_generation_request(spec) for spec in requests]
+        images = [[] for _ in requests]
+        next_index = 0
+
+        batches = self.iter_packed_batches(
+            requests,
+            num_inference_steps,
+            width,
+            height,
+            max_batch_images,
+            adaptive_steps=adaptive_steps,
+            convergence_tolerance=convergence_tolerance,
+            guidance_schedule=guidance_schedule,
+            guidance_cutoff=guidance_cutoff,
+        )
+        for chunk, pixels in batches:
+            clean_background = [unit.clean_background for _, unit in chunk]
+            with metrics.stage("postprocess", images=len(chunk)):
+                batch_images = self._postprocess(pixels, clean_background)
+            for (index, _), image in zip(chunk, batch_images):
+                images[index].append(image)
+
+            # Stream every request that is now complete, in order
+            while next_index < len(requests) and len(images[next_index]) == requests[next_index].num_images:
+                yield GenerationResult(next_index, requests[next_index], images[next_index])
+                images[next_index] = None
+                next_index += 1
+
+        # Requests asking for no images have nothing to wait for
+        while next_index < len(requests):
+            yield GenerationResult(next_index, requests[next_index], images[next_index])
+            next_index += 1
+
+    def iter_packed_batches(
+        self,
+        requests: List[GenerationRequest],
+        num_inference_steps: int = 25,
+        width: int = 512,
+        height: int = 512,
+        max_batch_images: Optional[int] = None,
+        **options
+    ) -> Iterator[Tuple[List[Tuple[int, GenerationRequest]], np.ndarray]]:
+        """
+        Denoise and decode requests in packed UNet batches, leaving post-processing to the caller.
+
+        This is the batching behind generate_many(): one single-image request
+        per output image, seeded with the request's seed plus the image index,
+        packed max_batch_images at a time. A CUDA batch that runs out of
+        memory is retried at half the size.
+
+        Args:
+            requests: Requests to generate
+            num_inference_steps: Number of denoising steps
+            width: Image width in pixels (must be divisible by 8)
+            height: Image height in pixels (must be divisible by 8)
+            max_batch_images: Images per UNet batch (None to estimate from free memory)
+            **options: adaptive_steps, convergence_tolerance and guidance options, as for generate_batch()
+
+        Yields:
+            (chunk, pixels): chunk lists (request index, single-image request)
+            for each row of pixels, a uint8 array of shape (B, H, W, 3)
+        """
+        batch_size = max_batch_images or self._max_batch_images(width, height)
+
+        # One single-image request per output image, so each gets its own generator
+        units = []
+        for index, request in enumerate(requests):
+            for i in range(request.num_images):
+                seed = request.seed + i if request.seed is not None else None
+                units.append((index, replace(request, num_images=1, seed=seed)))
+
+        total = len(units)
+        print(f"Generating {total} stencil image(s) for {len(requests)} request(s), up to {batch_size} per batch...")
+
+        start = 0
+        while start < total:
+            chunk = units[start:start + batch_size]
+            try:
+                with metrics.stage("generate_many_batch", batch=len(chunk)):
+                    pixels, _ = self._denoise_batch(
+                        [unit for _, unit in chunk], num_inference_steps, width, height, cache_latents=False, **options
+                    )
+            except torch.cuda.OutOfMemoryError:
+                if batch_size == 1:
+                    raise
+                torch.cuda.empty_cache()
+                batch_size = max(1, batch_size // 2)
+                print(f"Out of memory; retrying with {batch_size} image(s) per batch")
+                continue
+
+            start += len(chunk)
+            yield chunk, pixels
+
+    def _denoise_large(
+        self,
+        request: GenerationRequest,
+        num_inference_steps: int,
+        width: int,
+        height: int,
+        tile_size: int,
+        tile_overlap: int,
+        tile_batch: int,
+        is_cancelled: Optional[Callable[[], bool]] = None,
+        sequential_cfg: bool = False
+    ) -> torch.Tensor:
+        """
+        Denoise a large canvas as overlapping latent tiles (MultiDiffusion).
+
+        At every step each tile's noise prediction is computed (tiles batched
+        through the UNet) and the predictions are blended with feathered
+        weights into one full-canvas prediction. A single scheduler step on
+        the whole canvas then keeps the tiles consistent across seams, and
+        works with multistep schedulers too.
+
+        Tiles go through the same UNet as regular generation (engine, token
+        merging), except for the step cache: consecutive UNet calls see
+        different tiles, so there are no features to reuse.
+
+        Args:
+            request: The generation request
+            num_inference_steps: Number of denoising steps
+            width: Canvas width in pixels
+            height: Canvas height in pixels
+            tile_size: Tile size in pixels
+            tile_overlap: Overlap between neighbouring tiles in pixels
+            tile_batch: Tiles per UNet call
+            is_cancelled: Checked before every step; raises GenerationCancelled when it returns True
+            sequential_cfg: Run the unconditional and conditional passes separately (see _iter_denoise)
+
+        Returns:
+            Final latents of shape (num_images, C, height/8, width/8)
+        """
+        prompt_embeds, negative_prompt_embeds, guidance_scales, latents, generator = (
+            self._prepare_batch([request], width, height)
+        )
+        if self.step_cache_interval > 1:
+            print("Step cache skipped: tiled generation runs the UNet on different tiles every call")
+        unet, _ = self._denoising_unet(step_cache=False)
+        scheduler = self.pipe.scheduler.__class__.from_config(self.pipe.scheduler.config)
+        scheduler.set_timesteps(num_inference_steps, device=self.device)
+        latents = latents * scheduler.init_noise_sigma
+
+        scale = self.pipe.vae_scale_factor
+        latent_height, latent_width = latents.shape[-2:]
+        tile_height = min(tile_size // scale, latent_height)
+        tile_width = min(tile_size // scale, latent_width)
+        overlap = tile_overlap // scale
+        stride = max(1, min(tile_height, tile_width) - overlap)
+        views = [
+            (y, x)
+            for y in _tile_starts(latent_height, tile_height, stride)
+            for x in _tile_starts(latent_width, tile_width, stride)
+        ]
+        weights = _tile_weights(tile_height, tile_width, overlap).to(device=latents.device, dtype=latents.dtype)
+        weight_sum = torch.zeros((1, 1, latent_height, latent_width), device=latents.device, dtype=latents.dtype)
+        for y, x in views:
+            weight_sum[:, :, y:y + tile_height, x:x + tile_width] += weights
+        print(f"Denoising {len(views)} tile(s) of {tile_width * scale}x{tile_height * scale}, {tile_batch} per UNet call")
+
+        guidance_scale = float(guidance_scales[0])
+        do_classifier_free_guidance = guidance_scale > 1.0
+        n = latents.shape[0]
+
+        step_kwargs = {}
+        if generator is not None and "generator" in inspect.signature(scheduler.step).parameters:
+            step_kwargs["generator"] = generator
+
+        for i, t in enumerate(scheduler.timesteps):
+            if is_cancelled is not None and is_cancelled():
+                raise GenerationCancelled(f"Generation cancelled after {i} steps")
+
+            with metrics.stage("unet_step", step=i, batch=n, tiles=len(views)):
+                latent_model_input = scheduler.scale_model_input(latents, t)
+                noise_pred = torch.zeros_like(latents)
+
+                for start in range(0, len(views), tile_batch):
+                    batch_views = views[start:start + tile_batch]
+                    crops = torch.cat([
+                        latent_model_input[:, :, y:y + tile_height, x:x + tile_width] for y, x in batch_views
+                    ])
+                    rows = len(batch_views)
+                    tile_prompt_embeds = prompt_embeds.repeat(rows, 1, 1)
+                    if do_classifier_free_guidance:
+                        tile_negative_embeds = negative_prompt_embeds.repeat(rows, 1, 1)
+                        if sequential_cfg:
+                            tile_pred_uncond = unet(crops, t, encoder_hidden_states=tile_negative_embeds).sample
+                            tile_pred_text = unet(crops, t, encoder_hidden_states=tile_prompt_embeds).sample
+                        else:
+                            tile_pred = unet(
+                                torch.cat([crops, crops]),
+                                t,
+                                encoder_hidden_states=torch.cat([tile_negative_embeds, tile_prompt_embeds]),
+                            ).sample
+                            tile_pred_uncond, tile_pred_text = tile_pred.chunk(2)
+                        tile_pred = tile_pred_uncond + guidance_scale * (tile_pred_text - tile_pred_uncond)
+                    else:
+                        tile_pred = unet(crops, t, encoder_hidden_states=tile_prompt_embeds).sample
+
+                    for k, (y, x) in enumerate(batch_views):
+                        noise_pred[:, :, y:y + tile_height, x:x + tile_width] += tile_pred[k * n:(k + 1) * n] * weights
+
+                noise_pred = noise_pred / weight_sum
+                latents = scheduler.step(noise_pred, t, latents, **step_kwargs).prev_sample
+
+        return latents
+
+    def generate_large(
+        self,
+        prompt: str,
+        width: int = 2048,
+        height: int = 2048,
+        num_images: int = 1,
+        negative_prompt: Optional[str] = None,
+        num_inference_steps: int = 25,
+        guidance_scale: float = 7.5,
+        seed: Optional[int] = None,
+        add_stencil_suffix: bool = True,
+        clean_background: bool = True,
+        tile_size: int = 512,
+        tile_overlap: int = 128,
+        tile_batch: Optional[int] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Union[Image.Image, List[Image.Image]]:
+        """
+        Generate a mural-size stencil by denoising overlapping tiles of one large canvas.
+
+        Memory is bounded by the tile size and tile_batch rather than the
+        canvas size: the UNet only ever sees tiles, and the VAE decodes in
+        tiles too. Tiles are batched through the UNet, so throughput per
+        pixel stays close to regular generation. A memory_plan or
+        memory_budget_mb applies per tile batch, token merging applies as
+        usual, and the step cache is skipped (see _denoise_large). With the
+        compile engine, tile_size is snapped to a square compile bucket so
+        every tile batch reuses a compiled graph.
+
+        Args:
+            prompt, num_images, negative_prompt, num_inference_steps, guidance_scale,
+            seed, add_stencil_suffix, clean_background, cancel_token: Same as generate()
+            width: Canvas width in pixels (must be divisible by 8), e.g. 2048-4096
+            height: Canvas height in pixels (must be divisible by 8)
+            tile_size: Tile size in pixels, ideally the model's native resolution
+            tile_overlap: Overlap between neighbouring tiles in pixels; more overlap
+                          gives smoother seams at the cost of more tiles
+            tile_batch: Tiles per UNet call (None to estimate from free memory)
+
+        Returns:
+            Single PIL Image if num_images=1, otherwise list of PIL Images
+
+        Raises:
+            ValueError: If the tiles overlap completely, or with the compile engine
+                        when the canvas is smaller than one tile
+        """
+        if self.engine == "compile":
+            bucket_size = min(self._backend.snap_resolution(tile_size, tile_size))
+            if bucket_size != tile_size:
+                print(f"Tile size snapped to the {bucket_size}px compile bucket")
+                tile_overlap = min(tile_overlap, bucket_size // 2)
+                tile_size = bucket_size
+            # Tiles are cropped to the canvas, which would compile a new shape
+            if width < tile_size or height < tile_size:
+                raise ValueError(
+                    f"With the compile engine the canvas ({width}x{height}) must be at least "
+                    f"one {tile_size}px tile; use generate() for smaller images"
+                )
+        if tile_overlap >= tile_size:
+            raise ValueError(f"tile_overlap ({tile_overlap}) must be smaller than tile_size ({tile_size})")
+
+        request = GenerationRequest(
+            prompt=prompt,
+            num_images=num_images,
+            negative_prompt=negative_prompt,
+            guidance_scale=guidance_scale,
+            seed=seed,
+            add_stencil_suffix=add_stencil_suffix,
+            clean_background=clean_background,
+        )
+        tile_batch = tile_batch or max(1, self._max_batch_images(tile_size, tile_size) // num_images)
+        is_cancelled = (lambda: cancel_token.cancelled) if cancel_token is not None else None
+
+        # The UNet's working set is one tile batch, so that is what the plan is sized for
+        plan = self._prepare_memory(num_images * tile_batch, tile_size, tile_size)
+        bounded = plan is not None
+        stage = (
+            metrics.stage("bounded_generation", reset_peak_rss=True, plan=plan.describe())
+            if bounded else contextlib.nullcontext({})
+        )
+        with self._inference_context(), stage as record:
+            latents = self._denoise_large(
+                request, num_inference_steps, width, height, tile_size, tile_overlap, tile_batch, is_cancelled,
+                sequential_cfg=bounded and plan.sequential_cfg,
             )
 
-        images = result.images
+            # The full-canvas decode would need far more memory than any tile
+            vae = self._tiny_vae if self.decoder == "tiny" else self.pipe.vae
+            use_tiling, use_slicing = vae.use_tiling, vae.use_slicing
+            vae.enable_tiling()
+            vae.enable_slicing()
+            try:
+                pixels = self._decode_latents(latents)
+            finally:
+                vae.use_tiling, vae.use_slicing = use_tiling, use_slicing
+        if bounded:
+            self._report_peak_memory(record)
 
-        # Apply post-processing to clean background if enabled
-        if clean_background:
-            print("Cleaning background...")
-            images = [self._clean_stencil_image(img) for img in images]
+        with metrics.stage("postprocess", images=num_images):
+            images = self._postprocess(pixels, [clean_background] * num_images)
+        self._tag_results(images, [{STEPS_RUN_KEY: num_inference_steps}] * num_images)
 
         print("Generation complete!")
-
-        # Return single image or list
         return images[0] if num_images == 1 else images
 
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Return the executor dedicated to this generator's async calls, creating it on first use."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.ASYNC_WORKERS, thread_name_prefix="stencil-generate"
+                )
+            return self._executor
+
+    async def agenerate(
+        self,
+        prompt: str,
+        num_images: int = 1,
+        negative_prompt: Optional[str] = None,
+        num_inference_steps: int = 25,
+        guidance_scale: float = 7.5,
+        width: int = 512,
+        height: int = 512,
+        seed: Optional[int] = None,
+        add_stencil_suffix: bool = True,
+        clean_background: bool = True,
+        adaptive_steps: bool = False,
+        convergence_tolerance: float = 0.002,
+        guidance_schedule: str = "full",
+        guidance_cutoff: Optional[float] = None,
+        quality_preset: str = "custom",
+        cancel_token: Optional[CancellationToken] = None,
+        batcher=None,
+    ) -> List[Image.Image]:
+        """
+        Generate stencil images without blocking the event loop, cancellably.
+
+        Direct runs use this generator's dedicated executor. With a batcher,
+        the request is awaited on the event loop instead, so every concurrent
+        caller reaches the batcher's queue however many batches are running
+        (only the result cache's disk lookup takes a worker thread). If the
+        awaiting task is cancelled (e.g. the client went away), the token is
+        cancelled, a still-queued request is withdrawn from the batcher and
+        the coroutine returns at once; a running worker stops before its next
+        denoising step. Cancelling the token directly has the same effect on
+        the running generation.
+
+        Args:
+            prompt, num_images, negative_prompt, num_inference_steps,
+            guidance_scale, width, height, seed, add_stencil_suffix,
+            clean_background, adaptive_steps, convergence_tolerance,
+            guidance_schedule, guidance_cutoff, quality_preset: Same as generate()
+            cancel_token: Token to cancel the run with (one is created if None)
+            batcher: Optional DynamicBatcher to share UNet batches with concurrent requests
+
+        Returns:
+            List of PIL Images
+
+        Raises:
+            GenerationCancelled: If the token was cancelled while the coroutine was still awaited
+        """
+        num_inference_steps = self._preset_steps(num_inference_steps, quality_preset)
+        cancel_token = cancel_token or CancellationToken()
+        request = GenerationRequest(
+            prompt=prompt,
+            num_images=num_images,
+            negative_prompt=negative_prompt,
+            guidance_scale=guidance_scale,
+            seed=seed,
+            add_stencil_suffix=add_stencil_suffix,
+            clean_background=clean_background,
+            cancel_token=cancel_token,
+        )
+        options = dict(
+            adaptive_steps=adaptive_steps,
+            convergence_tolerance=convergence_tolerance,
+            guidance_schedule=guidance_schedule,
+            guidance_cutoff=guidance_cutoff,
+        )
+
+        key = self.result_cache_key(request, num_inference_steps, width, height, **options) if self.result_cache else None
+        loop = asyncio.get_running_loop()
+        try:
+            if batcher is None:
+                compute = lambda: self.generate_batch([request], num_inference_steps, width, height, **options)[0]
+                work = (lambda: self.result_cache.get_or_compute(key, compute)) if key is not None else compute
+
+                # Carry the caller's context (request ids for metrics) into the worker thread
+                context = contextvars.copy_context()
+                return await loop.run_in_executor(self._get_executor(), context.run, work)
+
+            submit = lambda: batcher.submit(self, request, num_inference_steps, width, height, **options)
+            if key is None:
+                future = submit()
+                try:
+                    return await asyncio.wrap_future(future)
+                finally:
+                    # Withdraws the request if it is still queued; no-op once it runs or is done
+                    future.cancel()
+
+            images = await loop.run_in_executor(self._get_executor(), self.result_cache.get, key)
+            if images is not None:
+                return images
+            return await self.result_cache.aget_or_compute(key, submit)
+        except asyncio.CancelledError:
+            cancel_token.cancel()
+            raise
+
+    async def agenerate_stream(
+        self,
+        prompt: str,
+        cancel_token: Optional[CancellationToken] = None,
+        **kwargs
+    ) -> AsyncIterator[GenerationPreview]:
+        """
+        Stream previews like generate_stream() without blocking the event loop, cancellably.
+
+        The denoising loop is stepped on this generator's dedicated executor,
+        so streamed runs share the ASYNC_WORKERS bound with agenerate()
+        instead of taking threads of their own. When the consumer is cancelled
+        or stops iterating, the token is cancelled and the worker stops
+        before its next denoising step.
+
+        Args:
+            prompt: Text description of the desired stencil
+            cancel_token: Token to cancel the run with (one is created if None)
+            **kwargs: Any other generate_stream() arguments
+
+        Yields:
+            GenerationPreview updates; the last one has final=True
+        """
+        cancel_token = cancel_token or CancellationToken()
+        stream = self.generate_stream(prompt, cancel_token=cancel_token, **kwargs)
+
+        # One context for every step, so the run's metrics stages nest as in a single thread
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            while True:
+                update = await loop.run_in_executor(executor, context.run, next, stream, None)
+                if update is None:
+                    return
+                yield update
+        finally:
+            # Harmless once the stream has finished
+            cancel_token.cancel()
+
     def save_image(
         self,
         image: Image.Image,
@@ -374,7 +3036,8 @@ class StencilGenerator:
         if create_dirs:
             os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
 
-        image.save(output_path)
+        with metrics.stage("png_encode", target="file"):
+            image.save(output_path)
         print(f"Image saved to: {output_path}")
 
     def generate_and_save(
@@ -0,0 +1,214 @@
+"""
+StencilBatcher - Cross-request dynamic batching for diffusion inference
+
+Concurrent users each asking for a couple of images would otherwise run the
+UNet as many small batches back to back. The DynamicBatcher collects requests
+that arrive within a short window, groups the ones that can share a denoising
+loop (same generator/model, size, step count and loop options) and runs each group as one
+batch through StencilGenerator.generate_batch. Every request keeps its own
+prompt, seed and guidance scale, and its images are handed back to the caller
+through a Future. A running batch is abandoned once all of its requests have
+been cancelled through their cancel tokens.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import List
+
+from Stencil import StencilGenerator, GenerationRequest, GenerationCancelled
+from StencilMetrics import metrics
+
+
+class _PendingRequest:
+    """A request waiting in the batching queue, with the Future its caller is blocked on."""
+
+    def __init__(self, generator, request, num_inference_steps, width, height, options):
+        self.generator = generator
+        self.request = request
+        self.num_inference_steps = num_inference_steps
+        self.width = width
+        self.height = height
+        self.options = options
+        self.request_ids = metrics.current_request_ids()
+        self.future = Future()
+
+    @property
+    def batch_key(self):
+        """Requests with the same key can share one denoising loop."""
+        options = tuple(sorted(self.options.items()))
+        return (id(self.generator), self.width, self.height, self.num_inference_steps, options)
+
+
+class DynamicBatcher:
+    """
+    Batches generation requests from concurrent callers into shared UNet runs.
+
+    A single worker thread owns inference: it waits for a request, keeps
+    collecting for up to window_ms, then runs compatible requests together.
+    """
+
+    def __init__(self, window_ms: float = 50, max_batch_images: int = 4):
+        """
+        Initialize the batcher and start its worker thread.
+
+        Args:
+            window_ms: How long to wait for more requests after the first one arrives
+            max_batch_images: Maximum number of images per UNet batch
+        """
+        self.window_ms = window_ms
+        self.max_batch_images = max_batch_images
+
+        self.batches_run = 0
+        self.requests_served = 0
+
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="stencil-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(
+        self,
+        generator: StencilGenerator,
+        request: GenerationRequest,
+        num_inference_steps: int = 25,
+        width: int = 512,
+        height: int = 512,
+        **options
+    ) -> Future:
+        """
+        Queue a request for batched generation.
+
+        Args:
+            generator: Generator (model) to run the request on
+            request: Prompt, seed, guidance and post-processing settings
+            num_inference_steps: Number of denoising steps
+            width: Image width in pixels
+            height: Image height in pixels
+            **options: Batch-wide generate_batch options (e.g. adaptive_steps);
+                       only requests with equal options are batched together
+
+        Returns:
+            Future resolving to the request's list of PIL Images
+        """
+        pending = _PendingRequest(generator, request, num_inference_steps, width, height, options)
+        self._queue.put(pending)
+        return pending.future
+
+    def generate(
+        self,
+        generator: StencilGenerator,
+        request: GenerationRequest,
+        num_inference_steps: int = 25,
+        width: int = 512,
+        height: int = 512,
+        **options
+    ) -> List:
+        """
+        Submit a request and block until its images are ready.
+
+        Returns:
+            List of PIL Images for the request
+        """
+        return self.submit(generator, request, num_inference_steps, width, height, **options).result()
+
+    def _collect(self) -> List[_PendingRequest]:
+        """Block for the first request, then gather whatever arrives within the window."""
+        pending = [self._queue.get()]
+        deadline = time.monotonic() + self.window_ms / 1000
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return pending
+
+    def _group(self, pending: List[_PendingRequest]) -> List[List[_PendingRequest]]:
+        """Split collected requests into compatible batches of at most max_batch_images."""
+        groups = {}
+        for item in pending:
+            groups.setdefault(item.batch_key, []).append(item)
+
+        batches = []
+        for items in groups.values():
+            batch, batch_images = [], 0
+            for item in items:
+                if batch and batch_images + item.request.num_images > self.max_batch_images:
+                    batches.append(batch)
+                    batch, batch_images = [], 0
+                batch.append(item)
+                batch_images += item.request.num_images
+            batches.append(batch)
+        return batches
+
+    def _run_batch(self, batch: List[_PendingRequest]):
+        """Run one batch and resolve each caller's Future with its own images."""
+        # Drop requests whose callers gave up while they were queued
+        runnable = []
+        for item in batch:
+            if not item.future.set_running_or_notify_cancel():
+                continue
+            token = item.request.cancel_token
+            if token is not None and token.cancelled:
+                item.future.set_exception(GenerationCancelled("Generation cancelled before it started"))
+                continue
+            runnable.append(item)
+        batch = runnable
+        if not batch:
+            return
+
+        first = batch[0]
+        request_ids = [request_id for item in batch for request_id in item.request_ids]
+        try:
+            with metrics.bind(request_ids):
+                results = first.generator.generate_batch(
+                    [item.request for item in batch],
+                    num_inference_steps=first.num_inference_steps,
+                    width=first.width,
+                    height=first.height,
+                    **first.options
+                )
+        except Exception as e:
+            for item in batch:
+                item.future.set_exception(e)
+            return
+
+        for item, images in zip(batch, results):
+            item.future.set_result(images)
+
+        self.batches_run += 1
+        self.requests_served += len(batch)
+        if len(batch) > 1:
+            print(f"Batched {len(batch)} requests into one denoising run")
+
+    def _fail(self, items: List[_PendingRequest], error: Exception):
+        """Fail the Futures of items that are still unresolved (e.g. not cancelled or answered meanwhile)."""
+        print(f"Batcher error: {error!r}")
+        for item in items:
+            if item.future.done():
+                continue
+            try:
+                item.future.set_exception(error)
+            except InvalidStateError:
+                pass
+
+    def _run(self):
+        """Worker loop: collect, group and run batches forever."""
+        # The worker is the only thread serving the queue, so an error must fail its
+        # requests rather than the thread, or every later caller would wait forever
+        while True:
+            pending = self._collect()
+            try:
+                batches = self._group(pending)
+            except Exception as e:
+                self._fail(pending, e)
+                continue
+            for batch in batches:
+                try:
+                    self._run_batch(batch)
+                except Exception as e:
+                    self._fail(batch, e)
@@ -11,12 +11,17 @@ Approaches:
 3. Threshold-based - converts to binary black/white
 """
 
-import cv2
 import numpy as np
 from PIL import Image
 from typing import Union, Literal
 import os
 
+from StencilMetrics import metrics
+from StencilStartup import lazy_import
+
+# Loaded on first use so importing this module (e.g. from app.py) stays cheap
+cv2 = lazy_import("cv2")
+
 
 class StencilCV:
     """
@@ -50,11 +55,15 @@ class StencilCV:
         Convert PIL Image to OpenCV format.
 
         Args:
-            pil_image: PIL Image object
+            pil_image: PIL Image object (RGB or grayscale 'L')
 
         Returns:
             Image as numpy array (BGR format)
         """
+        # Single-channel stencils (e.g. from StencilGenerator) expand straight to BGR
+        if pil_image.mode == 'L':
+            return cv2.cvtColor(np.array(pil_image), cv2.COLOR_GRAY2BGR)
+
         # Convert PIL (RGB) to OpenCV (BGR)
         return cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
 
@@ -73,6 +82,7 @@ class StencilCV:
         else:  # BGR to RGB
             return Image.fromarray(cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB))
 
+    @metrics.timed("cv_edge")
     def edge_stencil(
         self,
         image: Union[str, np.ndarray, Image.Image],
@@ -128,6 +138,7 @@ class StencilCV:
 
         return self.to_pil(result)
 
+    @metrics.timed("cv_silhouette")
     def silhouette_stencil(
         self,
         image: Union[str, np.ndarray, Image.Image],
@@ -233,6 +244,7 @@ class StencilCV:
 
         return self.to_pil(result)
 
+    @metrics.timed("cv_hybrid")
     def hybrid_stencil(
         self,
         image: Union[str, np.ndarray, Image.Image],
@@ -314,7 +326,8 @@ class StencilCV:
             output_path: Path to save image
         """
         os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
-        image.save(output_path)
+        with metrics.stage("png_encode", target="file"):
+            image.save(output_path)
         print(f"Saved stencil to: {output_path}")
 
 
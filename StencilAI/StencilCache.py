@@ -0,0 +1,331 @@
+"""
+StencilCache - Content-addressed cache of finished stencil images
+
+With a fixed seed, StencilGenerator output depends only on its inputs (model,
+decorated prompt, negative prompt, steps, guidance, size, seed and cleaning).
+ResultCache stores the final images on disk under a hash of those inputs,
+keeps the most recent results in memory, and coalesces identical requests
+that are in flight at the same time onto a single computation.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from StencilMetrics import metrics
+
+
+def make_cache_key(**inputs) -> str:
+    """
+    Hash generation inputs into a content address.
+
+    Args:
+        **inputs: JSON-serializable values that fully determine the output
+
+    Returns:
+        Hex SHA-256 digest of the canonicalized inputs
+    """
+    payload = json.dumps(inputs, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier (memory + disk) cache of generated stencil images.
+
+    Each entry is a directory of PNGs named after the cache key. Disk usage is
+    bounded by max_disk_mb with least-recently-used eviction; the memory tier
+    holds the last max_memory_entries results.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = ".stencil_cache",
+        max_disk_mb: float = 512,
+        max_memory_entries: int = 32
+    ):
+        """
+        Initialize the cache, indexing any entries already on disk.
+
+        Args:
+            cache_dir: Directory to store cached images in
+            max_disk_mb: Maximum disk usage in MB before evicting old entries
+            max_memory_entries: Number of results to keep in memory
+        """
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = int(max_disk_mb * 1024 ** 2)
+        self.max_memory_entries = max_memory_entries
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        self._memory = OrderedDict()  # key -> list of images
+        self._disk = OrderedDict()  # key -> size in bytes, least recently used first
+        self._inflight = {}  # key -> Future for computations in progress
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_disk()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _index_disk(self):
+        """Rebuild the LRU index from existing entries, oldest access first."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = self._entry_dir(name)
+            if not os.path.isdir(path) or name.startswith("."):
+                continue
+            files = [os.path.join(path, f) for f in os.listdir(path)]
+            size = sum(os.path.getsize(f) for f in files)
+            entries.append((os.path.getmtime(path), name, size))
+
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+
+    def _remember(self, key: str, images: List[Image.Image]):
+        """Put a result in the memory tier, evicting the oldest beyond the limit."""
+        self._memory[key] = images
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[List[Image.Image]]:
+        """Load an entry's images from disk, or None if it is missing or unreadable."""
+        path = self._entry_dir(key)
+        try:
+            names = sorted(os.listdir(path), key=lambda f: int(os.path.splitext(f)[0]))
+            images = []
+            for name in names:
+                image = Image.open(os.path.join(path, name))
+                image.load()
+                images.append(image)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return images
+
+    def _write_disk(self, key: str, images: List[Image.Image]):
+        """Write an entry atomically, then evict old entries beyond the disk budget."""
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+        with metrics.stage("png_encode", images=len(images), target="cache"):
+            for idx, image in enumerate(images):
+                # PNG only keeps Image.info text as text chunks (e.g. the result id tag)
+                text = PngInfo()
+                for name, value in image.info.items():
+                    if isinstance(value, str):
+                        text.add_text(name, str(value))
+                image.save(os.path.join(tmp_dir, f"{idx}.png"), pnginfo=text)
+        size = sum(os.path.getsize(os.path.join(tmp_dir, f)) for f in os.listdir(tmp_dir))
+
+        try:
+            os.replace(tmp_dir, self._entry_dir(key))
+        except OSError:
+            # Another process already stored this entry
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        with self._lock:
+            self._disk[key] = size
+            self._disk.move_to_end(key)
+            while len(self._disk) > 1 and sum(self._disk.values()) > self.max_disk_bytes:
+                evicted, _ = self._disk.popitem(last=False)
+                self._memory.pop(evicted, None)
+                shutil.rmtree(self._entry_dir(evicted), ignore_errors=True)
+                self.evictions += 1
+
+    def get(self, key: str) -> Optional[List[Image.Image]]:
+        """
+        Look up a result in memory, then on disk.
+
+        Args:
+            key: Cache key from make_cache_key
+
+        Returns:
+            Copies of the cached images, or None on a miss
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return [image.copy() for image in self._memory[key]]
+            on_disk = key in self._disk
+
+        if not on_disk:
+            return None
+
+        images = self._read_disk(key)
+        if images is None:
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._remember(key, images)
+        return [image.copy() for image in images]
+
+    def put(self, key: str, images: List[Image.Image]):
+        """
+        Store a result in both tiers.
+
+        Args:
+            key: Cache key from make_cache_key
+            images: Final stencil images for the request
+        """
+        images = [image.copy() for image in images]
+        with self._lock:
+            self._remember(key, images)
+        self._write_disk(key, images)
+
+    def get_or_compute(self, key: str, compute: Callable[[], List[Image.Image]]) -> List[Image.Image]:
+        """
+        Return the cached result for key, computing it once if needed.
+
+        Concurrent callers asking for the same key while it is being computed
+        wait for that computation instead of starting their own. If that
+        computation fails (e.g. its caller cancelled it), a waiter takes over.
+
+        Args:
+            key: Cache key from make_cache_key
+            compute: Zero-argument function producing the images on a miss
+
+        Returns:
+            List of PIL Images
+        """
+        images = self.get(key)
+        if images is not None:
+            return images
+
+        while True:
+            with self._lock:
+                # The owner of an in-flight computation may have just finished
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return [image.copy() for image in self._memory[key]]
+
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._inflight[key] = future
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+
+            if owner:
+                break
+
+            try:
+                return [image.copy() for image in future.result()]
+            except Exception:
+                # The owner failed or was cancelled; compute it ourselves
+                continue
+
+        try:
+            images = compute()
+            self.put(key, images)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_result(images)
+        return [image.copy() for image in images]
+
+    async def aget_or_compute(self, key: str, submit: Callable[[], Future]) -> List[Image.Image]:
+        """
+        Like get_or_compute(), for computations that run elsewhere, awaited without holding a thread.
+
+        Only the memory tier and in-flight computations are checked, since a
+        disk read would block the event loop: call get() from a worker thread
+        first. Disk writes run in a worker thread.
+
+        Args:
+            key: Cache key from make_cache_key
+            submit: Zero-argument function starting the computation on a miss and
+                    returning its Future (e.g. a DynamicBatcher.submit call); the
+                    Future is cancelled if the awaiting task is
+
+        Returns:
+            List of PIL Images
+        """
+        while True:
+            with self._lock:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return [image.copy() for image in self._memory[key]]
+
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._inflight[key] = future
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+
+            if owner:
+                break
+
+            try:
+                # Shielded: a waiter giving up must not cancel the owner's Future
+                return [image.copy() for image in await asyncio.shield(asyncio.wrap_future(future))]
+            except Exception:
+                # The owner failed or was cancelled; compute it ourselves
+                continue
+
+        computation = submit()
+        try:
+            images = await asyncio.wrap_future(computation)
+            await asyncio.to_thread(self.put, key, images)
+        except BaseException as e:
+            computation.cancel()
+            with self._lock:
+                self._inflight.pop(key, None)
+            # Waiters take over on an Exception; the owner's own cancellation must not cancel them
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError(f"Computation of {key} was abandoned"))
+            raise
+
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_result(images)
+        return [image.copy() for image in images]
+
+    def info(self) -> dict:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dictionary with hit/miss/coalesced/eviction counters and occupancy
+        """
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk),
+                "disk_mb": sum(self._disk.values()) / 1024 ** 2,
+            }
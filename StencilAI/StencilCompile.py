@@ -0,0 +1,275 @@
+"""
+StencilCompile - torch.compile engine with shape buckets and a persistent compile cache
+
+Compiles the UNet and VAE decoder (in channels_last layout) with static
+shapes, one graph per (resolution, batch) bucket. Requests are snapped to
+the buckets so traffic never triggers a fresh compile:
+
+    resolution  StencilGenerator generates at the closest bucket resolution
+                (by aspect ratio, then area) and resizes the decoded pixels
+                to the requested size
+    batch       UNet and decoder batches are padded up to the next bucket
+                size and the padding rows are dropped from the output
+
+With torch >= 2.7, torch's portable compile cache artifacts (Inductor
+kernels and AOT graphs) are saved to <cache dir>/compile_artifacts.bin after every new graph and
+loaded at startup, so a restart (even on a fresh machine with the same cache
+directory) skips kernel compilation. Dynamo still traces each graph again,
+which takes seconds rather than minutes.
+
+Any graph compiled after precompile() is counted in stats()["recompiles"];
+it stays at zero when precompile() covered every bucket traffic hits.
+"""
+
+import math
+import os
+from types import SimpleNamespace
+from typing import Iterable, Optional, Tuple
+
+from StencilMetrics import metrics
+from StencilStartup import lazy_import
+
+torch = lazy_import("torch")
+
+# (width, height) buckets: the UI default and warm-up sizes first, then the extremes and portrait/landscape
+COMPILE_RESOLUTIONS = ((512, 512), (256, 256), (768, 768), (1024, 1024), (512, 768), (768, 512))
+# Images per decode and rows per UNet call (classifier-free guidance doubles the images)
+COMPILE_BATCH_SIZES = (1, 2, 4, 8, 16)
+ARTIFACTS = "compile_artifacts.bin"
+
+
+def snap_batch(size: int, batch_sizes: Iterable[int] = COMPILE_BATCH_SIZES) -> int:
+    """Return the smallest bucket batch size that fits size rows (size itself above the largest bucket)."""
+    return min((bucket for bucket in batch_sizes if bucket >= size), default=size)
+
+
+def snap_resolution(
+    width: int,
+    height: int,
+    resolutions: Iterable[Tuple[int, int]] = COMPILE_RESOLUTIONS
+) -> Tuple[int, int]:
+    """
+    Pick the bucket resolution to generate a width x height request at.
+
+    Aspect distortion is weighted twice as heavily as a change of area, since
+    a squashed stencil is more visible than a slightly softer one.
+
+    Args:
+        width: Requested width in pixels
+        height: Requested height in pixels
+        resolutions: Bucket (width, height) pairs
+
+    Returns:
+        The closest bucket (width, height)
+    """
+    def distance(bucket):
+        bucket_width, bucket_height = bucket
+        aspect = abs(math.log((bucket_width / bucket_height) / (width / height)))
+        area = abs(math.log((bucket_width * bucket_height) / (width * height)))
+        return 2 * aspect + area
+
+    return min(resolutions, key=distance)
+
+
+def _pad_batch(tensor, size: int):
+    """Pad a tensor's batch dimension to size rows by repeating its last row."""
+    missing = size - tensor.shape[0]
+    if missing <= 0:
+        return tensor
+    return torch.cat([tensor, tensor[-1:].expand(missing, *tensor.shape[1:])])
+
+
+class CompiledUNet:
+    """UNet2DConditionModel stand-in running the compiled UNet on bucket-sized batches."""
+
+    def __init__(self, engine: "CompileEngine", unet):
+        self.engine = engine
+        self.config = unet.config
+        self.dtype = unet.dtype
+        self._compiled = torch.compile(unet, dynamic=False, mode=engine.mode)
+
+    def __call__(self, sample, timestep, encoder_hidden_states):
+        rows = sample.shape[0]
+        size = snap_batch(rows, self.engine.batch_sizes)
+        sample = _pad_batch(sample, size).contiguous(memory_format=torch.channels_last)
+        encoder_hidden_states = _pad_batch(encoder_hidden_states, size)
+        noise_pred = self.engine.run(
+            "unet", self._compiled, (sample, timestep), encoder_hidden_states=encoder_hidden_states, return_dict=False
+        )[0]
+        return SimpleNamespace(sample=noise_pred[:rows])
+
+
+class CompiledVaeDecoder:
+    """AutoencoderKL stand-in for decoding, running the compiled decode on bucket-sized batches."""
+
+    def __init__(self, engine: "CompileEngine", vae):
+        self.engine = engine
+        self.config = vae.config
+        self._compiled = torch.compile(vae.decode, dynamic=False, mode=engine.mode)
+
+    def decode(self, latents):
+        rows = latents.shape[0]
+        latents = _pad_batch(latents, snap_batch(rows, self.engine.batch_sizes)).contiguous(memory_format=torch.channels_last)
+        image = self.engine.run("vae_decoder", self._compiled, (latents,), return_dict=False)[0]
+        return SimpleNamespace(sample=image[:rows])
+
+
+class CompileEngine:
+    """
+    torch.compile versions of a pipeline's UNet and VAE decoder.
+
+    The text encoder runs once per prompt (and is cached), so it stays eager.
+    The pipeline's UNet and VAE are converted to channels_last in place.
+    """
+
+    def __init__(
+        self,
+        pipe,
+        cache_dir: str,
+        resolutions: Optional[Iterable[Tuple[int, int]]] = None,
+        batch_sizes: Optional[Iterable[int]] = None,
+        mode: Optional[str] = None
+    ):
+        """
+        Set up the compile cache and wrap the UNet and VAE decoder.
+
+        Nothing is compiled until the first call or precompile().
+
+        Args:
+            pipe: StableDiffusionPipeline to take the components from
+            cache_dir: Directory for the persistent compile cache
+            resolutions: (width, height) buckets (default COMPILE_RESOLUTIONS)
+            batch_sizes: Batch buckets (default COMPILE_BATCH_SIZES)
+            mode: torch.compile mode (e.g. "max-autotune"; None for the default)
+        """
+        self.cache_dir = cache_dir
+        self.resolutions = [tuple(r) for r in (resolutions or COMPILE_RESOLUTIONS)]
+        self.batch_sizes = sorted(batch_sizes or COMPILE_BATCH_SIZES)
+        self.mode = mode
+        self.vae_scale_factor = pipe.vae_scale_factor
+        self.compiled_shapes = set()
+        self.recompiles = 0
+        self._precompiled = False
+        self.device = pipe.unet.device
+        text_config = pipe.text_encoder.config
+        self.cross_attention_shape = (text_config.max_position_embeddings, text_config.hidden_size)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_artifacts()
+
+        # Every bucket is a separate static graph, beyond Dynamo's default of 8 per function
+        graphs = len(self.resolutions) * len(self.batch_sizes)
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, graphs + 8)
+
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+        self.text_encoder = pipe.text_encoder
+        self.unet = CompiledUNet(self, pipe.unet)
+        self.vae = CompiledVaeDecoder(self, pipe.vae)
+
+    def _load_artifacts(self):
+        """Load saved compile cache artifacts, if any (needs torch >= 2.7)."""
+        path = os.path.join(self.cache_dir, ARTIFACTS)
+        if not os.path.exists(path) or not hasattr(torch.compiler, "load_cache_artifacts"):
+            return
+        try:
+            with open(path, "rb") as f:
+                torch.compiler.load_cache_artifacts(f.read())
+            print(f"Loaded compile cache from {path}")
+        except Exception as e:
+            # A cache from another torch version is useless but harmless
+            print(f"Ignoring compile cache {path}: {e}")
+
+    def save(self):
+        """Write everything compiled so far to the cache artifacts file, atomically (needs torch >= 2.7)."""
+        if not hasattr(torch.compiler, "save_cache_artifacts"):
+            return
+        artifacts = torch.compiler.save_cache_artifacts()
+        if not artifacts:
+            return
+        path = os.path.join(self.cache_dir, ARTIFACTS)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(artifacts[0])
+        os.replace(tmp_path, path)
+
+    def run(self, name: str, compiled, inputs, **kwargs):
+        """
+        Call a compiled function, recording (and timing) the first call of each input shape.
+
+        Args:
+            name: "unet" or "vae_decoder"
+            compiled: The torch.compile'd callable
+            inputs: Positional inputs; the first one's shape keys the graph
+            **kwargs: Keyword inputs
+
+        Returns:
+            The callable's output
+        """
+        key = (name, tuple(inputs[0].shape))
+        if key in self.compiled_shapes:
+            return compiled(*inputs, **kwargs)
+
+        if self._precompiled:
+            self.recompiles += 1
+            print(f"Warning: compiling {name} for shape {key[1]}, which precompile() didn't cover")
+        with metrics.stage("compile", model=name, shape="x".join(map(str, key[1]))) as record:
+            output = compiled(*inputs, **kwargs)
+        self.compiled_shapes.add(key)
+        self.save()
+        took = f" in {record['wall_ms'] / 1000:.1f}s" if record else ""
+        print(f"Compiled {name} for shape {key[1]}{took}")
+        return output
+
+    def snap_resolution(self, width: int, height: int) -> Tuple[int, int]:
+        """Return the bucket resolution to generate a width x height request at."""
+        return snap_resolution(width, height, self.resolutions)
+
+    def precompile(
+        self,
+        resolutions: Optional[Iterable[Tuple[int, int]]] = None,
+        unet_batch_sizes: Optional[Iterable[int]] = None,
+        decoder_batch_sizes: Optional[Iterable[int]] = None
+    ):
+        """
+        Compile every requested bucket now with dummy inputs.
+
+        Args:
+            resolutions: (width, height) buckets to compile (default: all)
+            unet_batch_sizes: UNet batch buckets to compile (default: all)
+            decoder_batch_sizes: Decoder batch buckets to compile (default: all)
+        """
+        resolutions = [snap_resolution(w, h, self.resolutions) for w, h in (resolutions or self.resolutions)]
+        unet_batch_sizes = sorted({snap_batch(b, self.batch_sizes) for b in (unet_batch_sizes or self.batch_sizes)})
+        decoder_batch_sizes = sorted({snap_batch(b, self.batch_sizes) for b in (decoder_batch_sizes or self.batch_sizes)})
+        options = dict(device=self.device, dtype=self.unet.dtype)
+
+        with torch.no_grad(), metrics.stage("precompile") as record:
+            for width, height in dict.fromkeys(resolutions):
+                size = (height // self.vae_scale_factor, width // self.vae_scale_factor)
+                for batch in unet_batch_sizes:
+                    latents = torch.zeros(batch, self.unet.config.in_channels, *size, **options)
+                    embeds = torch.zeros(batch, *self.cross_attention_shape, **options)
+                    # Scheduler timesteps are 0-d int64 tensors
+                    self.unet(latents, torch.tensor(999, device=self.device), encoder_hidden_states=embeds)
+                for batch in decoder_batch_sizes:
+                    self.vae.decode(torch.zeros(batch, self.vae.config.latent_channels, *size, **options))
+        self._precompiled = True
+        took = f" in {record['wall_ms'] / 1000:.1f}s" if record else ""
+        print(f"Precompiled {len(self.compiled_shapes)} shape bucket(s){took}")
+
+    def stats(self) -> dict:
+        """
+        Get compile statistics.
+
+        Returns:
+            Dictionary with compiled_shapes, recompiles (graphs compiled after
+            precompile()) and dynamo_graphs (all graphs Dynamo compiled in this process)
+        """
+        from torch._dynamo.utils import counters
+
+        return {
+            "compiled_shapes": len(self.compiled_shapes),
+            "recompiles": self.recompiles,
+            "dynamo_graphs": counters["stats"]["unique_graphs"],
+        }
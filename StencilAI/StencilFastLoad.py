@@ -0,0 +1,260 @@
+"""
+StencilFastLoad - Pre-fused single-file pipeline artifacts for fast model loading
+
+A normal from_pretrained load reads several weight files, and without care
+materializes fp32 weights in host RAM before casting them. A fused artifact
+stores every component's weights already in the target dtype in a single
+safetensors file, next to the small config/tokenizer/scheduler files.
+Loading builds the modules with empty (meta) weights and assigns tensors
+straight from the memory-mapped file onto the target device, so no
+intermediate fp32 or host copy of the weights is made. Loading needs
+torch >= 2.1 (load_state_dict(assign=True)) and accelerate.
+
+Artifacts of local checkpoints are keyed by the sizes and modification
+times of the checkpoint's files, so retraining into the same directory
+builds a new artifact instead of loading stale weights. ModelPool stores
+the components all checkpoints share (tokenizer, text encoder, VAE,
+scheduler) in one artifact and only the UNet in each checkpoint's.
+
+Layout of an artifact directory:
+    fused.json              manifest: source, dtype, components, scheduler class
+    weights.safetensors     "<component>.<param>" -> tensor, in the target dtype
+    text_encoder/, vae/, unet/   model configs
+    tokenizer/, scheduler/       tokenizer files and scheduler config
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+from typing import Dict, Iterable, Optional
+
+from StencilStartup import lazy_import
+
+torch = lazy_import("torch")
+
+MANIFEST = "fused.json"
+WEIGHTS = "weights.safetensors"
+MODEL_COMPONENTS = ("text_encoder", "vae", "unet")
+
+
+def _model_class(name: str):
+    """Return the model class stored under a component name."""
+    if name == "text_encoder":
+        from transformers import CLIPTextModel
+        return CLIPTextModel
+    if name == "vae":
+        from diffusers import AutoencoderKL
+        return AutoencoderKL
+    if name == "unet":
+        from diffusers import UNet2DConditionModel
+        return UNet2DConditionModel
+    raise ValueError(f"Unknown model component: {name}")
+
+
+def source_fingerprint(source: str) -> Optional[str]:
+    """
+    Hash the relative paths, sizes and modification times of a local model's files.
+
+    Args:
+        source: Checkpoint directory or HuggingFace model ID
+
+    Returns:
+        Short hex digest, or None if source isn't a local path
+    """
+    if not os.path.exists(source):
+        return None
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, source)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def fused_artifact_dir(root: str, source: str, dtype, suffix: str = "") -> str:
+    """
+    Get the artifact directory for a model source and dtype.
+
+    Args:
+        root: Directory holding all fused artifacts
+        source: Checkpoint path or HuggingFace model ID the artifact was built from
+        dtype: torch dtype of the stored weights
+        suffix: Distinguishes artifacts holding different parts of the same source
+
+    Returns:
+        Path of the artifact directory (which may not exist yet); local sources
+        get a new one whenever their files change (see source_fingerprint())
+    """
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "--", source.strip("./"))
+    fingerprint = source_fingerprint(source)
+    if fingerprint is not None:
+        name = f"{name}-{fingerprint}"
+    return os.path.join(root, f"{name}{suffix}-{str(dtype).replace('torch.', '')}")
+
+
+def has_fused_artifact(path: Optional[str]) -> bool:
+    """Return True if a complete fused artifact exists at path."""
+    return path is not None and os.path.exists(os.path.join(path, MANIFEST))
+
+
+def save_fused_artifact(path: str, source: str = "", tokenizer=None, scheduler=None, **models):
+    """
+    Write components as a fused artifact, atomically.
+
+    Args:
+        path: Artifact directory to create
+        source: Checkpoint path or model ID, recorded in the manifest
+        tokenizer: CLIP tokenizer to include
+        scheduler: Scheduler whose config to include
+        **models: Model components by name (text_encoder, vae, unet)
+    """
+    from safetensors.torch import save_file
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    tensors = {}
+    seen = set()
+    dtype = None
+    for name, model in models.items():
+        component_dir = os.path.join(tmp_path, name)
+        if hasattr(model, "save_config"):
+            model.save_config(component_dir)  # diffusers models
+        else:
+            model.config.save_pretrained(component_dir)  # transformers models
+
+        for key, tensor in model.state_dict().items():
+            tensor = tensor.detach().to("cpu").contiguous()
+            # safetensors refuses tensors that share storage
+            if tensor.data_ptr() in seen:
+                tensor = tensor.clone()
+            seen.add(tensor.data_ptr())
+            tensors[f"{name}.{key}"] = tensor
+        dtype = dtype or model.dtype
+
+    save_file(tensors, os.path.join(tmp_path, WEIGHTS))
+
+    if tokenizer is not None:
+        tokenizer.save_pretrained(os.path.join(tmp_path, "tokenizer"))
+    if scheduler is not None:
+        scheduler.save_config(os.path.join(tmp_path, "scheduler"))
+
+    manifest = {
+        "source": source,
+        "dtype": str(dtype).replace("torch.", ""),
+        "models": list(models),
+        "tokenizer": tokenizer is not None,
+        "scheduler": scheduler.__class__.__name__ if scheduler is not None else None,
+    }
+    with open(os.path.join(tmp_path, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    print(f"Saved fused fast-load artifact to {path}")
+
+
+def save_fused_pipeline(pipe, path: str, source: str = ""):
+    """
+    Write a Stable Diffusion pipeline's components as one fused artifact.
+
+    Args:
+        pipe: StableDiffusionPipeline to save
+        path: Artifact directory to create
+        source: Checkpoint path or model ID, recorded in the manifest
+    """
+    save_fused_artifact(
+        path,
+        source=source,
+        tokenizer=pipe.tokenizer,
+        scheduler=pipe.scheduler,
+        text_encoder=pipe.text_encoder,
+        vae=pipe.vae,
+        unet=pipe.unet,
+    )
+
+
+def load_fused_artifact(path: str, device: str = "cpu", components: Optional[Iterable[str]] = None) -> Dict[str, object]:
+    """
+    Load components from a fused artifact straight onto a device.
+
+    Args:
+        path: Artifact directory
+        device: Device to materialize weights on ('cuda', 'cpu', ...)
+        components: Names to load (default: everything in the artifact),
+                    from text_encoder, vae, unet, tokenizer and scheduler
+
+    Returns:
+        Dictionary mapping component name to the loaded component
+    """
+    from accelerate import init_empty_weights
+    from safetensors import safe_open
+
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+
+    available = list(manifest["models"])
+    if manifest.get("tokenizer"):
+        available.append("tokenizer")
+    if manifest.get("scheduler"):
+        available.append("scheduler")
+    wanted = list(components) if components is not None else available
+    missing = [name for name in wanted if name not in available]
+    if missing:
+        raise KeyError(f"Fused artifact {path} has no {', '.join(missing)}")
+
+    loaded = {}
+    models = [name for name in wanted if name in MODEL_COMPONENTS]
+    if models:
+        with safe_open(os.path.join(path, WEIGHTS), framework="pt", device=str(device)) as weights:
+            keys = list(weights.keys())
+            for name in models:
+                model_class = _model_class(name)
+                component_dir = os.path.join(path, name)
+                with init_empty_weights():
+                    if hasattr(model_class, "load_config"):
+                        model = model_class.from_config(model_class.load_config(component_dir))
+                    else:
+                        model = model_class(model_class.config_class.from_pretrained(component_dir))
+
+                prefix = f"{name}."
+                state = {key[len(prefix):]: weights.get_tensor(key) for key in keys if key.startswith(prefix)}
+                model.load_state_dict(state, strict=True, assign=True)
+                # Non-persistent buffers were created normally and still need moving
+                loaded[name] = model.to(device).eval()
+
+    if "tokenizer" in wanted:
+        from transformers import CLIPTokenizer
+        loaded["tokenizer"] = CLIPTokenizer.from_pretrained(os.path.join(path, "tokenizer"))
+    if "scheduler" in wanted:
+        import diffusers
+        scheduler_class = getattr(diffusers, manifest["scheduler"])
+        loaded["scheduler"] = scheduler_class.from_pretrained(os.path.join(path, "scheduler"))
+    return loaded
+
+
+def load_fused_pipeline(path: str, device: str = "cpu"):
+    """
+    Load a whole Stable Diffusion pipeline from a fused artifact.
+
+    Args:
+        path: Artifact directory
+        device: Device to materialize weights on
+
+    Returns:
+        StableDiffusionPipeline without safety checker
+    """
+    from diffusers import StableDiffusionPipeline
+
+    components = load_fused_artifact(path, device=device)
+    return StableDiffusionPipeline(
+        **components,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
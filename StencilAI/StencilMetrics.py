@@ -0,0 +1,369 @@
+"""
+StencilMetrics - Per-stage latency and memory instrumentation
+
+Records wall time and memory for each stage of a generation request (model
+load, tokenization, text encoding, every UNet step, VAE decode, cleaning,
+CV outlining, PNG encoding, ...). Every stage feeds an in-process latency
+histogram, and can optionally be appended to a JSONL trace file for offline
+aggregation (set STENCIL_TRACE_PATH or call metrics.set_trace_path()).
+
+Stages are attributed to the request(s) they serve through a context
+variable, so work done in executor or batcher threads still carries the ids
+of the requests that caused it.
+
+Usage:
+    from StencilMetrics import metrics
+
+    with metrics.request("generate", model="Checkpoint-1000"):
+        with metrics.stage("vae_decode"):
+            ...
+
+    print(metrics.summary())
+"""
+
+import contextvars
+import functools
+import itertools
+import json
+import math
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+
+_request_ids: contextvars.ContextVar = contextvars.ContextVar("stencil_request_ids", default=())
+
+
+def current_rss_mb() -> float:
+    """Return the current resident set size of this process in MB (0 if unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def peak_rss_mb() -> float:
+    """Return the peak resident set size of this process in MB (since start or the last _reset_peak_rss())."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _reset_peak_rss() -> bool:
+    """
+    Reset the peak RSS high-water mark to the current RSS (Linux only).
+
+    Returns:
+        True if the reset worked, False if the peak can't be reset on this platform
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _cuda():
+    """Return the torch.cuda module if torch is already loaded and CUDA is in use, else None."""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return None
+    return torch.cuda
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram in milliseconds.
+
+    Buckets grow geometrically (about 12% per bucket) from 0.01 ms to ~30
+    minutes, so percentiles are accurate to roughly one bucket width.
+    """
+
+    GROWTH = 1.12
+    MIN_MS = 0.01
+    NUM_BUCKETS = 220
+
+    def __init__(self):
+        self.counts = [0] * self.NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _bucket(self, value_ms: float) -> int:
+        if value_ms <= self.MIN_MS:
+            return 0
+        index = int(math.log(value_ms / self.MIN_MS, self.GROWTH)) + 1
+        return min(index, self.NUM_BUCKETS - 1)
+
+    def _upper_bound(self, index: int) -> float:
+        return self.MIN_MS * self.GROWTH ** index
+
+    def add(self, value_ms: float):
+        """Record one observation."""
+        self.counts[self._bucket(value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        self.min = min(self.min, value_ms)
+        self.max = max(self.max, value_ms)
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimate a percentile from the buckets.
+
+        Args:
+            q: Percentile in [0, 100]
+
+        Returns:
+            Upper bound of the bucket containing the percentile, clamped to the observed range
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return min(max(self._upper_bound(index), self.min), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """Return count, mean, min, max and p50/p90/p99 in milliseconds."""
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count,
+            "min_ms": self.min,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max,
+        }
+
+
+class Instrumentation:
+    """
+    Collects per-stage timings and memory into histograms and an optional JSONL trace.
+
+    Each stage record holds wall time, RSS before/after, the process peak RSS
+    and, when CUDA is in use, the CUDA memory allocated at the start of the
+    stage and the peak allocated since its request started. The CUDA peak is
+    device-wide and only reset when a top-level request starts (resetting it
+    per stage would clobber the peaks of enclosing and concurrent stages), so
+    overlapping requests share it.
+    """
+
+    def __init__(self, trace_path: Optional[str] = None, enabled: bool = True, cuda_sync: Optional[bool] = None):
+        """
+        Initialize the instrumentation.
+
+        Args:
+            trace_path: JSONL file to append stage and request records to (None for no trace)
+            enabled: Whether to record anything at all
+            cuda_sync: Synchronize CUDA at the end of each stage so wall times include queued
+                       kernels (None: only while writing a trace, as a sync per UNet step costs
+                       throughput)
+        """
+        self.enabled = enabled
+        self.cuda_sync = cuda_sync
+        self._histograms: Dict[str, Histogram] = {}
+        self._peak_rss: Dict[str, float] = {}
+        self._peak_cuda: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._trace_file = None
+        self._ids = itertools.count(1)
+        self.set_trace_path(trace_path)
+
+    def set_trace_path(self, trace_path: Optional[str]):
+        """
+        Start (or stop, with None) appending records to a JSONL trace file.
+
+        Args:
+            trace_path: Path of the JSONL file
+        """
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+            if trace_path:
+                os.makedirs(os.path.dirname(trace_path) or ".", exist_ok=True)
+                self._trace_file = open(trace_path, "a", buffering=1)
+
+    def current_request_ids(self) -> Tuple[int, ...]:
+        """Return the ids of the requests the current code is working for."""
+        return _request_ids.get()
+
+    @contextmanager
+    def bind(self, request_ids: Iterable[int]):
+        """
+        Attribute stages inside this block to the given requests.
+
+        Used where work for several requests runs together, e.g. a batch.
+
+        Args:
+            request_ids: Request ids to attribute stages to
+        """
+        token = _request_ids.set(tuple(request_ids))
+        try:
+            yield
+        finally:
+            try:
+                _request_ids.reset(token)
+            except ValueError:
+                # Exited from a different context (e.g. an async generator resumed elsewhere)
+                pass
+
+    @contextmanager
+    def request(self, name: str, **attrs):
+        """
+        Time a whole request and attribute the stages inside it to a new request id.
+
+        Args:
+            name: Request type, e.g. "generate_stencil"
+            **attrs: Extra JSON-serializable fields for the trace record
+
+        Yields:
+            The new request id
+        """
+        request_id = next(self._ids)
+        cuda = _cuda() if self.enabled else None
+        if cuda is not None and not self.current_request_ids():
+            cuda.reset_peak_memory_stats()
+        with self.bind(self.current_request_ids() + (request_id,)):
+            with self.stage(f"request:{name}", **attrs):
+                yield request_id
+
+    @contextmanager
+    def stage(self, name: str, reset_peak_rss: bool = False, **attrs):
+        """
+        Time one stage and record its memory use.
+
+        Args:
+            name: Stage name, e.g. "unet_step" or "vae_decode"
+            reset_peak_rss: Reset the process RSS high-water mark first, so peak_rss_mb
+                            is the peak during this stage (outer stages lose their earlier peak)
+            **attrs: Extra JSON-serializable fields for the trace record
+
+        Yields:
+            The stage record, filled in when the stage ends
+        """
+        record = {}
+        if not self.enabled:
+            yield record
+            return
+
+        cuda = _cuda()
+        cuda_before = cuda.memory_allocated() if cuda is not None else 0
+        if reset_peak_rss:
+            _reset_peak_rss()
+
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield record
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            cuda_sync = self.cuda_sync if self.cuda_sync is not None else self._trace_file is not None
+            if cuda is not None and cuda_sync:
+                cuda.synchronize()
+            wall_ms = (time.perf_counter() - start) * 1000
+
+            record.update({
+                "ts": time.time(),
+                "stage": name,
+                "wall_ms": round(wall_ms, 3),
+                "rss_before_mb": round(rss_before, 1),
+                "rss_after_mb": round(current_rss_mb(), 1),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+                "request_ids": list(self.current_request_ids()),
+                "thread": threading.current_thread().name,
+            })
+            if cuda is not None:
+                record["cuda_before_mb"] = round(cuda_before / 1024 ** 2, 1)
+                record["cuda_peak_mb"] = round(cuda.max_memory_allocated() / 1024 ** 2, 1)
+            if error is not None:
+                record["error"] = error
+            record.update(attrs)
+            self._record(record)
+
+    def timed(self, name: str):
+        """
+        Decorator recording every call of a function as a stage.
+
+        Args:
+            name: Stage name
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _record(self, record: dict):
+        """Add a stage record to the histograms and the trace."""
+        name = record["stage"]
+        with self._lock:
+            self._histograms.setdefault(name, Histogram()).add(record["wall_ms"])
+            self._peak_rss[name] = max(self._peak_rss.get(name, 0.0), record["peak_rss_mb"])
+            if "cuda_peak_mb" in record:
+                self._peak_cuda[name] = max(self._peak_cuda.get(name, 0.0), record["cuda_peak_mb"])
+            if self._trace_file is not None:
+                self._trace_file.write(json.dumps(record, default=str) + "\n")
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Get latency and memory statistics for every stage seen so far.
+
+        Returns:
+            Dictionary mapping stage name to histogram summary plus peak memory
+        """
+        with self._lock:
+            result = {}
+            for name, histogram in sorted(self._histograms.items()):
+                stats = histogram.summary()
+                stats["peak_rss_mb"] = self._peak_rss.get(name, 0.0)
+                if name in self._peak_cuda:
+                    stats["cuda_peak_mb"] = self._peak_cuda[name]
+                result[name] = stats
+            return result
+
+    def reset(self):
+        """Clear all histograms (the trace file is left as is)."""
+        with self._lock:
+            self._histograms.clear()
+            self._peak_rss.clear()
+            self._peak_cuda.clear()
+
+    def format_summary(self) -> str:
+        """Return the summary as a fixed-width text table."""
+        lines = [f"{'stage':<28}{'count':>7}{'mean ms':>11}{'p50 ms':>11}{'p90 ms':>11}{'max ms':>11}{'peak RSS MB':>13}"]
+        for name, stats in self.summary().items():
+            lines.append(
+                f"{name:<28}{stats['count']:>7}{stats['mean_ms']:>11.1f}{stats['p50_ms']:>11.1f}"
+                f"{stats['p90_ms']:>11.1f}{stats['max_ms']:>11.1f}{stats['peak_rss_mb']:>13.0f}"
+            )
+        return "\n".join(lines)
+
+
+# Shared instance used by Stencil.py, StencilCV.py and app.py
+metrics = Instrumentation(trace_path=os.environ.get("STENCIL_TRACE_PATH"))
@@ -0,0 +1,367 @@
+"""
+StencilPipeline - Overlapped denoising and post-processing for bulk generation
+
+Generating a catalogue one batch at a time runs denoise, VAE decode,
+cleaning, outlining and PNG encoding strictly in sequence, so the
+accelerator idles during post-processing and the CPU cores idle during
+denoising. The StencilPipeline splits that into a producer and consumers:
+
+    producer thread     StencilGenerator.iter_packed_batches: denoise + VAE decode
+          |             bounded queue (backpressure: denoising pauses when full)
+    process pool        clean_stencil_batch, StencilCV.edge_stencil, PNG encode (and write)
+
+While the pool post-processes one decoded batch, the next one is already
+denoising. Results come back in request order, and each run reports its
+end-to-end throughput in images per second.
+
+Usage:
+    pipeline = StencilPipeline(generator, outline=True, output_dir="output_stencils")
+    for result in pipeline.run([("a cat", 1, 3), ("a tree", 2, 3)]):
+        print(result.index, result.paths)
+    print(pipeline.last_stats)
+"""
+
+import contextvars
+import io
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional
+
+import numpy as np
+from PIL import Image
+
+from Stencil import GenerationRequest, StencilGenerator, _as_generation_request, _rgb_to_gray, clean_stencil_batch
+from StencilMetrics import metrics
+from StencilStartup import lazy_import
+
+cv2 = lazy_import("cv2")
+
+_DONE = object()
+
+
+class PipelineResult(NamedTuple):
+    """The finished images for one request, as yielded by StencilPipeline.run."""
+
+    index: int
+    request: GenerationRequest
+    images: List[bytes]  # PNG-encoded stencils
+    outlines: Optional[List[bytes]]  # PNG-encoded outlines, None if outlining is off
+    paths: Optional[List[str]]  # Where the stencils were written, None without an output_dir
+
+
+def _init_worker():
+    """Keep each pool worker to one OpenCV thread; the pool itself provides the parallelism."""
+    cv2.setNumThreads(1)
+
+
+def _encode_png(image: Image.Image) -> bytes:
+    """Encode a PIL image as PNG bytes."""
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def postprocess_batch(
+    pixels: np.ndarray,
+    clean_background: List[bool],
+    outline: bool = True,
+    paths: Optional[List[str]] = None,
+    outline_paths: Optional[List[str]] = None
+) -> List[tuple]:
+    """
+    Clean, outline and PNG-encode a decoded batch (runs in a pool worker).
+
+    Args:
+        pixels: uint8 array of shape (B, H, W, 3) from the VAE decode
+        clean_background: Per-row flag for binary stencil cleaning
+        outline: Whether to also make an edge_stencil outline of each image
+        paths: Optional file paths to write the stencils to
+        outline_paths: Optional file paths to write the outlines to
+
+    Returns:
+        One (stencil PNG bytes, outline PNG bytes or None) tuple per row
+    """
+    from StencilCV import StencilCV
+
+    images = [None] * len(pixels)
+    clean_rows = [i for i, clean in enumerate(clean_background) if clean]
+    if clean_rows:
+        for i, stencil in zip(clean_rows, clean_stencil_batch(_rgb_to_gray(pixels[clean_rows]))):
+            images[i] = stencil
+    for i, clean in enumerate(clean_background):
+        if not clean:
+            images[i] = pixels[i]
+
+    processor = StencilCV()
+    encoded = []
+    for i, array in enumerate(images):
+        stencil_png = _encode_png(Image.fromarray(array))
+        outline_png = None
+        if outline:
+            bgr = cv2.cvtColor(array, cv2.COLOR_GRAY2BGR if array.ndim == 2 else cv2.COLOR_RGB2BGR)
+            outline_png = _encode_png(processor.edge_stencil(bgr))
+
+        for data, targets in ((stencil_png, paths), (outline_png, outline_paths)):
+            if data is not None and targets:
+                os.makedirs(os.path.dirname(targets[i]) or ".", exist_ok=True)
+                with open(targets[i], "wb") as f:
+                    f.write(data)
+        encoded.append((stencil_png, outline_png))
+    return encoded
+
+
+class StencilPipeline:
+    """
+    Runs bulk generation as a producer/consumer pipeline.
+
+    A producer thread denoises and decodes packed batches into a bounded
+    queue; a process pool cleans, outlines and encodes them while the next
+    batch denoises. With workers=0 everything runs sequentially in the
+    calling thread instead, which is useful as a baseline.
+    """
+
+    # Decoded batches handed to the pool at once; more wait in the bounded queue
+    IN_FLIGHT_BATCHES = 2
+
+    def __init__(
+        self,
+        generator: StencilGenerator,
+        workers: Optional[int] = None,
+        queue_size: int = 2,
+        outline: bool = True,
+        output_dir: Optional[str] = None,
+        outline_dir: Optional[str] = None,
+        max_batch_images: Optional[int] = None
+    ):
+        """
+        Initialize the pipeline.
+
+        Args:
+            generator: StencilGenerator that does the denoising and decoding
+            workers: Post-processing processes (None for one per spare CPU core, 0 for sequential)
+            queue_size: Decoded batches allowed to wait for the pool before denoising pauses
+            outline: Whether to also make an edge_stencil outline of each image
+            output_dir: Directory to write stencils to (None to only return PNG bytes)
+            outline_dir: Directory to write outlines to (defaults to output_dir)
+            max_batch_images: Images per UNet batch (None to estimate from free memory)
+        """
+        self.generator = generator
+        self.workers = max(1, (os.cpu_count() or 2) - 1) if workers is None else workers
+        self.queue_size = queue_size
+        self.outline = outline
+        self.output_dir = output_dir
+        self.outline_dir = outline_dir or output_dir
+        self.max_batch_images = max_batch_images
+        self.last_stats = None
+        self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Return the post-processing pool, starting it on first use."""
+        if self._pool is None:
+            # Spawn rather than fork: forking a process that is running torch threads can deadlock
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return self._pool
+
+    def close(self):
+        """Shut down the post-processing pool."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _file_name(self, index: int, request: GenerationRequest, image_index: int) -> str:
+        """Return the stencil file name for one image, as generate_and_save() names it."""
+        name = f"stencil_{index + 1}_{request.prompt.replace(' ', '_')[:20]}"
+        return f"{name}_{image_index + 1}.png" if request.num_images > 1 else f"{name}.png"
+
+    def _outline_name(self, index: int, request: GenerationRequest, image_index: int) -> str:
+        """Return the outline file name for one image, following the test_StencilCV.py naming."""
+        return f"outline_stencil_{index + 1}_{request.prompt.replace(' ', '_')[:20]}_{image_index}.png"
+
+    def _job_args(self, chunk: list) -> tuple:
+        """Build the postprocess_batch arguments (after pixels) for rows of a batch."""
+        clean_background = [request.clean_background for _, request, _ in chunk]
+        if not self.output_dir:
+            return clean_background, self.outline, None, None
+
+        paths = [os.path.join(self.output_dir, self._file_name(*row)) for row in chunk]
+        outline_paths = None
+        if self.outline:
+            outline_paths = [os.path.join(self.outline_dir, self._outline_name(*row)) for row in chunk]
+        return clean_background, self.outline, paths, outline_paths
+
+    def _produce(self, batches: Iterator, out: queue.Queue, stop: threading.Event):
+        """Producer thread: push decoded batches into the bounded queue until done or stopped."""
+        try:
+            for item in batches:
+                while not stop.is_set():
+                    try:
+                        out.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            out.put(_DONE)
+        except BaseException as e:
+            out.put(e)
+
+    def run(
+        self,
+        requests: list,
+        num_inference_steps: int = 25,
+        width: int = 512,
+        height: int = 512,
+        **options
+    ) -> Iterator[PipelineResult]:
+        """
+        Generate, clean, outline and encode many requests with overlapped stages.
+
+        Args:
+            requests: GenerationRequests, (prompt, seed, num_images) tuples or dicts,
+                      as for StencilGenerator.generate_many()
+            num_inference_steps: Number of denoising steps
+            width: Image width in pixels (must be divisible by 8)
+            height: Image height in pixels (must be divisible by 8)
+            **options: adaptive_steps / convergence_tolerance, as for generate_batch()
+
+        Yields:
+            PipelineResult per request, in request order
+        """
+        requests = [_as_generation_request(spec) for spec in requests]
+        start = time.perf_counter()
+        batches = self.generator.iter_packed_batches(
+            requests, num_inference_steps, width, height, self.max_batch_images, **options
+        )
+
+        encoded = [[] for _ in requests]
+        image_counts = [0] * len(requests)
+        stats = {"images": 0, "batches": 0}
+        next_index = 0
+
+        def add_batch(chunk, outputs):
+            """Store a post-processed batch and return the requests it completed, in order."""
+            nonlocal next_index
+            for (index, _, _), output in zip(chunk, outputs):
+                encoded[index].append(output)
+            stats["images"] += len(chunk)
+            stats["batches"] += 1
+
+            completed = []
+            while next_index < len(requests) and len(encoded[next_index]) == requests[next_index].num_images:
+                completed.append(self._result(next_index, requests[next_index], encoded[next_index]))
+                encoded[next_index] = None
+                next_index += 1
+            return completed
+
+        def label(chunk):
+            """Attach each row's index within its request to a packed batch."""
+            labelled = []
+            for index, unit in chunk:
+                labelled.append((index, requests[index], image_counts[index]))
+                image_counts[index] += 1
+            return labelled
+
+        if self.workers == 0:
+            for chunk, pixels in batches:
+                chunk = label(chunk)
+                with metrics.stage("pipeline_postprocess", images=len(chunk)):
+                    outputs = postprocess_batch(pixels, *self._job_args(chunk))
+                yield from add_batch(chunk, outputs)
+        else:
+            pool = self._get_pool()
+            decoded = queue.Queue(maxsize=self.queue_size)
+            stop = threading.Event()
+            # Carry the caller's context (request ids for metrics) into the producer thread
+            context = contextvars.copy_context()
+            producer = threading.Thread(
+                target=context.run,
+                args=(self._produce, batches, decoded, stop),
+                name="stencil-pipeline-producer",
+                daemon=True,
+            )
+            producer.start()
+
+            # Batches handed to the pool, oldest first; each is split across the workers
+            in_flight = deque()
+            try:
+                finished = False
+                while not finished or in_flight:
+                    while in_flight and all(future.done() for future in in_flight[0][1]):
+                        chunk, futures = in_flight.popleft()
+                        yield from add_batch(chunk, [output for future in futures for output in future.result()])
+
+                    if finished or len(in_flight) >= self.IN_FLIGHT_BATCHES:
+                        # Nothing more to submit until the oldest batch is done
+                        chunk, futures = in_flight.popleft()
+                        yield from add_batch(chunk, [output for future in futures for output in future.result()])
+                        continue
+
+                    try:
+                        item = decoded.get(timeout=0.05 if in_flight else None)
+                    except queue.Empty:
+                        continue
+                    if item is _DONE:
+                        finished = True
+                        continue
+                    if isinstance(item, BaseException):
+                        raise item
+
+                    chunk, pixels = item
+                    chunk = label(chunk)
+                    futures = []
+                    for rows in np.array_split(np.arange(len(chunk)), min(self.workers, len(chunk))):
+                        part = [chunk[row] for row in rows]
+                        futures.append(pool.submit(postprocess_batch, pixels[rows], *self._job_args(part)))
+                    in_flight.append((chunk, futures))
+            finally:
+                stop.set()
+                for _, futures in in_flight:
+                    for future in futures:
+                        future.cancel()
+                # Unblock the producer if it is waiting on a full queue
+                while producer.is_alive():
+                    try:
+                        decoded.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+        while next_index < len(requests):
+            yield self._result(next_index, requests[next_index], encoded[next_index])
+            next_index += 1
+
+        seconds = time.perf_counter() - start
+        stats.update(
+            seconds=seconds,
+            images_per_second=stats["images"] / seconds if seconds > 0 else 0.0,
+            workers=self.workers,
+        )
+        self.last_stats = stats
+        print(f"Pipeline: {stats['images']} image(s) in {seconds:.1f}s ({stats['images_per_second']:.2f} images/s)")
+
+    def _result(self, index: int, request: GenerationRequest, outputs: list) -> PipelineResult:
+        """Assemble the PipelineResult for one completed request."""
+        paths = None
+        if self.output_dir:
+            paths = [os.path.join(self.output_dir, self._file_name(index, request, i)) for i in range(len(outputs))]
+        return PipelineResult(
+            index=index,
+            request=request,
+            images=[stencil for stencil, _ in outputs],
+            outlines=[outline for _, outline in outputs] if self.outline else None,
+            paths=paths,
+        )
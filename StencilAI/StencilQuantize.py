@@ -0,0 +1,108 @@
+"""
+StencilQuantize - Int8 and bf16 precision modes for CPU inference
+
+On CPU the generator runs in fp32, since fp16 kernels are slow or missing
+there. This module provides the cheaper alternatives:
+
+    bf16        bf16 autocast (needs AVX512-BF16 or AMX; falls back to fp32)
+    int8        dynamic int8 quantization of every nn.Linear in the text encoder
+                and UNet (attention projections and feed-forwards): int8 weights,
+                activations quantized on the fly, fp32 elsewhere
+    int8-bf16   weight-only int8 Linears, dequantized into bf16 under autocast
+
+Convolutions, norms and the VAE are left alone; the binary stencil
+thresholding downstream absorbs the small numerical drift.
+
+This module subclasses torch.nn.Module at import time, so Stencil imports
+it only when a non-fp32 precision is selected.
+"""
+
+import warnings
+from typing import Tuple
+
+import torch
+
+CPU_PRECISIONS = ("fp32", "bf16", "int8", "int8-bf16")
+# quantize_linear_layers mode used by each quantized precision
+QUANTIZATION_MODES = {"int8": "dynamic", "int8-bf16": "weight"}
+
+
+def cpu_supports_bf16() -> bool:
+    """Return True if oneDNN has native bf16 kernels on this CPU."""
+    try:
+        return bool(torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class Int8WeightLinear(torch.nn.Module):
+    """
+    Linear layer with int8 weights and per-output-channel scales.
+
+    Weights take a quarter of the fp32 memory and are dequantized on each
+    call into the compute dtype (bf16 under CPU autocast), so the matmul
+    itself runs in that dtype.
+    """
+
+    def __init__(self, linear: torch.nn.Linear):
+        """
+        Quantize an existing Linear layer.
+
+        Args:
+            linear: Layer to take the weights and bias from
+        """
+        super().__init__()
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+
+        weight = linear.weight.detach().float()
+        scale = weight.abs().amax(dim=1, keepdim=True).clamp(min=1e-8) / 127
+        self.register_buffer("weight_int8", torch.round(weight / scale).clamp(-127, 127).to(torch.int8))
+        self.register_buffer("scale", scale)
+        self.register_buffer("bias", None if linear.bias is None else linear.bias.detach().float())
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        dtype = torch.get_autocast_dtype("cpu") if torch.is_autocast_enabled("cpu") else x.dtype
+        weight = self.weight_int8.to(dtype) * self.scale.to(dtype)
+        bias = None if self.bias is None else self.bias.to(dtype)
+        return torch.nn.functional.linear(x.to(dtype), weight, bias)
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}"
+
+
+def _replace_linears(module: torch.nn.Module) -> int:
+    """Swap every nn.Linear below module for an Int8WeightLinear, returning how many were swapped."""
+    count = 0
+    for name, child in module.named_children():
+        if type(child) is torch.nn.Linear:
+            setattr(module, name, Int8WeightLinear(child))
+            count += 1
+        else:
+            count += _replace_linears(child)
+    return count
+
+
+def quantize_linear_layers(module: torch.nn.Module, mode: str = "dynamic") -> Tuple[torch.nn.Module, int]:
+    """
+    Quantize the Linear layers of a CPU module to int8, in place.
+
+    Args:
+        module: Model to quantize (text encoder or UNet)
+        mode: "dynamic" for torch's dynamic int8 Linear (int8 matmuls, fp32
+              activations) or "weight" for weight-only Int8WeightLinear layers
+
+    Returns:
+        Tuple of (quantized module, number of Linear layers quantized)
+    """
+    if mode == "weight":
+        return module, _replace_linears(module)
+    if mode != "dynamic":
+        raise ValueError(f"Unknown quantization mode '{mode}', expected 'dynamic' or 'weight'")
+
+    count = sum(1 for child in module.modules() if type(child) is torch.nn.Linear)
+    with warnings.catch_warnings():
+        # torch.ao.quantization is deprecated in favour of torchao, which isn't a dependency
+        warnings.simplefilter("ignore")
+        module = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return module, count
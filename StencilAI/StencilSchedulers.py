@@ -0,0 +1,277 @@
+"""
+StencilSchedulers - Scheduler registry and per-model step-count profiles
+
+Schedulers differ a lot in how many steps they need before the binarized
+stencil stops changing: the multistep solvers (DPM-Solver++, UniPC) settle
+in far fewer steps than PNDM or the Euler samplers. Since the output is
+thresholded to black and white, "good enough" is measurable: the profiling
+command generates seeded stencils at increasing step counts and compares
+each with the same scheduler's output at a high reference step count (IoU
+of the black pixels). The smallest step count from which the mean IoU stays
+above a threshold is stored as the recommended step count for that model
+and scheduler, which StencilGenerator uses for the "fast" quality preset.
+
+Usage:
+    python StencilSchedulers.py --model Manojb/stable-diffusion-2-1-base
+    python StencilSchedulers.py --checkpoint ./Fine-tuning/checkpoint-1000 \\
+        --schedulers dpm++ unipc pndm --steps 6 8 10 15 20 25
+"""
+
+import argparse
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# name -> (diffusers scheduler class, config overrides). Schedulers are always
+# built from the model's original scheduler config, so overrides never leak
+# from one choice into the next. Ancestral (stochastic) samplers only
+# reproduce a seed in single-request batches.
+SCHEDULERS = {
+    "dpm++": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++", "use_karras_sigmas": False}),
+    "dpm++-karras": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++", "use_karras_sigmas": True}),
+    "unipc": ("UniPCMultistepScheduler", {}),
+    "euler": ("EulerDiscreteScheduler", {}),
+    "euler-a": ("EulerAncestralDiscreteScheduler", {}),
+    "ddim": ("DDIMScheduler", {"clip_sample": False}),  # Latents must never be clipped to [-1, 1]
+    "pndm": ("PNDMScheduler", {}),
+}
+
+# Schedulers that can't start partway through a schedule, and what variations (which re-run only
+# the end of one) use instead: PNDM's PLMS warm-up runs its first timestep twice and keeps
+# counter-based multistep history, so a sliced schedule skips a step
+PARTIAL_SCHEDULE_FALLBACK = {"pndm": "dpm++"}
+
+# "fast" preset step counts for models and schedulers that haven't been profiled (never more
+# than the step count the caller asked for)
+DEFAULT_FAST_STEPS = {
+    "dpm++": 15,
+    "dpm++-karras": 12,
+    "unipc": 12,
+    "euler": 25,
+    "euler-a": 25,
+    "ddim": 25,
+    "pndm": 30,
+}
+
+DEFAULT_PROFILE_PATH = "scheduler_profiles.json"
+PROFILE_STEPS = (5, 8, 10, 12, 15, 20, 25, 30)
+PROFILE_PROMPTS = [
+    "a cat sitting",
+    "an eagle with spread wings",
+    "a rose with leaves",
+    "a lighthouse by the sea",
+]
+
+
+def make_scheduler(name: str, config):
+    """
+    Build a registered scheduler from a model's scheduler config.
+
+    Args:
+        name: Key of SCHEDULERS
+        config: Original scheduler config of the model
+
+    Returns:
+        New diffusers scheduler instance
+    """
+    import diffusers
+
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler '{name}', expected one of {tuple(SCHEDULERS)}")
+    class_name, overrides = SCHEDULERS[name]
+    return getattr(diffusers, class_name).from_config(config, **overrides)
+
+
+def _black_iou(reference: np.ndarray, masks: np.ndarray) -> np.ndarray:
+    """IoU of the black (subject) pixels per image; two empty stencils count as identical."""
+    reference, masks = reference < 128, masks < 128
+    axes = tuple(range(1, reference.ndim))
+    intersection = (reference & masks).sum(axis=axes)
+    union = (reference | masks).sum(axis=axes)
+    return np.where(union > 0, intersection / np.maximum(union, 1), 1.0)
+
+
+class SchedulerProfiles:
+    """
+    Recommended step counts per (model, scheduler), stored in a JSON file.
+
+    The file maps a model (checkpoint path or model ID, as passed to
+    StencilGenerator) to its profiled schedulers:
+
+        {"<model>": {"<scheduler>": {"recommended_steps": 10, "curve": {"5": 0.82, ...}, ...}}}
+    """
+
+    def __init__(self, path: str = DEFAULT_PROFILE_PATH):
+        """
+        Load the profiles file if it exists.
+
+        Args:
+            path: JSON file with the profiles
+        """
+        self.path = path
+        self.profiles = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.profiles = json.load(f)
+
+    def get(self, model: str, scheduler: str) -> Optional[dict]:
+        """Return the stored profile of a model and scheduler, if any."""
+        return self.profiles.get(model, {}).get(scheduler)
+
+    def recommended_steps(self, model: str, scheduler: str) -> Optional[int]:
+        """Return the profiled minimal step count of a model and scheduler, if any."""
+        profile = self.get(model, scheduler)
+        return profile["recommended_steps"] if profile else None
+
+    def update(self, model: str, scheduler: str, profile: dict):
+        """Store (or replace) the profile of a model and scheduler."""
+        self.profiles.setdefault(model, {})[scheduler] = profile
+
+    def save(self):
+        """Write the profiles file atomically."""
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(self.profiles, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def profile_scheduler(
+    generator,
+    scheduler: str,
+    steps: Iterable[int] = PROFILE_STEPS,
+    reference_steps: int = 50,
+    min_iou: float = 0.95,
+    resolution: int = 512,
+    prompts: Optional[List[str]] = None
+) -> dict:
+    """
+    Measure how quickly a scheduler's stencils settle and pick a minimal step count.
+
+    Args:
+        generator: Loaded StencilGenerator (its scheduler is switched to this one)
+        scheduler: Key of SCHEDULERS
+        steps: Step counts to measure
+        reference_steps: Step count whose stencils count as converged
+        min_iou: Mean black-pixel IoU against the reference the recommended count must keep
+        resolution: Image size in pixels
+        prompts: Prompts to generate (seeded by index; None for PROFILE_PROMPTS)
+
+    Returns:
+        Profile dict with the mean and min IoU per step count, the thresholds
+        and the recommended step count (reference_steps if none qualifies)
+    """
+    prompts = prompts or PROFILE_PROMPTS
+    generator.set_scheduler(scheduler)
+
+    def stencils(num_inference_steps: int) -> np.ndarray:
+        return np.stack([
+            np.array(generator.generate(
+                prompt,
+                seed=i,
+                num_inference_steps=num_inference_steps,
+                width=resolution,
+                height=resolution,
+            ).convert("L"))
+            for i, prompt in enumerate(prompts)
+        ])
+
+    # Measure fresh generations, never results cached by an earlier run
+    result_cache, generator.result_cache = generator.result_cache, None
+    try:
+        reference = stencils(reference_steps)
+        curve, curve_min = {}, {}
+        for num_inference_steps in sorted(set(steps)):
+            iou = _black_iou(reference, stencils(num_inference_steps))
+            curve[str(num_inference_steps)] = float(iou.mean())
+            curve_min[str(num_inference_steps)] = float(iou.min())
+            print(f"{scheduler}: {num_inference_steps} steps, mean IoU {iou.mean():.3f} (min {iou.min():.3f})")
+    finally:
+        generator.result_cache = result_cache
+
+    # The smallest step count from which every larger one also stays above min_iou
+    recommended = reference_steps
+    for num_inference_steps in sorted(curve, key=int, reverse=True):
+        if curve[num_inference_steps] < min_iou:
+            break
+        recommended = int(num_inference_steps)
+
+    return {
+        "recommended_steps": recommended,
+        "min_iou": min_iou,
+        "reference_steps": reference_steps,
+        "resolution": resolution,
+        "curve": curve,
+        "curve_min": curve_min,
+    }
+
+
+def profile_models(
+    sources: Dict[str, dict],
+    schedulers: Iterable[str],
+    profiles: SchedulerProfiles,
+    generator_class=None,
+    **options
+) -> SchedulerProfiles:
+    """
+    Profile every scheduler on every model and save the results.
+
+    Args:
+        sources: Model key -> StencilGenerator keyword arguments loading it
+        schedulers: Keys of SCHEDULERS to profile
+        profiles: Profiles to update; saved after each model
+        generator_class: StencilGenerator (sub)class to load the models with
+        **options: Extra profile_scheduler() arguments
+
+    Returns:
+        The updated profiles
+    """
+    if generator_class is None:
+        from Stencil import StencilGenerator
+        generator_class = StencilGenerator
+
+    for model, source in sources.items():
+        generator = generator_class(**source)
+        for scheduler in schedulers:
+            profile = profile_scheduler(generator, scheduler, **options)
+            profiles.update(model, scheduler, profile)
+            print(f"{model} / {scheduler}: recommended {profile['recommended_steps']} steps")
+        profiles.save()
+        del generator
+    return profiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile stencil stability vs steps per model and scheduler")
+    parser.add_argument("--model", default=None, help="HuggingFace model ID of a base model to profile")
+    parser.add_argument("--checkpoint", nargs="*", default=[], help="Fine-tuned checkpoints to profile")
+    parser.add_argument("--schedulers", nargs="+", default=list(SCHEDULERS), choices=list(SCHEDULERS))
+    parser.add_argument("--steps", nargs="+", type=int, default=list(PROFILE_STEPS), help="Step counts to measure")
+    parser.add_argument("--reference-steps", type=int, default=50, help="Step count treated as converged")
+    parser.add_argument("--min-iou", type=float, default=0.95, help="Mean black-pixel IoU the recommendation must keep")
+    parser.add_argument("--resolution", type=int, default=512, help="Image size in pixels")
+    parser.add_argument("--profiles", default=DEFAULT_PROFILE_PATH, help="Profiles JSON file to update")
+    args = parser.parse_args()
+
+    # Keyed the way StencilGenerator looks profiles up: checkpoint path, else model ID
+    sources = {args.model: dict(model_id=args.model)} if args.model else {}
+    for checkpoint in args.checkpoint:
+        sources[checkpoint] = dict(checkpoint_path=checkpoint)
+    if not sources:
+        parser.error("Give --model and/or --checkpoint")
+
+    profile_models(
+        sources,
+        args.schedulers,
+        SchedulerProfiles(args.profiles),
+        steps=args.steps,
+        reference_steps=args.reference_steps,
+        min_iou=args.min_iou,
+        resolution=args.resolution,
+    )
+    print(f"Profiles written to: {args.profiles}")
+
+
+if __name__ == "__main__":
+    main()
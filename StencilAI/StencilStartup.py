@@ -0,0 +1,155 @@
+"""
+StencilStartup - Lazy imports and import-cost profiling for fast cold starts
+
+torch, diffusers, transformers, scipy, OpenCV, gradio and spaCy each take
+from a fraction of a second to several seconds to import. lazy_import()
+returns a module object right away and only executes the real import on
+first attribute access, so modules can keep using `torch.zeros(...)` and
+friends while importing them stays cheap.
+
+Run this file to see what each module costs to import in a fresh interpreter:
+    python StencilStartup.py
+    python StencilStartup.py torch gradio app
+"""
+
+import importlib.util
+import os
+import re
+import subprocess
+import sys
+import threading
+from types import ModuleType
+from typing import Dict, List
+
+# Heavy third-party dependencies, then this repo's modules
+DEFAULT_MODULES = [
+    "torch",
+    "diffusers",
+    "transformers",
+    "scipy.ndimage",
+    "cv2",
+    "gradio",
+    "spacy",
+    "Stencil",
+    "StencilCV",
+    "app",
+    "PromptNLP",
+]
+
+# One lock per lazy module, held while its code runs. importlib's LazyLoader
+# only locks its first-access load from Python 3.12.3 (gh-114763); before
+# that, a request thread could see a module the warm-up thread was still
+# executing
+_load_locks: Dict[str, threading.RLock] = {}
+_loading = set()
+
+
+class _LazyModule(ModuleType):
+    """Module whose code runs on first attribute access, exactly once across threads."""
+
+    def __getattribute__(self, attr):
+        name = ModuleType.__getattribute__(self, "__name__")
+        with _load_locks[name]:
+            # Another thread may have loaded it while we waited; nested accesses
+            # from the module's own import (same thread) see it as it loads
+            if type(self) is _LazyModule and name not in _loading:
+                _loading.add(name)
+                try:
+                    ModuleType.__getattribute__(self, "__spec__").loader.exec_module(self)
+                    self.__class__ = ModuleType
+                finally:
+                    _loading.discard(name)
+        return ModuleType.__getattribute__(self, attr)
+
+    def __delattr__(self, attr):
+        # Load first, so the deletion isn't undone by the module's code
+        self.__getattribute__("__name__")
+        ModuleType.__delattr__(self, attr)
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Import a module lazily: it is only loaded when one of its attributes is first used.
+
+    If the module is already imported, it is returned as is. Concurrent first
+    accesses are safe: other threads wait until the module has fully loaded.
+
+    Args:
+        name: Fully qualified module name, e.g. "torch" or "scipy.ndimage"
+
+    Returns:
+        The (possibly not yet loaded) module
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'")
+    _load_locks.setdefault(name, threading.RLock())
+    module = importlib.util.module_from_spec(spec)
+    module.__class__ = _LazyModule
+    sys.modules[name] = module
+    return module
+
+
+def import_cost(module: str, python: str = sys.executable) -> Dict[str, float]:
+    """
+    Measure the cost of importing a module in a fresh interpreter.
+
+    Uses `python -X importtime`, so the numbers include everything the
+    module pulls in but nothing already loaded by this process.
+
+    Args:
+        module: Module name to import
+        python: Interpreter to run
+
+    Returns:
+        Dictionary with total_ms (the module's cumulative import time) and
+        self_ms (time in the module itself), or error if the import failed
+    """
+    search_path = [os.path.dirname(os.path.abspath(__file__)), os.path.join(os.path.dirname(os.path.abspath(__file__)), "PromptNLP")]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(search_path + [os.environ.get("PYTHONPATH", "")]))
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    if proc.returncode != 0:
+        last_line = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed"
+        return {"error": last_line}
+
+    # Lines look like "import time:       123 |       4567 |   torch"
+    pattern = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+    for line in proc.stderr.splitlines():
+        match = pattern.match(line)
+        if match and match.group(4) == module and len(match.group(3)) == 1:
+            return {"self_ms": int(match.group(1)) / 1000, "total_ms": int(match.group(2)) / 1000}
+    return {"total_ms": 0.0, "self_ms": 0.0}
+
+
+def profile_imports(modules: List[str] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Measure and print the import cost of each module, most expensive first.
+
+    Args:
+        modules: Module names (defaults to the heavy dependencies and this repo's modules)
+
+    Returns:
+        Dictionary mapping module name to its import_cost() result
+    """
+    results = {module: import_cost(module) for module in (modules or DEFAULT_MODULES)}
+
+    print(f"{'module':<20}{'total ms':>12}{'self ms':>12}")
+    ordered = sorted(results.items(), key=lambda item: -item[1].get("total_ms", -1))
+    for module, cost in ordered:
+        if "error" in cost:
+            print(f"{module:<20}{'-':>12}{'-':>12}  ({cost['error']})")
+        else:
+            print(f"{module:<20}{cost['total_ms']:>12.1f}{cost['self_ms']:>12.1f}")
+    return results
+
+
+if __name__ == "__main__":
+    profile_imports(sys.argv[1:] or None)
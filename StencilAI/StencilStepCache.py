@@ -0,0 +1,160 @@
+"""
+StencilStepCache - DeepCache-style reuse of deep UNet features across denoising steps
+
+Adjacent steps of a denoising schedule produce nearly the same high-level
+UNet features; most of the change between steps is in the shallow,
+full-resolution layers. With a reuse interval k, every k-th step runs the
+whole UNet and keeps the input of its last up block (the deep features
+from every lower level). The steps in between run only the shallow path:
+
+    conv_in -> down_blocks[0] -> up_blocks[-1] (cached deep features) -> conv_out
+
+For SD 1.x/2.x that skips three of the four resolution levels, which is
+most of the UNet's compute, at the price of slightly staler predictions.
+The binary stencil thresholding downstream absorbs most of the drift.
+
+Only plain text-conditioned UNet2DConditionModels are supported (no class,
+addition or image-hint embeddings).
+"""
+
+from types import SimpleNamespace
+
+from StencilStartup import lazy_import
+
+torch = lazy_import("torch")
+
+
+def _time_embed(unet, sample, timestep):
+    """Sinusoidal timestep embedding per batch row, as UNet2DConditionModel.get_time_embed()."""
+    if hasattr(unet, "get_time_embed"):
+        return unet.get_time_embed(sample=sample, timestep=timestep)
+    # Older diffusers releases compute it inline in forward()
+    timesteps = timestep
+    if not torch.is_tensor(timesteps):
+        dtype = torch.float32 if isinstance(timestep, float) else torch.int64
+        timesteps = torch.tensor([timesteps], dtype=dtype, device=sample.device)
+    elif timesteps.ndim == 0:
+        timesteps = timesteps[None].to(sample.device)
+    return unet.time_proj(timesteps.expand(sample.shape[0])).to(dtype=sample.dtype)
+
+
+def _encoder_states(unet, encoder_hidden_states):
+    """Project the text states if the UNet does, as UNet2DConditionModel.process_encoder_hidden_states()."""
+    if hasattr(unet, "process_encoder_hidden_states"):
+        return unet.process_encoder_hidden_states(encoder_hidden_states, None)
+    # Older diffusers releases; plain text-conditioned UNets at most apply a text projection
+    if getattr(unet, "encoder_hid_proj", None) is not None:
+        encoder_hidden_states = unet.encoder_hid_proj(encoder_hidden_states)
+    return encoder_hidden_states
+
+
+class StepCacheUNet:
+    """
+    UNet2DConditionModel stand-in that reuses deep features between full steps.
+
+    The denoising loop calls begin_step() before each step's UNet calls.
+    Calls within a step (one per CFG branch with sequential guidance) each
+    get their own cached features, so the loop calls reset() whenever it
+    changes which calls it makes (e.g. when guidance is dropped).
+    """
+
+    def __init__(self, unet, interval: int):
+        """
+        Wrap a UNet.
+
+        Args:
+            unet: UNet2DConditionModel to run
+            interval: Run the full UNet every this many steps (1 disables reuse)
+        """
+        config = unet.config
+        if unet.class_embedding is not None or config.addition_embed_type is not None or config.center_input_sample:
+            raise ValueError("The step cache supports plain text-conditioned UNets only")
+        if interval < 1:
+            raise ValueError(f"Step cache interval must be at least 1, got {interval}")
+
+        self.unet = unet
+        self.config = config
+        self.dtype = unet.dtype
+        self.interval = interval
+        self.full_steps = 0
+        self.cached_steps = 0
+        self._features = []  # Input of the last up block, per call slot within a step
+        self._full = True
+        self._slot = 0
+
+    def begin_step(self, index: int):
+        """
+        Start a denoising step.
+
+        Args:
+            index: Step index within the schedule (step 0 always runs the full UNet)
+        """
+        self._full = index % self.interval == 0
+        self._slot = 0
+        if self._full:
+            self.full_steps += 1
+        else:
+            self.cached_steps += 1
+
+    def reset(self):
+        """Forget the cached features, so the next call runs the full UNet."""
+        self._features = []
+
+    def __call__(self, sample, timestep, encoder_hidden_states):
+        slot = self._slot
+        self._slot += 1
+        if slot < len(self._features) and not self._full and self._features[slot].shape[0] == sample.shape[0]:
+            return SimpleNamespace(sample=self._shallow_forward(sample, timestep, encoder_hidden_states, self._features[slot]))
+
+        noise_pred, features = self._full_forward(sample, timestep, encoder_hidden_states)
+        if slot < len(self._features):
+            self._features[slot] = features
+        else:
+            self._features.append(features)
+        return SimpleNamespace(sample=noise_pred)
+
+    def _full_forward(self, sample, timestep, encoder_hidden_states):
+        """Run the whole UNet, capturing the input of its last up block."""
+        captured = {}
+
+        def capture(module, args, kwargs):
+            captured["features"] = kwargs["hidden_states"] if "hidden_states" in kwargs else args[0]
+
+        handle = self.unet.up_blocks[-1].register_forward_pre_hook(capture, with_kwargs=True)
+        try:
+            noise_pred = self.unet(sample, timestep, encoder_hidden_states=encoder_hidden_states).sample
+        finally:
+            handle.remove()
+        return noise_pred, captured["features"]
+
+    def _shallow_forward(self, sample, timestep, encoder_hidden_states, features):
+        """Run the outermost resolution level only, with cached features from the levels below."""
+        unet = self.unet
+        emb = unet.time_embedding(_time_embed(unet, sample, timestep), None)
+        if unet.time_embed_act is not None:
+            emb = unet.time_embed_act(emb)
+        encoder_hidden_states = _encoder_states(unet, encoder_hidden_states)
+
+        sample = unet.conv_in(sample)
+        down_block = unet.down_blocks[0]
+        if getattr(down_block, "has_cross_attention", False):
+            _, res_samples = down_block(hidden_states=sample, temb=emb, encoder_hidden_states=encoder_hidden_states)
+        else:
+            _, res_samples = down_block(hidden_states=sample, temb=emb)
+
+        # The last up block consumes the conv_in output and the first skips of down_blocks[0]
+        up_block = unet.up_blocks[-1]
+        res_samples = ((sample,) + res_samples)[:len(up_block.resnets)]
+        if getattr(up_block, "has_cross_attention", False):
+            sample = up_block(
+                hidden_states=features,
+                temb=emb,
+                res_hidden_states_tuple=res_samples,
+                encoder_hidden_states=encoder_hidden_states,
+            )
+        else:
+            sample = up_block(hidden_states=features, temb=emb, res_hidden_states_tuple=res_samples)
+
+        if unet.conv_norm_out:
+            sample = unet.conv_act(unet.conv_norm_out(sample))
+        return unet.conv_out(sample)
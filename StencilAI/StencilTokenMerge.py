@@ -0,0 +1,183 @@
+"""
+StencilTokenMerge - Token merging (ToMe) for the UNet's high-resolution self-attention
+
+Self-attention cost grows with the square of the token count, so at
+768-1024 px the highest-resolution transformer blocks dominate UNet time.
+Neighbouring latent pixels of a stencil (flat black or flat white areas)
+are largely redundant, so before each of those self-attention layers a
+fraction of the tokens is merged into similar ones, attention runs on the
+shorter sequence, and its output is copied back to the merged tokens
+(Bolya & Hoffman, "Token Merging for Fast Stable Diffusion", 2023):
+
+    1. Split tokens into destinations (one random token per 2x2 cell) and sources
+    2. Match each source to its most similar destination (cosine similarity)
+    3. Average the ratio * N best-matched sources into their destinations
+    4. Run the original attention processor on the remaining tokens
+    5. Unmerge: every merged source takes its destination's output
+
+The merging processors wrap the UNet's self-attention processors once and
+stay installed; they only merge during a TokenMergingUNet call, whose
+settings they read from a context variable. A UNet shared through a model
+pool can so run merged and unmerged calls concurrently, and a call never
+changes another call's processors. If the processors are replaced (e.g. a
+memory plan slicing attention), the next call wraps the new ones.
+"""
+
+import contextvars
+import math
+import threading
+from typing import Optional
+
+from StencilStartup import lazy_import
+
+torch = lazy_import("torch")
+
+STRIDE = 2  # Destination cells are STRIDE x STRIDE latent pixels
+
+# The TokenMergingUNet whose call is running in this thread (None: don't merge)
+_active = contextvars.ContextVar("token_merge_owner", default=None)
+_install_lock = threading.Lock()
+
+
+class _Merge:
+    """Bipartite soft matching of one token map: merge() shortens it, unmerge() restores it."""
+
+    def __init__(self, metric, height: int, width: int, ratio: float, generator):
+        batch, tokens, _ = metric.shape
+        device = metric.device
+        cells_h, cells_w = height // STRIDE, width // STRIDE
+        self.num_dst = cells_h * cells_w
+
+        # One random destination per cell; tokens outside whole cells stay sources
+        choice = torch.randint(STRIDE * STRIDE, (cells_h, cells_w, 1), generator=generator).to(device)
+        cell_view = torch.zeros(cells_h, cells_w, STRIDE * STRIDE, device=device, dtype=torch.int64)
+        cell_view.scatter_(2, choice, -1)
+        cell_view = cell_view.view(cells_h, cells_w, STRIDE, STRIDE).transpose(1, 2).reshape(cells_h * STRIDE, cells_w * STRIDE)
+        if cells_h * STRIDE < height or cells_w * STRIDE < width:
+            padded = torch.zeros(height, width, device=device, dtype=torch.int64)
+            padded[:cells_h * STRIDE, :cells_w * STRIDE] = cell_view
+            cell_view = padded
+        order = cell_view.reshape(1, -1, 1).argsort(dim=1)
+        self.dst_tokens = order[:, :self.num_dst, :]
+        self.src_tokens = order[:, self.num_dst:, :]
+
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        src, dst = self._split(metric)
+        scores = src @ dst.transpose(-1, -2)
+
+        self.r = min(src.shape[1], int(tokens * ratio))
+        best, best_dst = scores.max(dim=-1)
+        ranked = best.argsort(dim=-1, descending=True)[..., None]
+        self.unmerged = ranked[..., self.r:, :]
+        self.merged = ranked[..., :self.r, :]
+        self.merged_dst = best_dst[..., None].gather(dim=-2, index=self.merged)
+        self.batch, self.tokens = batch, tokens
+
+    def _split(self, x):
+        channels = x.shape[-1]
+        src = x.gather(dim=1, index=self.src_tokens.expand(x.shape[0], -1, channels))
+        dst = x.gather(dim=1, index=self.dst_tokens.expand(x.shape[0], -1, channels))
+        return src, dst
+
+    def merge(self, x):
+        src, dst = self._split(x)
+        batch, sources, channels = src.shape
+        kept = src.gather(dim=-2, index=self.unmerged.expand(batch, sources - self.r, channels))
+        src = src.gather(dim=-2, index=self.merged.expand(batch, self.r, channels))
+        dst = dst.scatter_reduce(-2, self.merged_dst.expand(batch, self.r, channels), src, reduce="mean")
+        return torch.cat([kept, dst], dim=1)
+
+    def unmerge(self, x):
+        kept_count = self.unmerged.shape[1]
+        kept, dst = x[..., :kept_count, :], x[..., kept_count:, :]
+        batch, _, channels = kept.shape
+        src = dst.gather(dim=-2, index=self.merged_dst.expand(batch, self.r, channels))
+
+        out = torch.zeros(batch, self.tokens, channels, device=x.device, dtype=x.dtype)
+        src_tokens = self.src_tokens.expand(batch, -1, 1)
+        out.scatter_(-2, self.dst_tokens.expand(batch, self.num_dst, channels), dst)
+        out.scatter_(-2, src_tokens.gather(dim=1, index=self.unmerged).expand(batch, kept_count, channels), kept)
+        out.scatter_(-2, src_tokens.gather(dim=1, index=self.merged).expand(batch, self.r, channels), src)
+        return out
+
+
+class TokenMergeProcessor:
+    """Attention processor wrapper merging tokens around a self-attention layer during merged calls."""
+
+    def __init__(self, processor):
+        self.processor = processor
+
+    def __call__(self, attn, hidden_states, encoder_hidden_states=None, attention_mask=None, **kwargs):
+        owner = _active.get()
+        size = None
+        if owner is not None and encoder_hidden_states is None and hidden_states.ndim == 3:
+            size = owner.token_map_size(hidden_states.shape[1])
+        if size is None:
+            return self.processor(attn, hidden_states, encoder_hidden_states, attention_mask, **kwargs)
+
+        merge = _Merge(hidden_states, *size, owner.ratio, owner.generator)
+        output = self.processor(attn, merge.merge(hidden_states), None, attention_mask, **kwargs)
+        return merge.unmerge(output)
+
+
+class TokenMergingUNet:
+    """
+    UNet2DConditionModel stand-in that runs with token merging in its self-attention.
+
+    Wraps the callable that runs the UNet (the module itself, or a
+    StepCacheUNet around it); module is the UNet whose self-attention
+    processors get wrapped (once, shared by all wrappers of that UNet).
+    """
+
+    def __init__(self, unet, module, ratio: float, max_downsample: int = 1, seed: int = 0):
+        """
+        Wrap a UNet.
+
+        Args:
+            unet: Callable running the UNet
+            module: The UNet2DConditionModel inside it
+            ratio: Fraction of each token map to merge away (0 to 0.75)
+            max_downsample: Merge in levels downsampled at most this much (1: highest resolution only)
+            seed: Seed for the destination choices, so seeded runs stay reproducible
+        """
+        if not 0 <= ratio <= 0.75:
+            raise ValueError(f"Token merge ratio must be between 0 and 0.75, got {ratio}")
+        self.unet = unet
+        self.module = module
+        self.config = module.config
+        self.dtype = module.dtype
+        self.ratio = ratio
+        self.max_downsample = max_downsample
+        self.generator = torch.Generator().manual_seed(seed)
+        self._latent_size = None
+        self._attentions = [
+            block.attn1 for block in module.modules()
+            if hasattr(block, "attn1") and hasattr(block, "attn2")
+        ]
+
+    def token_map_size(self, tokens: int) -> Optional[tuple]:
+        """Return the (height, width) of a token map of this many tokens, if it should be merged."""
+        height, width = self._latent_size
+        downsample = 1
+        while downsample <= self.max_downsample:
+            size = (math.ceil(height / downsample), math.ceil(width / downsample))
+            if size[0] * size[1] == tokens:
+                return size
+            downsample *= 2
+        return None
+
+    def _install(self):
+        """Wrap any self-attention processor that isn't wrapped yet (never twice)."""
+        with _install_lock:
+            for attn in self._attentions:
+                if not isinstance(attn.processor, TokenMergeProcessor):
+                    attn.processor = TokenMergeProcessor(attn.processor)
+
+    def __call__(self, sample, timestep, encoder_hidden_states):
+        self._latent_size = tuple(sample.shape[-2:])
+        self._install()
+        active = _active.set(self)
+        try:
+            return self.unet(sample, timestep, encoder_hidden_states=encoder_hidden_states)
+        finally:
+            _active.reset(active)
@@ -3,63 +3,234 @@ Gradio Web Interface for Stencil Image Generator
 
 This module provides a web-based UI for the Stencil Generator using Gradio.
 Run this file to launch the interactive web interface.
+
+gradio and torch are imported lazily, and the default model is loaded by a
+background warm-up thread once the UI is being built, so the server starts
+accepting connections without waiting for the model.
 """
 
-import gradio as gr
-from Stencil import StencilGenerator
+from __future__ import annotations
+
+from Stencil import StencilGenerator, ModelPool, CancellationToken, GenerationCancelled, GenerationRequest, LatentCache, RESULT_ID_KEY, STEPS_RUN_KEY, DEFAULT_TINY_VAE, DEFAULT_ONNX_DIR, DEFAULT_COMPILE_DIR
+from StencilBatcher import DynamicBatcher
+from StencilCache import ResultCache
 from StencilCV import StencilCV
-import torch
+from StencilMetrics import metrics
+from StencilSchedulers import DEFAULT_PROFILE_PATH, SchedulerProfiles
+from StencilStartup import lazy_import
 from typing import Optional
 import numpy as np
+import asyncio
 import os
+import threading
+from collections import OrderedDict
+
+gr = lazy_import("gradio")
+torch = lazy_import("torch")
 
 MAX_IMAGES = 4
+MAX_RESIDENT_UNETS = 2  # Fine-tuned UNets kept loaded for fast model switching
+UNET_MEMORY_BUDGET_MB = None  # Optional cap on memory used by resident UNets
+BATCH_WINDOW_MS = 100  # How long to wait for concurrent requests to batch together
+MAX_BATCH_IMAGES = 8  # Maximum images per batched UNet run
+MAX_CONCURRENT_REQUESTS = 4  # Gradio requests allowed to wait in the batcher at once
+LATENT_CACHE_SIZE = 64  # Recent results whose final latents are kept for cheap variations
+RESULT_CACHE_DIR = os.environ.get("STENCIL_CACHE_DIR", ".stencil_cache")
+RESULT_CACHE_MAX_MB = 512  # Disk budget for cached seeded results
+FAST_LOAD_DIR = os.environ.get("STENCIL_FAST_LOAD_DIR")  # Fused fast-load artifacts (None to disable)
+DECODER = os.environ.get("STENCIL_DECODER", "full")  # "tiny" decodes with a distilled AutoencoderTiny
+TINY_VAE_PATH = os.environ.get("STENCIL_TINY_VAE_PATH", DEFAULT_TINY_VAE)  # Local path or model ID of the tiny decoder
+MEMORY_BUDGET_MB = float(os.environ["STENCIL_MEMORY_BUDGET_MB"]) if os.environ.get("STENCIL_MEMORY_BUDGET_MB") else None  # VRAM/RSS cap per generation
+CPU_PRECISION = os.environ.get("STENCIL_CPU_PRECISION", "fp32")  # "bf16", "int8" or "int8-bf16" for cheaper CPU inference
+ENGINE = os.environ.get("STENCIL_ENGINE", "torch")  # "compile" uses torch.compile, "onnx" ONNX Runtime (CPU)
+ONNX_DIR = os.environ.get("STENCIL_ONNX_DIR", DEFAULT_ONNX_DIR)  # Exported ONNX graphs, keyed by weights hash
+COMPILE_DIR = os.environ.get("STENCIL_COMPILE_DIR", DEFAULT_COMPILE_DIR)  # Persistent torch.compile cache
+GUIDANCE_SCHEDULE = os.environ.get("STENCIL_GUIDANCE_SCHEDULE", "full")  # "truncate", "adaptive" or "off" to skip unconditional UNet passes
+GUIDANCE_CUTOFF = float(os.environ["STENCIL_GUIDANCE_CUTOFF"]) if os.environ.get("STENCIL_GUIDANCE_CUTOFF") else None  # Truncation fraction / adaptive similarity
+STEP_CACHE_INTERVAL = int(os.environ.get("STENCIL_STEP_CACHE_INTERVAL", "1"))  # Full UNet every N steps, deep features reused between
+TOKEN_MERGE_RATIO = float(os.environ.get("STENCIL_TOKEN_MERGE_RATIO", "0"))  # Fraction of high-res attention tokens merged (ToMe)
+SCHEDULER = os.environ.get("STENCIL_SCHEDULER")  # Key of StencilSchedulers.SCHEDULERS (None for each model's default)
+SCHEDULER_PROFILES = os.environ.get("STENCIL_SCHEDULER_PROFILES", DEFAULT_PROFILE_PATH)  # Recommended steps for the fast preset
+PREVIEW_EVERY = 3  # Denoising steps between live previews
+CONVERGENCE_TOLERANCE = 0.002  # Stencil pixel fraction that may still change when adaptive steps stop early
+DEFAULT_MODEL_TYPE = "Checkpoint-1000"
+WARMUP_ON_START = os.environ.get("STENCIL_WARMUP", "1") != "0"  # Load the default model in the background at startup
+WARMUP_SIZE = 256  # Image size of the dummy warm-up generation
+WARMUP_STEPS = 2  # Denoising steps of the dummy warm-up generation
+# Compile engine buckets compiled during warm-up: the UI's default size and number of images
+# (other buckets compile on first use, then come from the compile cache)
+PRECOMPILE_RESOLUTION = (512, 512)
+PRECOMPILE_IMAGES = 2
 
 class StencilApp:
     """Wrapper class for the Gradio application."""
 
     def __init__(self):
         """Initialize the Stencil Generator."""
-        self.generator = None
-        self.current_model_type = None
-        self.original_images = []  # Store original images for toggling
-        self.outlined_status = []  # Track which images have outline applied
+        # One generator per model type, so concurrent users of different models don't
+        # replace each other's; least recently used ones are dropped like pooled UNets
+        self.generators = OrderedDict()
+        # Shared components and recently used UNets for the fine-tuned checkpoints,
+        # created on first model load so building the UI doesn't import torch
+        self.model_pool = None
+        self._load_lock = threading.Lock()
+        self.warmup_thread = None
+        # Collects concurrent requests into shared denoising runs
+        self.batcher = DynamicBatcher(window_ms=BATCH_WINDOW_MS, max_batch_images=MAX_BATCH_IMAGES)
+        # Seeded generations are deterministic, so their results are cached and shared
+        self.result_cache = ResultCache(cache_dir=RESULT_CACHE_DIR, max_disk_mb=RESULT_CACHE_MAX_MB)
+        # Profiled minimal step counts per model and scheduler, for the fast preset
+        self.scheduler_profiles = SchedulerProfiles(SCHEDULER_PROFILES)
+        # Final latents of recent results, shared across model switches, for variations
+        self.latent_cache = LatentCache(maxsize=LATENT_CACHE_SIZE)
+        # Cancellation tokens of running generations, by browser session
+        self.active_requests = {}
 
     def load_model(self, model_type: str = "Standard SD 2.1"):
         """
-        Lazy load the model when first needed or reload if model type changed.
+        Get the generator of a model type, loading it when first needed.
+
+        Fine-tuned checkpoints are assembled from the model pool, so switching
+        between them only reloads a UNet if it has been evicted. Up to
+        MAX_RESIDENT_UNETS generators stay loaded; dropping one doesn't
+        affect requests still running on it.
 
         Args:
             model_type: Type of model to load ("Standard SD 2.1", "Checkpoint-500", "Checkpoint-1000")
         """
-        # Reload if model type changed or first load
-        if self.generator is None or self.current_model_type != model_type:
-            print(f"Initializing Stencil Generator with {model_type}...")
-
-            # Determine checkpoint path based on model type
-            # Can be local path or HuggingFace Hub model ID
-            checkpoint_path = None
-            if model_type == "Checkpoint-500":
-                # Try local path first, fallback to HuggingFace Hub
-                checkpoint_path = "./Fine-tuning/checkpoint-500"
-                if not os.path.exists(checkpoint_path):
-                    checkpoint_path = "mrpink925/stencilai-checkpoint-500"
-            elif model_type == "Checkpoint-1000":
-                # Try local path first, fallback to HuggingFace Hub
-                checkpoint_path = "./Fine-tuning/checkpoint-1000"
-                if not os.path.exists(checkpoint_path):
-                    checkpoint_path = "mrpink925/stencilai-checkpoint-1000"
-
-            self.generator = StencilGenerator(
-                model_id="Manojb/stable-diffusion-2-1-base",
-                checkpoint_path=checkpoint_path,
-                use_fp16=torch.cuda.is_available()
-            )
-            self.current_model_type = model_type
-
-        return self.generator
-
-    def generate_stencil(
+        # Serialized so the warm-up thread and early requests don't load the model twice
+        with self._load_lock:
+            if self.model_pool is None:
+                self.model_pool = ModelPool(
+                    max_unets=MAX_RESIDENT_UNETS,
+                    memory_budget_mb=UNET_MEMORY_BUDGET_MB,
+                    use_fp16=torch.cuda.is_available(),
+                    fast_load_dir=FAST_LOAD_DIR
+                )
+
+            if model_type in self.generators:
+                self.generators.move_to_end(model_type)
+            else:
+                print(f"Initializing Stencil Generator with {model_type}...")
+
+                # Determine checkpoint path based on model type
+                # Can be local path or HuggingFace Hub model ID
+                checkpoint_path = None
+                if model_type == "Checkpoint-500":
+                    # Try local path first, fallback to HuggingFace Hub
+                    checkpoint_path = "./Fine-tuning/checkpoint-500"
+                    if not os.path.exists(checkpoint_path):
+                        checkpoint_path = "mrpink925/stencilai-checkpoint-500"
+                elif model_type == "Checkpoint-1000":
+                    # Try local path first, fallback to HuggingFace Hub
+                    checkpoint_path = "./Fine-tuning/checkpoint-1000"
+                    if not os.path.exists(checkpoint_path):
+                        checkpoint_path = "mrpink925/stencilai-checkpoint-1000"
+
+                self.generators[model_type] = StencilGenerator(
+                    model_id="Manojb/stable-diffusion-2-1-base",
+                    checkpoint_path=checkpoint_path,
+                    use_fp16=torch.cuda.is_available(),
+                    model_pool=self.model_pool,
+                    result_cache=self.result_cache,
+                    fast_load_dir=FAST_LOAD_DIR,
+                    decoder=DECODER,
+                    tiny_vae_path=TINY_VAE_PATH,
+                    memory_budget_mb=MEMORY_BUDGET_MB,
+                    cpu_precision=CPU_PRECISION,
+                    engine=ENGINE,
+                    onnx_dir=ONNX_DIR,
+                    compile_dir=COMPILE_DIR,
+                    step_cache_interval=STEP_CACHE_INTERVAL,
+                    token_merge_ratio=TOKEN_MERGE_RATIO,
+                    scheduler=SCHEDULER,
+                    scheduler_profiles=self.scheduler_profiles,
+                    latent_cache=self.latent_cache
+                )
+                # Evicting the pool's UNet frees nothing while a generator still holds it
+                while len(self.generators) > MAX_RESIDENT_UNETS:
+                    self.generators.popitem(last=False)
+
+            return self.generators[model_type]
+
+    def warmup(self, model_type: str = DEFAULT_MODEL_TYPE):
+        """
+        Load a model and run one tiny dummy generation.
+
+        The first real request then skips model loading and the one-off
+        costs of the first forward pass (kernel selection, allocator growth).
+        With the compile engine, the buckets of a default request
+        (PRECOMPILE_RESOLUTION, up to PRECOMPILE_IMAGES images) are compiled
+        here too.
+
+        Args:
+            model_type: Model to load
+        """
+        try:
+            with metrics.stage("warmup", model=model_type):
+                generator = self.load_model(model_type)
+                request = GenerationRequest(prompt="warm up", seed=0, clean_background=False)
+                generator.generate_batch(
+                    [request],
+                    num_inference_steps=WARMUP_STEPS,
+                    width=WARMUP_SIZE,
+                    height=WARMUP_SIZE
+                )
+                generator.precompile(resolutions=[PRECOMPILE_RESOLUTION], max_images=PRECOMPILE_IMAGES)
+            print(f"Warm-up complete for {model_type}")
+        except Exception as e:
+            print(f"Warm-up failed: {e}")
+
+    def start_warmup(self, model_type: str = DEFAULT_MODEL_TYPE) -> threading.Thread:
+        """
+        Run warmup() on a background thread so the UI can serve meanwhile.
+
+        Requests that arrive before it finishes wait for the model load
+        instead of starting a second one.
+
+        Args:
+            model_type: Model to load
+
+        Returns:
+            The warm-up thread
+        """
+        self.warmup_thread = threading.Thread(
+            target=self.warmup, args=(model_type,), name="stencil-warmup", daemon=True
+        )
+        self.warmup_thread.start()
+        return self.warmup_thread
+
+    def metrics_summary(self) -> dict:
+        """
+        Get per-stage latency histograms and peak memory since startup.
+
+        Returns:
+            Dictionary mapping stage name to its statistics
+        """
+        return metrics.summary()
+
+    def _start_request(self, session: Optional[gr.Request]) -> CancellationToken:
+        """
+        Register a new generation for a browser session, cancelling its previous one.
+
+        Pressing generate again abandons the run the user is no longer waiting for.
+        """
+        token = CancellationToken()
+        session_id = session.session_hash if session is not None else None
+        if session_id is not None:
+            previous = self.active_requests.get(session_id)
+            if previous is not None:
+                previous.cancel()
+            self.active_requests[session_id] = token
+        return token
+
+    def _finish_request(self, session: Optional[gr.Request], token: CancellationToken):
+        """Forget a session's generation once it has finished."""
+        session_id = session.session_hash if session is not None else None
+        if session_id is not None and self.active_requests.get(session_id) is token:
+            del self.active_requests[session_id]
+
+    async def generate_stencil(
         self,
         prompt: str,
         model_type: str,
@@ -72,48 +243,196 @@ class StencilApp:
         seed: int,
         use_seed: bool,
         add_stencil_suffix: bool,
-        clean_background: bool
+        clean_background: bool,
+        live_preview: bool = False,
+        adaptive_steps: bool = False,
+        fast_preset: bool = False,
+        original_images: Optional[list] = None,
+        outlined_status: Optional[list] = None,
+        session: gr.Request = None
     ):
         """
         Generate stencil images based on user inputs.
 
-        This is the main function called by the Gradio interface.
+        This is the main function called by the Gradio interface. It yields
+        updates so that, with live preview enabled, the gallery shows a rough
+        stencil every few denoising steps before the final result.
+
+        Generation is cancellable: if the client disconnects (Gradio cancels
+        this coroutine) or the same session presses generate again, the
+        running generation stops before its next denoising step.
+
+        The fast preset ignores the steps slider and runs the step count
+        profiled for the model and its scheduler.
+
+        The session's original images and outline status (gr.State) are
+        passed through and replaced by the new results.
         """
         if not prompt or prompt.strip() == "":
-            return [], "Please enter a prompt!"
+            yield [], "Please enter a prompt!", original_images, outlined_status
+            return
+
+        token = self._start_request(session)
+        # Times the whole request; stages run on its behalf (in any thread) carry its id
+        with metrics.request(
+            "generate_stencil",
+            model=model_type,
+            num_images=int(num_images),
+            steps=int(num_inference_steps),
+            width=int(width),
+            height=int(height),
+            live_preview=live_preview,
+        ):
+            try:
+                # Load model (will reload if model type changed)
+                generator = await asyncio.to_thread(self.load_model, model_type)
+
+                # Guidance can only be skipped entirely when there is no negative prompt to honour
+                guidance_schedule = GUIDANCE_SCHEDULE
+                if guidance_schedule == "off" and (negative_prompt or not generator.is_checkpoint_model):
+                    guidance_schedule = "full"
+
+                kwargs = dict(
+                    prompt=prompt,
+                    negative_prompt=negative_prompt if negative_prompt else None,
+                    num_images=int(num_images),
+                    num_inference_steps=int(num_inference_steps),
+                    guidance_scale=guidance_scale,
+                    width=int(width),
+                    height=int(height),
+                    seed=int(seed) if use_seed else None,
+                    add_stencil_suffix=add_stencil_suffix,
+                    clean_background=clean_background,
+                    adaptive_steps=adaptive_steps,
+                    convergence_tolerance=CONVERGENCE_TOLERANCE,
+                    guidance_schedule=guidance_schedule,
+                    guidance_cutoff=GUIDANCE_CUTOFF,
+                    quality_preset="fast" if fast_preset else "custom",
+                    cancel_token=token
+                )
 
-        try:
-            # Load model (will reload if model type changed)
-            generator = self.load_model(model_type)
-
-            # Generate the image(s)
-            images = generator.generate(
-                prompt=prompt,
-                negative_prompt=negative_prompt if negative_prompt else None,
-                num_images=num_images,
-                num_inference_steps=num_inference_steps,
-                guidance_scale=guidance_scale,
-                width=width,
-                height=height,
-                seed=seed if use_seed else None,
-                add_stencil_suffix=add_stencil_suffix,
-                clean_background=clean_background
-            )
-
-            # Ensure images is a list
-            if not isinstance(images, list):
-                images = [images]
-
-            # Store original images and reset outlined status
-            self.original_images = [img.copy() for img in images]
-            self.outlined_status = [False] * len(images)
-
-            return images, f"Generation successful! Created {len(images)} image(s)."
+                if live_preview:
+                    # Stream cheap previews straight from the denoising loop, stepped
+                    # on the generator's bounded executor to keep the event loop free
+                    async for update in generator.agenerate_stream(preview_every=PREVIEW_EVERY, **kwargs):
+                        if update.final:
+                            images = update.images
+                        else:
+                            yield (
+                                update.images,
+                                f"Denoising... step {update.step}/{update.total_steps}",
+                                original_images,
+                                outlined_status,
+                            )
+                else:
+                    # Batched with any concurrent requests; identical seeded requests
+                    # are served from (or wait on) the result cache
+                    images = await generator.agenerate(batcher=self.batcher, **kwargs)
+
+                steps_note = ""
+                if fast_preset:
+                    steps_note = f" Fast preset: {min(generator.recommended_steps(), int(num_inference_steps))} steps."
+                steps_run = images[0].info.get(STEPS_RUN_KEY) if images else None
+                if adaptive_steps and steps_run is not None:
+                    steps_note = f" Stencil settled after {steps_run} steps."
+
+                # Store original images and reset outlined status
+                yield (
+                    images,
+                    f"Generation successful! Created {len(images)} image(s).{steps_note}",
+                    [img.copy() for img in images],
+                    [False] * len(images),
+                )
 
-        except Exception as e:
-            return [], f"Error: {str(e)}"
+            except GenerationCancelled:
+                yield [], "Generation cancelled.", original_images, outlined_status
+            except Exception as e:
+                yield [], f"Error: {str(e)}", original_images, outlined_status
+            finally:
+                # Stops the worker if we were cancelled or closed mid-run; harmless once finished
+                token.cancel()
+                self._finish_request(session, token)
+
+    async def vary_stencil(
+        self,
+        gallery_data,
+        selected_index,
+        model_type: str,
+        strength: float,
+        num_variations: int,
+        original_images: Optional[list] = None,
+        outlined_status: Optional[list] = None,
+        session: gr.Request = None
+    ):
+        """
+        Generate variations of the selected image from its cached latents.
+
+        Only the last part of the denoising schedule is re-run (about
+        strength times the original steps), so this is much cheaper than a
+        new generation. The variations replace the gallery and can be varied
+        in turn.
+
+        Args:
+            gallery_data: Gallery data from Gradio (list of images or tuples)
+            selected_index: Index of the selected image (from gr.Gallery select event)
+            model_type: Model selected in the UI (must be the one that generated the image)
+            strength: How far to re-noise the image (0 to 1)
+            num_variations: Number of variations to generate
+            original_images: The session's original images (gr.State)
+            outlined_status: The session's outline status per image (gr.State)
 
-    def apply_outline(self, gallery_data, selected_index):
+        Returns:
+            Updated gallery, status message, original images and outline status
+        """
+        original_images = original_images or []
+        unchanged = (original_images, outlined_status)
+        if not gallery_data:
+            return (gallery_data, "No images to vary!") + unchanged
+
+        # If there's only 1 image and no selection, default to index 0
+        if selected_index is None:
+            if len(original_images) == 1:
+                selected_index = 0
+            else:
+                return (gallery_data, "Please select an image first by clicking on it!") + unchanged
+
+        if selected_index >= len(original_images):
+            return (gallery_data, "Error: Image index out of range!") + unchanged
+
+        result_id = original_images[selected_index].info.get(RESULT_ID_KEY)
+        if result_id is None:
+            return (gallery_data, "This image can't be varied; generate it again to vary it.") + unchanged
+
+        token = self._start_request(session)
+        with metrics.request("vary_stencil", model=model_type, strength=float(strength), num_images=int(num_variations)):
+            try:
+                generator = await asyncio.to_thread(self.load_model, model_type)
+                images = await asyncio.to_thread(
+                    generator.vary,
+                    result_id,
+                    strength=float(strength),
+                    num_images=int(num_variations),
+                    cancel_token=token
+                )
+                if not isinstance(images, list):
+                    images = [images]
+
+                status = (
+                    f"Created {len(images)} variation(s) of image {selected_index + 1} "
+                    f"in {images[0].info.get(STEPS_RUN_KEY)} steps."
+                )
+                return images, status, [img.copy() for img in images], [False] * len(images)
+            except KeyError:
+                return (gallery_data, "This image is no longer cached; generate it again to vary it.") + unchanged
+            except GenerationCancelled:
+                return (gallery_data, "Variation cancelled.") + unchanged
+            except Exception as e:
+                return (gallery_data, f"Error: {str(e)}") + unchanged
+            finally:
+                token.cancel()
+                self._finish_request(session, token)
+
+    def apply_outline(self, gallery_data, selected_index, original_images=None, outlined_status=None):
         """
         Toggle outline processing on a selected image using StencilCV.
         If the image has outline applied, revert to original. Otherwise, apply outline.
@@ -121,39 +440,43 @@ class StencilApp:
         Args:
             gallery_data: Gallery data from Gradio (list of images or tuples)
             selected_index: Index of the selected image (from gr.Gallery select event)
+            original_images: The session's original images (gr.State)
+            outlined_status: The session's outline status per image (gr.State)
 
         Returns:
-            Updated gallery and status message
+            Updated gallery, status message and outline status
         """
+        original_images = original_images or []
+        outlined_status = list(outlined_status or [False] * len(original_images))
         # print(f"DEBUG: apply_outline called")
         # print(f"DEBUG: gallery_data type: {type(gallery_data)}")
         # print(f"DEBUG: gallery_data length: {len(gallery_data) if gallery_data else 0}")
         # print(f"DEBUG: selected_index: {selected_index}")
 
         if not gallery_data:
-            return gallery_data, "No images to process!"
+            return gallery_data, "No images to process!", outlined_status
 
         # If there's only 1 image and no selection, default to index 0
         if selected_index is None:
-            if len(self.original_images) == 1:
+            if len(original_images) == 1:
                 selected_index = 0
             else:
-                return gallery_data, "Please select an image first by clicking on it!"
+                return gallery_data, "Please select an image first by clicking on it!", outlined_status
 
-        if selected_index >= len(self.original_images):
-            return gallery_data, "Error: Image index out of range!"
+        if selected_index >= len(original_images):
+            return gallery_data, "Error: Image index out of range!", outlined_status
 
         try:
             # Create a copy of the gallery data
             updated_gallery = list(gallery_data)
 
             # Check if this image already has outline applied
-            if self.outlined_status[selected_index]:
+            if outlined_status[selected_index]:
                 # Revert to original
                 # print(f"DEBUG: Reverting image {selected_index} to original")
-                updated_gallery[selected_index] = self.original_images[selected_index].copy()
-                self.outlined_status[selected_index] = False
-                return updated_gallery, f"Reverted image {selected_index + 1} to original."
+                updated_gallery[selected_index] = original_images[selected_index].copy()
+                outlined_status[selected_index] = False
+                return updated_gallery, f"Reverted image {selected_index + 1} to original.", outlined_status
             else:
                 # Apply outline
                 # print(f"DEBUG: Applying outline to image {selected_index}")
@@ -162,30 +485,42 @@ class StencilApp:
                 processor = StencilCV()
 
                 # Get the original image (not the gallery one, to ensure consistency)
-                original_img = self.original_images[selected_index]
+                original_img = original_images[selected_index]
 
                 # print(f"DEBUG: Applying edge_stencil...")
                 # Apply outline to the original image
-                outlined = processor.edge_stencil(original_img)
+                with metrics.request("apply_outline"):
+                    outlined = processor.edge_stencil(original_img)
                 # print(f"DEBUG: Outline applied successfully!")
 
                 # Update gallery with outlined version
                 updated_gallery[selected_index] = outlined
-                self.outlined_status[selected_index] = True
+                outlined_status[selected_index] = True
 
-                return updated_gallery, f"Applied outline to image {selected_index + 1}. Click again to revert."
+                return (
+                    updated_gallery,
+                    f"Applied outline to image {selected_index + 1}. Click again to revert.",
+                    outlined_status,
+                )
 
         except Exception as e:
             import traceback
             print("DEBUG: Exception occurred:")
             traceback.print_exc()
-            return gallery_data, f"Error applying outline: {str(e)}"
+            return gallery_data, f"Error applying outline: {str(e)}", outlined_status
+
 
+def create_interface(warmup: bool = False):
+    """
+    Create and configure the Gradio interface.
 
-def create_interface():
-    """Create and configure the Gradio interface."""
+    Args:
+        warmup: Start loading the default model in the background right away
+    """
 
     app = StencilApp()
+    if warmup:
+        app.start_warmup(DEFAULT_MODEL_TYPE)
 
     # Define the interface
     with gr.Blocks(title="Stencil Image Generator", theme=gr.themes.Soft()) as interface:
@@ -210,7 +545,7 @@ def create_interface():
 
                 model_selector = gr.Radio(
                     choices=["Standard SD 2.1", "Checkpoint-500", "Checkpoint-1000"],
-                    value="Checkpoint-1000",
+                    value=DEFAULT_MODEL_TYPE,
                     label="Model Type",
                     info="Choose between standard model or fine-tuned checkpoints (trained on sketch-style images)"
                 )
@@ -243,6 +578,24 @@ def create_interface():
                         info="Post-process to ensure pure white background and remove artifacts"
                     )
 
+                    live_preview = gr.Checkbox(
+                        label="Live preview",
+                        value=True,
+                        info="Show a rough stencil every few steps while generating"
+                    )
+
+                    adaptive_steps = gr.Checkbox(
+                        label="Adaptive steps",
+                        value=False,
+                        info="Stop denoising early once the black/white stencil stops changing"
+                    )
+
+                    fast_preset = gr.Checkbox(
+                        label="Fast preset",
+                        value=False,
+                        info="Use the fewest steps profiled to give a stable stencil for this model (at most Inference Steps)"
+                    )
+
                     num_inference_steps = gr.Slider(
                         minimum=10,
                         maximum=50,
@@ -325,6 +678,9 @@ def create_interface():
 
                 # Hidden state to track selected image
                 selected_image_index = gr.State(value=None)
+                # Per-session original images (for toggling outlines and varying) and outline status
+                original_images = gr.State(value=[])
+                outlined_status = gr.State(value=[])
 
                 # Post-processing section
                 with gr.Accordion("Post-Processing Options", open=False):
@@ -339,6 +695,34 @@ def create_interface():
                     )
                     apply_outline_btn = gr.Button("Toggle Outline on Selected Image", variant="secondary")
 
+                with gr.Accordion("Variations", open=False):
+                    gr.Markdown(
+                        """
+                        **Variations**: Click an image above to select it, then generate variations of it.
+                        Only the last part of the denoising is re-run, so this is much faster than a new
+                        generation. Low strength keeps the silhouette; high strength changes more.
+                        """
+                    )
+                    variation_strength = gr.Slider(
+                        minimum=0.1,
+                        maximum=1.0,
+                        value=0.5,
+                        step=0.05,
+                        label="Variation Strength"
+                    )
+                    num_variations = gr.Slider(
+                        minimum=1,
+                        maximum=MAX_IMAGES,
+                        value=2,
+                        step=1,
+                        label="Number of Variations"
+                    )
+                    vary_btn = gr.Button("Vary Selected Image", variant="secondary")
+
+                with gr.Accordion("Performance Metrics", open=False):
+                    metrics_json = gr.JSON(label="Per-stage latency (ms) and peak memory (MB)")
+                    refresh_metrics_btn = gr.Button("Refresh Metrics", variant="secondary")
+
                 gr.Markdown(
                     """
                     ### Tips for Best Results:
@@ -348,6 +732,7 @@ def create_interface():
                     - Generate multiple images to see variations
                     - Use negative prompts to avoid unwanted features (works best with Standard SD 2.1)
                     - Try the outline option after generation for different styles
+                    - Use Variations to explore around a result you like, without starting over
                     - Higher inference steps = better quality (but slower)
                     """
                 )
@@ -367,9 +752,16 @@ def create_interface():
                 seed,
                 use_seed,
                 add_stencil_suffix,
-                clean_background
+                clean_background,
+                live_preview,
+                adaptive_steps,
+                fast_preset,
+                original_images,
+                outlined_status
             ],
-            outputs=[output_gallery, status_text]
+            outputs=[output_gallery, status_text, original_images, outlined_status],
+            # Let concurrent users reach the batcher instead of queueing one at a time
+            concurrency_limit=MAX_CONCURRENT_REQUESTS
         )
 
         # Track when user selects an image in the gallery
@@ -385,8 +777,29 @@ def create_interface():
         # Connect the outline button
         apply_outline_btn.click(
             fn=app.apply_outline,
-            inputs=[output_gallery, selected_image_index],
-            outputs=[output_gallery, status_text]
+            inputs=[output_gallery, selected_image_index, original_images, outlined_status],
+            outputs=[output_gallery, status_text, outlined_status]
+        )
+
+        # Connect the variations button
+        vary_btn.click(
+            fn=app.vary_stencil,
+            inputs=[
+                output_gallery,
+                selected_image_index,
+                model_selector,
+                variation_strength,
+                num_variations,
+                original_images,
+                outlined_status
+            ],
+            outputs=[output_gallery, status_text, original_images, outlined_status],
+            concurrency_limit=MAX_CONCURRENT_REQUESTS
+        )
+
+        refresh_metrics_btn.click(
+            fn=app.metrics_summary,
+            outputs=metrics_json
         )
 
         gr.Markdown(
@@ -414,7 +827,7 @@ def launch(
         server_port: Port to run the server on
         **kwargs: Additional arguments passed to gradio.launch()
     """
-    interface = create_interface()
+    interface = create_interface(warmup=WARMUP_ON_START)
     interface.launch(
         share=share,
         server_name=server_name,